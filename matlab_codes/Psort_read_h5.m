@@ -22,6 +22,12 @@ elseif (nargin < 1) && ~usejava('desktop')
 end
 
 ch_data = h5read(file_fullPath,'/ch_data');
+% ch_data saved as its native int16 samples carries its scale as an attribute
+ch_data_info = h5info(file_fullPath,'/ch_data');
+if isstruct(ch_data_info.Attributes) && any(strcmp({ch_data_info.Attributes.Name}, 'PSORT_SCALE'))
+    ch_data_scale = h5readatt(file_fullPath,'/ch_data','PSORT_SCALE');
+    ch_data = double(ch_data) * ch_data_scale(1) + ch_data_scale(2);
+end
 ch_time = h5read(file_fullPath,'/ch_time');
 sample_rate = h5read(file_fullPath,'/sample_rate');
 
@@ -66,6 +66,14 @@ for counter_variable = 1 : 1 : num_variables
     if contains(variable_name, 'LearnTemp_mode')
         variable_data = h5read(file_fullPath,[slot_name '/' variable_name]);
     end
+    % signals saved as their native int16 samples carry their scale as an attribute
+    if any(strcmp(variable_name, {'ch_data', 'ch_lfp'}))
+        variable_info = h5info(file_fullPath,[slot_name '/' variable_name]);
+        if isstruct(variable_info.Attributes) && any(strcmp({variable_info.Attributes.Name}, 'PSORT_SCALE'))
+            variable_scale = h5readatt(file_fullPath,[slot_name '/' variable_name],'PSORT_SCALE');
+            variable_data = double(variable_data) * variable_scale(1) + variable_scale(2);
+        end
+    end
     eval(['psortDataBase.' 'topLevel_data.' variable_name ...
         '=' 'variable_data' ';']);
 end
@@ -15,9 +15,6 @@ _workingDataBase = {
     "file_name": np.array([], dtype=np.unicode_),
     "file_ext": np.array([], dtype=np.unicode_),
     "file_name_without_ext": np.array([], dtype=np.unicode_),
-    "ch_data_cmn": np.zeros((0), dtype=np.float64),
-    "ch_data_all": np.zeros((0, 0), dtype=np.float64),
-    "ch_time": np.zeros((0), dtype=np.float64),
     "sample_rate": np.zeros((1), dtype=np.uint32),
 }
 _file_keys = [
@@ -74,24 +71,18 @@ class CommonAvgWidget(QtWidgets.QMainWindow):
         self.comboBx_avgMode = QtWidgets.QComboBox()
         lib.setFont(self.comboBx_avgMode)
         self.comboBx_avgMode.setEnabled(False)
-        self.comboBx_avgMode.addItems(["Mean", "Median"])
+        self.comboBx_avgMode.addItems(["Mean", "Median", "Trimmed Mean"])
         self.comboBx_avgMode.setCurrentIndex(1)
 
-        self.pushBtn_start = QtWidgets.QPushButton("Start")
+        self.pushBtn_start = QtWidgets.QPushButton("Start and Save")
         lib.setFont(self.pushBtn_start)
         self.pushBtn_start.setStyleSheet("Text-align:left")
         self.pushBtn_start.setEnabled(False)
 
-        self.pushBtn_save = QtWidgets.QPushButton("Save")
-        lib.setFont(self.pushBtn_save)
-        self.pushBtn_save.setStyleSheet("Text-align:left")
-        self.pushBtn_save.setEnabled(False)
-
         self.layout_grand.addWidget(self.widget_table)
         self.layout_grand.addLayout(self.layout_addRemove)
         self.layout_grand.addWidget(self.comboBx_avgMode)
         self.layout_grand.addWidget(self.pushBtn_start)
-        self.layout_grand.addWidget(self.pushBtn_save)
         self.layout_grand.setSpacing(1)
         self.layout_grand.setContentsMargins(1, 1, 1, 1)
         self.widget_grand = QtWidgets.QWidget()
@@ -105,10 +96,10 @@ class CommonAvgWidget(QtWidgets.QMainWindow):
 class CommonAvgSignals(CommonAvgWidget):
     def __init__(self, parent=None):
         super(CommonAvgSignals, self).__init__(parent)
-        self.loadData = lib.LoadData()
-        self.loadData.return_signal.connect(self.compute_cmn_iteration_finished)
-        self.saveData = lib.SaveData()
-        self.saveData.return_signal.connect(self.save_process_finished)
+        self.loadData = lib.CommonAverageData()
+        self.loadData.return_signal.connect(self.load_process_finished)
+        self.loadData.progress_signal.connect(self.load_process_progress)
+        self.loadData.block_signal.connect(self.load_process_block)
         self._workingDataBase = deepcopy(_workingDataBase)
         self.widget_table.itemSelectionChanged.connect(
             self.onTable_itemSelectionChanged
@@ -117,7 +108,6 @@ class CommonAvgSignals(CommonAvgWidget):
         self.pushBtn_remove.pressed.connect(self.onRemove_pressed)
         self.pushBtn_reset.pressed.connect(self.onReset_pressed)
         self.pushBtn_start.pressed.connect(self.onStart_pressed)
-        self.pushBtn_save.pressed.connect(self.onSave_pressed)
         self.label_statusBar.setText("Add file to the table")
         self.num_iteration = 0
         self.counter_iteration = 0
@@ -131,7 +121,6 @@ class CommonAvgSignals(CommonAvgWidget):
             self.pushBtn_reset.setEnabled(False)
             self.pushBtn_start.setEnabled(False)
             self.comboBx_avgMode.setEnabled(False)
-            self.pushBtn_save.setEnabled(False)
         else:
             self.pushBtn_remove.setEnabled(True)
         return 0
@@ -168,14 +157,11 @@ class CommonAvgSignals(CommonAvgWidget):
         self._workingDataBase = deepcopy(_workingDataBase)
         self.pushBtn_start.setEnabled(False)
         self.comboBx_avgMode.setEnabled(False)
-        self.pushBtn_save.setEnabled(False)
         return 0
 
     def onStart_pressed(self):
-        self.load_process_start()
-        return 0
-
-    def onSave_pressed(self):
+        # the average is written to the file block by block, so the file is asked for
+        # before the average is computed
         file_path = self._workingDataBase["file_path"][-1]
         if not (os.path.isdir(file_path)):
             file_path = os.getcwd()
@@ -183,14 +169,12 @@ class CommonAvgSignals(CommonAvgWidget):
             self, "Save DataBase", file_path, filter="h5 Data (*.h5)"
         )
         if file_fullPath == "":
-            self.pushBtn_save.setEnabled(False)
-            self.pushBtn_save.setEnabled(True)
             return 0
         _, file_path, _, file_ext, _ = lib.get_fullPath_components(file_fullPath)
         if not (file_ext == ".h5"):
             file_fullPath = file_fullPath + ".h5"
         if os.path.isdir(file_path):
-            self.save_process_start(file_fullPath)
+            self.load_process_start(file_fullPath)
         return 0
 
     def add_file_fullPath_array_to_table(self, file_fullPath_array):
@@ -216,88 +200,60 @@ class CommonAvgSignals(CommonAvgWidget):
         self.lastUsedPath = deepcopy(self._workingDataBase["file_path"][-1])
         return 0
 
-    def load_process_start(self):
+    def load_process_start(self, file_fullPath):
+        # the average is streamed one time block at a time across all the files,
+        # straight into file_fullPath, no whole channel is kept in memory
         self.num_iteration = self._workingDataBase["file_fullPath"].size
         self.counter_iteration = 0
-        self.compute_cmn_iteration_start()
+        self.loadData.file_fullPath_list = list(self._workingDataBase["file_fullPath"])
+        self.loadData.file_fullPath = file_fullPath
+        self.loadData.mode = lib.COMMON_AVERAGE_MODES[
+            self.comboBx_avgMode.currentIndex()
+        ]
+        self.loadData.start()
         self.label_statusBar.setText("Loading data ...")
-        self.progress_statusBar.setRange(0, 0)
+        self.progress_statusBar.setRange(0, self.num_iteration)
+        self.progress_statusBar.setValue(0)
         self.widget_grand.setEnabled(False)
         return 0
 
-    def load_process_finished(self):
-        if self.comboBx_avgMode.currentIndex() == 0:
-            self._workingDataBase["ch_data_cmn"] = self._workingDataBase[
-                "ch_data_cmn"
-            ] / float(self.num_iteration)
-        elif self.comboBx_avgMode.currentIndex() == 1:
-            self._workingDataBase["ch_data_cmn"] = np.median(
-                self._workingDataBase["ch_data_all"], axis=0
-            )
-        self.label_statusBar.setText("Loaded data.")
-        self.progress_statusBar.setRange(0, 1)
-        self.widget_grand.setEnabled(True)
-        self.pushBtn_save.setEnabled(True)
+    def load_process_progress(self, counter_file, isLoaded):
+        self.counter_iteration = self.counter_iteration + 1
+        self.progress_statusBar.setValue(self.counter_iteration)
+        self.widget_table.setItem(
+            counter_file,
+            3,
+            QtWidgets.QTableWidgetItem("Opened" if isLoaded else "Failed"),
+        )
         return 0
 
-    def compute_cmn_iteration_start(self):
-        if self.counter_iteration < self.num_iteration:
-            file_fullPath = self._workingDataBase["file_fullPath"][
-                self.counter_iteration
-            ]
-            self.loadData.file_fullPath = file_fullPath
-            self.loadData.start()
-        else:
-            self.load_process_finished()
+    def load_process_block(self, percent):
+        if self.counter_iteration == self.num_iteration:
+            self.label_statusBar.setText("Averaging and saving data ...")
+            self.progress_statusBar.setRange(0, 100)
+        self.progress_statusBar.setValue(percent)
         return 0
 
-    def compute_cmn_iteration_finished(self, ch_data, ch_time, sample_rate):
-        if self.counter_iteration < self.num_iteration:
-            if self.counter_iteration == 0:
-                self._workingDataBase["ch_data_cmn"] = np.zeros(
-                    (ch_data.size), dtype=float
-                )
-                self._workingDataBase["ch_data_all"] = np.zeros(
-                    (self.num_iteration, ch_data.size), dtype=float
-                )
-            self._workingDataBase["ch_data_cmn"] = (
-                self._workingDataBase["ch_data_cmn"] + ch_data
-            )
-            if self.comboBx_avgMode.currentIndex() == 1:
-                self._workingDataBase["ch_data_all"][
-                    self.counter_iteration, :
-                ] = ch_data
-            self._workingDataBase["ch_time"] = ch_time
-            self._workingDataBase["sample_rate"][0] = sample_rate
+    def load_process_finished(self, data_size, sample_rate, isLoaded):
+        for counter_file in range(self.num_iteration):
+            if not isLoaded[counter_file]:
+                continue
             self.widget_table.setItem(
-                self.counter_iteration, 1, QTableWidgetItem(str(ch_data.size))
+                counter_file, 1, QtWidgets.QTableWidgetItem(str(data_size))
             )
             self.widget_table.setItem(
-                self.counter_iteration, 2, QTableWidgetItem(str(sample_rate))
+                counter_file, 2, QtWidgets.QTableWidgetItem(str(sample_rate))
             )
             self.widget_table.setItem(
-                self.counter_iteration, 3, QTableWidgetItem("Finished")
+                counter_file, 3, QtWidgets.QTableWidgetItem("Finished")
             )
-            self.counter_iteration = self.counter_iteration + 1
-            self.compute_cmn_iteration_start()
-        return 0
-
-    def save_process_start(self, file_fullPath):
-        self.saveData.file_fullPath = file_fullPath
-        self.saveData.ch_data = self._workingDataBase["ch_data_cmn"]
-        self.saveData.ch_time = self._workingDataBase["ch_time"]
-        self.saveData.sample_rate = self._workingDataBase["sample_rate"][0]
-        self.saveData.start()
-        self.label_statusBar.setText("Saving data ...")
-        self.progress_statusBar.setRange(0, 0)
-        self.widget_grand.setEnabled(False)
-        return 0
-
-    def save_process_finished(self):
-        self.label_statusBar.setText("Saved data.")
+        self._workingDataBase["sample_rate"][0] = sample_rate
+        if isLoaded.any():
+            self.label_statusBar.setText("Saved data.")
+        else:
+            self.label_statusBar.setText("No data saved.")
         self.progress_statusBar.setRange(0, 1)
         self.widget_grand.setEnabled(True)
-        self.pushBtn_save.setEnabled(False)
         return 0
 
 
@@ -18,6 +18,7 @@ import scipy.signal
 import scipy.io
 import time
 import struct
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 
 # constants
@@ -59,12 +60,15 @@ def loadFolder(folderpath, dtype = float, **kwargs):
         filelist = os.listdir(folderpath)
 
     t0 = time.time()
-    numFiles = 0
+    filelist = [f for f in filelist if '.continuous' in f]
+    numFiles = len(filelist)
 
-    for i, f in enumerate(filelist):
-        if '.continuous' in f:
-            data[f.replace('.continuous','')] = loadContinuous(os.path.join(folderpath, f), dtype = dtype)
-            numFiles += 1
+    # the files are loaded concurrently, each into its own dict
+    with ThreadPoolExecutor(max_workers = max(min(numFiles, os.cpu_count() or 1), 1)) as executor:
+        data_list = list(executor.map(
+            lambda f: loadContinuous(os.path.join(folderpath, f), dtype = dtype), filelist))
+    for f, data_file in zip(filelist, data_list):
+        data[f.replace('.continuous','')] = data_file
 
     print(''.join(('Avg. Load Time: ', str((time.time() - t0)/numFiles),' sec')))
     print(''.join(('Total Load Time: ', str((time.time() - t0)),' sec')))
@@ -86,6 +90,23 @@ def loadFolderToArray(folderpath, channels = 'all', chprefix = 'CH',
         filelist = [source + '_'+chprefix + x + '_' + session + '.continuous' for x in map(str,channels)]
 
     t0 = time.time()
+
+    if dtype is float:
+        # the channels are read concurrently into one preallocated array by psort
+        from psort.utils import lib
+        data_all, _, _, isLoaded = lib.load_files_to_array(
+            [os.path.join(folderpath, f) for f in filelist])
+        if not isLoaded.all():
+            raise Exception("Could not load " + ", ".join(
+                [f for f, isFileLoaded in zip(filelist, isLoaded) if not isFileLoaded]))
+        data_array = data_all.T
+        numFiles = len(filelist)
+
+        print(''.join(('Avg. Load Time: ', str((time.time() - t0)/numFiles),' sec')))
+        print(''.join(('Total Load Time: ', str((time.time() - t0)),' sec')))
+
+        return data_array
+
     numFiles = 1
 
     channel_1_data = loadContinuous(os.path.join(folderpath, filelist[0]), dtype)['data']
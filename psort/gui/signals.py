@@ -1,6 +1,5 @@
 import datetime
 import os
-import sys
 import time
 from copy import deepcopy
 
@@ -30,8 +29,14 @@ class PsortGuiSignals(PsortGuiWidget):
         self.psortDataBase = PsortDataBase()
         self.loadData = lib.LoadData()
         self.saveData = lib.SaveData()
+        self.autoSaveData = lib.AutoSaveData()
+        self.autoSaveTimer = QtCore.QTimer(self)
+        self.isSavePending = False
+        self.umapRunner = lib.UmapRunner(self)
         self._fileDataBase = deepcopy(dictionaries._fileDataBase)
         self._workingDataBase = deepcopy(dictionaries._workingDataBase)
+        self.refreshGraph = signals_lib.RefreshGraph()
+        self.undoRedoLog = signals_lib.UndoRedoLog()
         self.init_plots()
         self.connect_menubar_signals()
         self.connect_toolbar_signals()
@@ -53,32 +58,17 @@ class PsortGuiSignals(PsortGuiWidget):
         if self._workingDataBase["isAnalyzed"][0]:
             self.update_guiWidgets_from_guiDataBase()
         self.update_guiDataBase_from_guiWidgets()
-        signals_lib.filter_data(self._workingDataBase)
+        # only the stages whose inputs have been changed will be re-run
         if self._workingDataBase["flag_index_detection"][0]:
-            signals_lib.detect_ss_index(self._workingDataBase)
-            signals_lib.detect_cs_index_slow(self._workingDataBase)
-            signals_lib.align_cs(self._workingDataBase)
-            self.undoRedo_add()
+            stages_run = self.refreshGraph.run(self._workingDataBase)
+            if "detect_index" in stages_run:
+                self.undoRedo_add()
         else:
+            self.refreshGraph.run(self._workingDataBase, skip_stages=("detect_index",))
             self._workingDataBase["flag_index_detection"][0] = True
+        self.umap_process_start()
         signals_lib.reset_cs_ROI(self._workingDataBase)
         signals_lib.reset_ss_ROI(self._workingDataBase)
-        signals_lib.extract_ss_peak(self._workingDataBase)
-        signals_lib.extract_cs_peak(self._workingDataBase)
-        signals_lib.extract_ss_waveform(self._workingDataBase)
-        signals_lib.extract_cs_waveform(self._workingDataBase)
-        signals_lib.extract_ss_similarity(self._workingDataBase)
-        signals_lib.extract_cs_similarity(self._workingDataBase)
-        signals_lib.extract_ss_ifr(self._workingDataBase)
-        signals_lib.extract_cs_ifr(self._workingDataBase)
-        signals_lib.extract_ss_time(self._workingDataBase)
-        signals_lib.extract_cs_time(self._workingDataBase)
-        signals_lib.extract_ss_xprob(self._workingDataBase)
-        signals_lib.extract_cs_xprob(self._workingDataBase)
-        signals_lib.extract_ss_pca(self._workingDataBase)
-        signals_lib.extract_cs_pca(self._workingDataBase)
-        signals_lib.extract_ss_scatter(self._workingDataBase)
-        signals_lib.extract_cs_scatter(self._workingDataBase)
         self.update_SSPcaNum_comboBx()
         self.update_CSPcaNum_comboBx()
         self.plot_rawSignal(just_update_selected=False)
@@ -98,6 +88,12 @@ class PsortGuiSignals(PsortGuiWidget):
     # INIT FUNCTIONS
     def init_workingDataBase(self):
         self._workingDataBase = deepcopy(dictionaries._workingDataBase)
+        # UMAP is computed by umapRunner, the scatter plots show PCA until it is ready
+        self._workingDataBase["flag_umap_async"][0] = True
+        self.umapRunner.cancel()
+        self.refreshGraph.reset()
+        signals_lib.filter_cache.clear()
+        signals_lib.recording_filter.clear()
         self.txtedit_toolbar_slotNumCurrent.valueChanged.disconnect(
             self.onToolbar_slotNumCurrent_ValueChanged
         )
@@ -572,7 +568,7 @@ class PsortGuiSignals(PsortGuiWidget):
         self.actionBtn_menubar_file_save.triggered.connect(
             self.onToolbar_save_ButtonClick
         )
-        self.actionBtn_menubar_file_exit.triggered.connect(sys.exit)
+        self.actionBtn_menubar_file_exit.triggered.connect(self.close)
         self.actionBtn_menubar_tools_prefrences.triggered.connect(
             self.onMenubar_prefrences_ButtonClick
         )
@@ -594,6 +590,10 @@ class PsortGuiSignals(PsortGuiWidget):
         self.txtlabel_statusBar.setText("Please load data for sorting or use Add-ons.")
         self.loadData.return_signal.connect(self.load_process_finished)
         self.saveData.return_signal.connect(self.save_process_finished)
+        self.autoSaveData.return_signal.connect(self.autosave_process_finished)
+        self.autoSaveData.finished.connect(self.save_process_resume)
+        self.autoSaveTimer.timeout.connect(self.autosave_process_start)
+        self.umapRunner.return_signal.connect(self.umap_process_finished)
         self.actionBtn_toolbar_next.triggered.connect(self.onToolbar_next_ButtonClick)
         self.actionBtn_toolbar_previous.triggered.connect(
             self.onToolbar_previous_ButtonClick
@@ -776,6 +776,8 @@ class PsortGuiSignals(PsortGuiWidget):
 
     # @showWaitCursor
     def onToolbar_refresh_ButtonClick(self):
+        # the refresh button forces a full refresh, including the spike detection
+        self.refreshGraph.reset()
         self.refresh_workingDataBase()
         return 0
 
@@ -900,18 +902,25 @@ class PsortGuiSignals(PsortGuiWidget):
         if _reply == QtWidgets.QMessageBox.No:
             return 0
         self.menubar_prefrences = EditPrefrencesDialog(
-            self, workingDataBase=self._workingDataBase
+            self,
+            workingDataBase=self._workingDataBase,
+            fileDataBase=self._fileDataBase,
         )
         if not (self.menubar_prefrences.exec_()):
             return 0
         for counter in range(len(self.menubar_prefrences.list_doubleSpinBx)):
             key = self.menubar_prefrences.list_label[counter].text()
             value = self.menubar_prefrences.list_doubleSpinBx[counter].value()
-            if self._workingDataBase[key].dtype == np.uint32:
-                self._workingDataBase[key][0] = np.cast[np.uint32](value)
+            if key in dictionaries.SESSION_PREFRENCES_KEYS:
+                _dataBase = self._fileDataBase
             else:
-                self._workingDataBase[key][0] = np.cast[np.float32](value)
+                _dataBase = self._workingDataBase
+            if _dataBase[key].dtype == np.uint32:
+                _dataBase[key][0] = np.cast[np.uint32](value)
+            else:
+                _dataBase[key][0] = np.cast[np.float32](value)
         dictionaries.GLOBAL_check_variables(self._workingDataBase)
+        self.autosave_reset_timer()
         self._workingDataBase["flag_tools_prefrences"][0] = True
         self.onInfLineSsWaveMinPca_positionChangeFinished()
         self.onInfLineSsWaveMaxPca_positionChangeFinished()
@@ -951,6 +960,7 @@ class PsortGuiSignals(PsortGuiWidget):
         signals_lib.extract_cs_pca(self._workingDataBase)
         signals_lib.extract_ss_scatter(self._workingDataBase)
         signals_lib.extract_cs_scatter(self._workingDataBase)
+        self.umap_process_start()
         self.update_SSPcaNum_comboBx()
         self.update_CSPcaNum_comboBx()
         self.plot_ss_pca()
@@ -1078,6 +1088,7 @@ class PsortGuiSignals(PsortGuiWidget):
         if not (self._workingDataBase["flag_tools_prefrences"][0]):
             signals_lib.extract_ss_pca(self._workingDataBase)
             signals_lib.extract_ss_scatter(self._workingDataBase)
+            self.umap_process_start()
             self.update_SSPcaNum_comboBx()
             self.plot_ss_pca()
         return 0
@@ -1115,6 +1126,7 @@ class PsortGuiSignals(PsortGuiWidget):
         if not (self._workingDataBase["flag_tools_prefrences"][0]):
             signals_lib.extract_ss_pca(self._workingDataBase)
             signals_lib.extract_ss_scatter(self._workingDataBase)
+            self.umap_process_start()
             self.update_SSPcaNum_comboBx()
             self.plot_ss_pca()
         return 0
@@ -1152,6 +1164,7 @@ class PsortGuiSignals(PsortGuiWidget):
         if not (self._workingDataBase["flag_tools_prefrences"][0]):
             signals_lib.extract_cs_pca(self._workingDataBase)
             signals_lib.extract_cs_scatter(self._workingDataBase)
+            self.umap_process_start()
             self.update_CSPcaNum_comboBx()
             self.plot_cs_pca()
         return 0
@@ -1189,6 +1202,7 @@ class PsortGuiSignals(PsortGuiWidget):
         if not (self._workingDataBase["flag_tools_prefrences"][0]):
             signals_lib.extract_cs_pca(self._workingDataBase)
             signals_lib.extract_cs_scatter(self._workingDataBase)
+            self.umap_process_start()
             self.update_CSPcaNum_comboBx()
             self.plot_cs_pca()
         return 0
@@ -1458,6 +1472,7 @@ class PsortGuiSignals(PsortGuiWidget):
         signals_lib.extract_ss_pca(self._workingDataBase)
         signals_lib.extract_ss_scatter(self._workingDataBase)
         signals_lib.extract_cs_scatter(self._workingDataBase)
+        self.umap_process_start()
         self.update_SSPcaNum_comboBx()
         self.update_CSPcaNum_comboBx()
         self.plot_rawSignal(just_update_selected=True)
@@ -1496,6 +1511,7 @@ class PsortGuiSignals(PsortGuiWidget):
         signals_lib.extract_cs_pca(self._workingDataBase)
         signals_lib.extract_ss_scatter(self._workingDataBase)
         signals_lib.extract_cs_scatter(self._workingDataBase)
+        self.umap_process_start()
         self.update_SSPcaNum_comboBx()
         self.update_CSPcaNum_comboBx()
         self.plot_rawSignal(just_update_selected=True)
@@ -1529,6 +1545,7 @@ class PsortGuiSignals(PsortGuiWidget):
         signals_lib.extract_ss_pca(self._workingDataBase)
         signals_lib.extract_ss_scatter(self._workingDataBase)
         signals_lib.extract_cs_scatter(self._workingDataBase)
+        self.umap_process_start()
         self.update_SSPcaNum_comboBx()
         self.update_CSPcaNum_comboBx()
         self.plot_rawSignal(just_update_selected=True)
@@ -1567,6 +1584,7 @@ class PsortGuiSignals(PsortGuiWidget):
         signals_lib.extract_cs_pca(self._workingDataBase)
         signals_lib.extract_ss_scatter(self._workingDataBase)
         signals_lib.extract_cs_scatter(self._workingDataBase)
+        self.umap_process_start()
         self.update_SSPcaNum_comboBx()
         self.update_CSPcaNum_comboBx()
         self.plot_rawSignal(just_update_selected=True)
@@ -1622,7 +1640,28 @@ class PsortGuiSignals(PsortGuiWidget):
                 self.loadData.ch_index = ch_index
             else:
                 return 0
+        # in case of a raw signal, offer the autosaved session of the same file
+        isMainSignal = self._fileDataBase["isMainSignal"][0]
+        autosave_file_fullPath = self.get_autosave_file_fullPath(file_fullPath)
+        if (
+            isMainSignal
+            and not (file_ext == ".psort")
+            and os.path.isfile(autosave_file_fullPath)
+        ):
+            _reply = QtWidgets.QMessageBox.question(
+                self,
+                "Load Autosave",
+                "An autosaved session of this file exists. \n"
+                + "Do you want to load the autosaved session instead?",
+                QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No,
+                QtWidgets.QMessageBox.Yes,
+            )
+            if _reply == QtWidgets.QMessageBox.Yes:
+                file_fullPath = autosave_file_fullPath
+                self._fileDataBase["load_file_fullPath"] = file_fullPath
         # Load data
+        self.autoSaveTimer.stop()
+        self.loadData.isCompact = self.actionBtn_menubar_file_compact.isChecked()
         self.loadData.file_fullPath = file_fullPath
         self.loadData.start()
         self.txtlabel_statusBar.setText("Loading data ...")
@@ -1717,7 +1756,7 @@ class PsortGuiSignals(PsortGuiWidget):
             file_ext,
             _,
         ) = self.psortDataBase.get_file_fullPath_components()
-        psortDataBase_topLevel = self.psortDataBase.get_topLevelDataBase()
+        psortDataBase_topLevel = self.psortDataBase.get_topLevelDataBase_view()
         ch_data = psortDataBase_topLevel["ch_data"]
         ch_data_max = np.max(ch_data)
         total_slot_num = psortDataBase_topLevel["total_slot_num"][0]
@@ -1758,8 +1797,7 @@ class PsortGuiSignals(PsortGuiWidget):
                 )
                 if self.input_dialog.exec_():
                     scale_value = self.input_dialog.doubleSpinBx.value()
-                    psort_grandDataBase = self.psortDataBase.get_grandDataBase_Pointer()
-                    psort_grandDataBase[-1]["ch_data"] = ch_data * scale_value
+                    self.psortDataBase.scale_signal("ch_data", scale_value)
             # Scale ch_data DOWN and put it in 100-10000 range
             if ch_data_max > 10000.0:
                 message = str(
@@ -1779,8 +1817,7 @@ class PsortGuiSignals(PsortGuiWidget):
                 )
                 if self.input_dialog.exec_():
                     scale_value = self.input_dialog.doubleSpinBx.value()
-                    psort_grandDataBase = self.psortDataBase.get_grandDataBase_Pointer()
-                    psort_grandDataBase[-1]["ch_data"] = ch_data * scale_value
+                    self.psortDataBase.scale_signal("ch_data", scale_value)
         self.setEnableWidgets(True)
         self.setEnableMainModule(True)
         (
@@ -1826,6 +1863,16 @@ class PsortGuiSignals(PsortGuiWidget):
         self.txtedit_toolbar_slotNumCurrent.valueChanged.connect(
             self.onToolbar_slotNumCurrent_ValueChanged
         )
+        self._fileDataBase["autosave_file_fullPath"] = self.get_autosave_file_fullPath(
+            file_fullPath
+        )
+        self.autosave_reset_timer()
+        if os.path.isfile(lib.get_psort_journal_fullPath(file_fullPath)):
+            currentDT = datetime.datetime.now()
+            self.txtlabel_statusBar.setText(
+                currentDT.strftime("%H:%M:%S")
+                + " Loaded data with the autosaved changes."
+            )
         if flag_restart_session:
             self.slotBoundary_showWidget(True, "hard")
         return 0
@@ -1833,7 +1880,7 @@ class PsortGuiSignals(PsortGuiWidget):
     def load_process_finished_complement_lfp(self):
         self._workingDataBase["isLfpSideloaded"][0] = True
         psort_grandDataBase = self.psortDataBase.get_grandDataBase_Pointer()
-        ch_lfp = deepcopy(psort_grandDataBase[-1]["ch_lfp"])
+        ch_lfp = psort_grandDataBase[-1]["ch_lfp"]
         ch_lfp_max = np.max(ch_lfp)
         # Scale ch_lfp UP and put it in 100-10000 range
         if ch_lfp_max < 100.0:
@@ -1854,7 +1901,7 @@ class PsortGuiSignals(PsortGuiWidget):
             )
             if self.input_dialog.exec_():
                 scale_value = self.input_dialog.doubleSpinBx.value()
-                psort_grandDataBase[-1]["ch_lfp"] = ch_lfp * scale_value
+                self.psortDataBase.scale_signal("ch_lfp", scale_value)
         # Scale ch_lfp DOWN and put it in 100-10000 range
         if ch_lfp_max > 10000.0:
             message = str(
@@ -1874,13 +1921,12 @@ class PsortGuiSignals(PsortGuiWidget):
             )
             if self.input_dialog.exec_():
                 scale_value = self.input_dialog.doubleSpinBx.value()
-                psort_grandDataBase[-1]["ch_lfp"] = ch_lfp * scale_value
-        index_start_on_ch_data = psort_grandDataBase[-2]["index_start_on_ch_data"][0]
-        index_end_on_ch_data = psort_grandDataBase[-2]["index_end_on_ch_data"][0]
-        self._workingDataBase["ch_lfp"] = deepcopy(
-            psort_grandDataBase[-1]["ch_lfp"][
-                index_start_on_ch_data:index_end_on_ch_data
-            ]
+                self.psortDataBase.scale_signal("ch_lfp", scale_value)
+        self._workingDataBase["ch_lfp"] = self.psortDataBase.get_slot_view("ch_lfp")
+        signals_lib.recording_filter.set_recording(
+            "ch_lfp",
+            psort_grandDataBase[-1]["ch_lfp"],
+            psort_grandDataBase[-1]["sample_rate"][0],
         )
         signals_lib.filter_data(self._workingDataBase)
         self.onRawSignal_CsAutoThresh_Clicked()
@@ -1888,14 +1934,26 @@ class PsortGuiSignals(PsortGuiWidget):
         return 0
 
     def save_process_start(self):
-        self.saveData.file_fullPath = self._fileDataBase["save_file_fullPath"]
-        self.saveData.grandDataBase = self.psortDataBase.get_grandDataBase_Pointer()
-        self.saveData.start()
         self.txtlabel_statusBar.setText("Saving data ...")
         self.progress_statusBar.setRange(0, 0)
         self.widget_mainwin.setEnabled(False)
         self.toolbar.setEnabled(False)
         self.menubar.setEnabled(False)
+        # the autosave should not write while the file is being saved, the save
+        # starts once it is finished, see save_process_resume
+        if self.autoSaveData.isRunning():
+            self.isSavePending = True
+            return 0
+        self.saveData.file_fullPath = self._fileDataBase["save_file_fullPath"]
+        self.saveData.grandDataBase = self.psortDataBase.get_grandDataBase_Pointer()
+        self.saveData.start()
+        return 0
+
+    def save_process_resume(self):
+        if not (self.isSavePending):
+            return 0
+        self.isSavePending = False
+        self.save_process_start()
         return 0
 
     def save_process_finished(self):
@@ -1905,6 +1963,102 @@ class PsortGuiSignals(PsortGuiWidget):
         self.widget_mainwin.setEnabled(True)
         self.toolbar.setEnabled(True)
         self.menubar.setEnabled(True)
+        # the saved file holds every change, the autosave continues on top of it
+        save_file_fullPath = str(self._fileDataBase["save_file_fullPath"])
+        autosave_file_fullPath = str(self._fileDataBase["autosave_file_fullPath"])
+        lib.remove_file_psort_journal(save_file_fullPath)
+        if not (
+            os.path.realpath(autosave_file_fullPath)
+            == os.path.realpath(save_file_fullPath)
+        ):
+            lib.remove_file_psort_journal(autosave_file_fullPath)
+            if autosave_file_fullPath.endswith(".autosave.psort") and os.path.isfile(
+                autosave_file_fullPath
+            ):
+                os.remove(autosave_file_fullPath)
+        self._fileDataBase["autosave_file_fullPath"] = save_file_fullPath
+        self.autosave_reset_timer()
+        return 0
+
+    def closeEvent(self, event):
+        # the running saves are joined, a QThread must not be destroyed while it
+        # runs and an interrupted save would leave its temporary file behind
+        self.autoSaveTimer.stop()
+        self.autoSaveData.wait()
+        # a save which waited for the autosave is not dropped
+        self.save_process_resume()
+        self.saveData.wait()
+        super(PsortGuiSignals, self).closeEvent(event)
+        return None
+
+    def get_autosave_file_fullPath(self, file_fullPath):
+        _, file_path, _, file_ext, file_name_without_ext = lib.get_fullPath_components(
+            file_fullPath
+        )
+        if file_ext == ".psort":
+            return file_fullPath
+        return os.path.join(file_path, file_name_without_ext + ".autosave.psort")
+
+    def autosave_reset_timer(self):
+        self.autoSaveTimer.stop()
+        autosave_interval = self._fileDataBase["autosave_interval"][0]
+        if autosave_interval > 0:
+            self.autoSaveTimer.start(int(autosave_interval) * 60 * 1000)
+        return 0
+
+    def autosave_process_start(self):
+        # skip this round if the previous autosave or a load/save is still running
+        if (
+            self.autoSaveData.isRunning()
+            or self.saveData.isRunning()
+            or self.loadData.isRunning()
+            or self.isSavePending
+        ):
+            return 0
+        self.autoSaveData.file_fullPath = str(
+            self._fileDataBase["autosave_file_fullPath"]
+        )
+        self.autoSaveData.grandDataBase = self.psortDataBase.get_grandDataBase_snapshot(
+            self._workingDataBase
+        )
+        self.autoSaveData.start()
+        return 0
+
+    def autosave_process_finished(self, isFailed):
+        if isFailed:
+            return 0
+        currentDT = datetime.datetime.now()
+        self.txtlabel_statusBar.setText(currentDT.strftime("%H:%M:%S") + " Autosaved.")
+        return 0
+
+    def umap_process_start(self):
+        # submit the embeddings which extract_ss_pca/extract_cs_pca left pending
+        for spike_type in ("ss", "cs"):
+            if not self._workingDataBase[spike_type + "_umap_isPending"][0]:
+                continue
+            self._workingDataBase[spike_type + "_umap_isPending"][0] = False
+            self.umapRunner.submit(
+                spike_type,
+                **signals_lib.get_umap_args(self._workingDataBase, spike_type),
+            )
+        return 0
+
+    def umap_process_finished(self, spike_type, spike_id, embedding):
+        # the spikes might have been changed while the embedding was being computed
+        if not self._workingDataBase["umap_enable"][0]:
+            return 0
+        if not np.array_equal(
+            spike_id, np.flatnonzero(self._workingDataBase[spike_type + "_index"])
+        ):
+            return 0
+        self._workingDataBase[spike_type + "_umap1"] = deepcopy(embedding[:, 0])
+        self._workingDataBase[spike_type + "_umap2"] = deepcopy(embedding[:, 1])
+        if spike_type == "ss":
+            signals_lib.extract_ss_scatter(self._workingDataBase)
+            self.plot_ss_pca()
+        else:
+            signals_lib.extract_cs_scatter(self._workingDataBase)
+            self.plot_cs_pca()
         return 0
 
     # PLOTS
@@ -2164,50 +2318,17 @@ class PsortGuiSignals(PsortGuiWidget):
     # UNDO/REDO
     def undoRedo_reset(self):
         """
-        To make the code fast and efficient, instead of appending and removing from the history at
-        each time step, we allocate batch_size steps as default and then if more steps where
-        necessary we will allocate more steps on the go.
+        The history is an operation log of the spikes that changed at each step, see
+        signals_lib.UndoRedoLog, so its size does not depend on the slot length.
         """
-        len_data = len(self._workingDataBase["ch_data"])
-        batch_size = self._workingDataBase["batch_size_undoRedo"][0]
-        self._workingDataBase["ss_index_undoRedo"] = np.zeros(
-            (batch_size, len_data), dtype=bool
-        )
-        self._workingDataBase["cs_index_slow_undoRedo"] = np.zeros(
-            (batch_size, len_data), dtype=bool
-        )
-        self._workingDataBase["cs_index_undoRedo"] = np.zeros(
-            (batch_size, len_data), dtype=bool
-        )
+        self.undoRedoLog.max_length = self._workingDataBase["max_length_undoRedo"][0]
+        self.undoRedoLog.reset(len(self._workingDataBase["ch_data"]))
         self._workingDataBase["index_undoRedo"][0] = -1
         self._workingDataBase["length_undoRedo"][0] = 0
         self.actionBtn_toolbar_undo.setEnabled(False)
         self.actionBtn_toolbar_redo.setEnabled(False)
         return 0
 
-    def undoRedo_append(self):
-        len_data = len(self._workingDataBase["ch_data"])
-        batch_size = self._workingDataBase["batch_size_undoRedo"][0]
-        self._workingDataBase["ss_index_undoRedo"] = np.vstack(
-            (
-                self._workingDataBase["ss_index_undoRedo"],
-                np.zeros((batch_size, len_data), dtype=bool),
-            )
-        )
-        self._workingDataBase["cs_index_slow_undoRedo"] = np.vstack(
-            (
-                self._workingDataBase["cs_index_slow_undoRedo"],
-                np.zeros((batch_size, len_data), dtype=bool),
-            )
-        )
-        self._workingDataBase["cs_index_undoRedo"] = np.vstack(
-            (
-                self._workingDataBase["cs_index_undoRedo"],
-                np.zeros((batch_size, len_data), dtype=bool),
-            )
-        )
-        return 0
-
     def undoRedo_enable(self):
         # UNDO Enable conditions
         if self._workingDataBase["index_undoRedo"][0] <= 0:
@@ -2232,24 +2353,11 @@ class PsortGuiSignals(PsortGuiWidget):
         return 0
 
     def undoRedo_add(self):
-        if self._workingDataBase["ss_index_undoRedo"].shape[1] != len(
-            self._workingDataBase["ch_data"]
-        ):
+        if self.undoRedoLog.data_size != len(self._workingDataBase["ch_data"]):
             self.undoRedo_reset()
-        index_undoRedo = self._workingDataBase["index_undoRedo"][0] + 1
-        if index_undoRedo >= self._workingDataBase["ss_index_undoRedo"].shape[0]:
-            self.undoRedo_append()  # append another patch if neccessary
-        self._workingDataBase["ss_index_undoRedo"][index_undoRedo, :] = deepcopy(
-            self._workingDataBase["ss_index"]
-        )
-        self._workingDataBase["cs_index_slow_undoRedo"][index_undoRedo, :] = deepcopy(
-            self._workingDataBase["cs_index_slow"]
-        )
-        self._workingDataBase["cs_index_undoRedo"][index_undoRedo, :] = deepcopy(
-            self._workingDataBase["cs_index"]
-        )
-        self._workingDataBase["index_undoRedo"][0] = index_undoRedo
-        self._workingDataBase["length_undoRedo"][0] = index_undoRedo + 1
+        self.undoRedoLog.add(self._workingDataBase)
+        self._workingDataBase["index_undoRedo"][0] = self.undoRedoLog.index
+        self._workingDataBase["length_undoRedo"][0] = self.undoRedoLog.get_length()
         self.undoRedo_enable()
         return 0
 
@@ -2260,17 +2368,8 @@ class PsortGuiSignals(PsortGuiWidget):
             self.undoRedo_enable()
             return 0
         # if index_undoRedo is more than 0 then UNDO
-        index_undoRedo = self._workingDataBase["index_undoRedo"][0] - 1
-        self._workingDataBase["ss_index"] = deepcopy(
-            self._workingDataBase["ss_index_undoRedo"][index_undoRedo, :]
-        )
-        self._workingDataBase["cs_index_slow"] = deepcopy(
-            self._workingDataBase["cs_index_slow_undoRedo"][index_undoRedo, :]
-        )
-        self._workingDataBase["cs_index"] = deepcopy(
-            self._workingDataBase["cs_index_undoRedo"][index_undoRedo, :]
-        )
-        self._workingDataBase["index_undoRedo"][0] = index_undoRedo
+        self.undoRedoLog.undo(self._workingDataBase)
+        self._workingDataBase["index_undoRedo"][0] = self.undoRedoLog.index
         self.undoRedo_enable()
         self.undoRedo_updatePlots()
         return 0
@@ -2285,17 +2384,8 @@ class PsortGuiSignals(PsortGuiWidget):
             self.undoRedo_enable()
             return 0
         # if index_undoRedo is less than length_undoRedo-1 then REDO
-        index_undoRedo = self._workingDataBase["index_undoRedo"][0] + 1
-        self._workingDataBase["ss_index"] = deepcopy(
-            self._workingDataBase["ss_index_undoRedo"][index_undoRedo, :]
-        )
-        self._workingDataBase["cs_index_slow"] = deepcopy(
-            self._workingDataBase["cs_index_slow_undoRedo"][index_undoRedo, :]
-        )
-        self._workingDataBase["cs_index"] = deepcopy(
-            self._workingDataBase["cs_index_undoRedo"][index_undoRedo, :]
-        )
-        self._workingDataBase["index_undoRedo"][0] = index_undoRedo
+        self.undoRedoLog.redo(self._workingDataBase)
+        self._workingDataBase["index_undoRedo"][0] = self.undoRedoLog.index
         self.undoRedo_enable()
         self.undoRedo_updatePlots()
         return 0
@@ -2319,6 +2409,7 @@ class PsortGuiSignals(PsortGuiWidget):
         signals_lib.extract_cs_pca(self._workingDataBase)
         signals_lib.extract_ss_scatter(self._workingDataBase)
         signals_lib.extract_cs_scatter(self._workingDataBase)
+        self.umap_process_start()
         self.update_SSPcaNum_comboBx()
         self.update_CSPcaNum_comboBx()
         self.plot_rawSignal(just_update_selected=True)
@@ -2972,6 +3063,12 @@ class PsortGuiSignals(PsortGuiWidget):
     def onPushBtn_waveClust_Clicked(self):
         # copy _workingDataBase over to WaveClustWidget
         self.WaveClustWidget._workingDataBase = deepcopy(self._workingDataBase)
+        # the embeddings which are still being computed are submitted again by WaveClust
+        for spike_type in ("ss", "cs"):
+            if self.umapRunner.isRunning(spike_type):
+                self.WaveClustWidget._workingDataBase[spike_type + "_umap_isPending"][
+                    0
+                ] = True
         # Enable the WaveClustWidget module
         self.WaveClustWidget.pushBtn_waveClust_Clicked()
         self.waveClust_showWidget(True)
@@ -3092,37 +3189,37 @@ class PsortGuiSignals(PsortGuiWidget):
     # BIND SIGNALS TO database
     def transfer_data_from_psortDataBase_to_guiSignals(self):
         psortDataBase_currentSlot = self.psortDataBase.get_currentSlotDataBase()
-        psortDataBase_topLevel = self.psortDataBase.get_topLevelDataBase()
+        # the raw signals are read-only views of the topLevel arrays, the spike indices
+        # are kept sparse at the topLevel and expanded to slot sized masks here
+        psortDataBase_topLevel = self.psortDataBase.get_topLevelDataBase_view()
         self._workingDataBase["isAnalyzed"] = psortDataBase_currentSlot["isAnalyzed"]
         index_start_on_ch_data = psortDataBase_currentSlot["index_start_on_ch_data"][0]
         index_end_on_ch_data = psortDataBase_currentSlot["index_end_on_ch_data"][0]
         self._workingDataBase["index_start_on_ch_data"][0] = index_start_on_ch_data
         self._workingDataBase["index_end_on_ch_data"][0] = index_end_on_ch_data
-        self._workingDataBase["ch_data"] = psortDataBase_topLevel["ch_data"][
-            index_start_on_ch_data:index_end_on_ch_data
-        ]
-        self._workingDataBase["ch_time"] = psortDataBase_topLevel["ch_time"][
-            index_start_on_ch_data:index_end_on_ch_data
-        ]
-        self._workingDataBase["ss_index"] = psortDataBase_topLevel["ss_index"][
-            index_start_on_ch_data:index_end_on_ch_data
-        ]
-        self._workingDataBase["cs_index"] = psortDataBase_topLevel["cs_index"][
-            index_start_on_ch_data:index_end_on_ch_data
-        ]
-        self._workingDataBase["cs_index_slow"] = psortDataBase_topLevel[
-            "cs_index_slow"
-        ][index_start_on_ch_data:index_end_on_ch_data]
+        self._workingDataBase["ch_data"] = self.psortDataBase.get_slot_view("ch_data")
+        self._workingDataBase["ch_time"] = self.psortDataBase.get_slot_view("ch_time")
+        for key in ("ss_index", "cs_index", "cs_index_slow"):
+            self._workingDataBase[key] = self.psortDataBase.get_slot_index(key)
         self._workingDataBase["sample_rate"][0] = psortDataBase_topLevel["sample_rate"][
             0
         ]
         if psortDataBase_topLevel["isLfpSideloaded"][0]:
-            self._workingDataBase["ch_lfp"] = psortDataBase_topLevel["ch_lfp"][
-                index_start_on_ch_data:index_end_on_ch_data
-            ]
+            self._workingDataBase["ch_lfp"] = self.psortDataBase.get_slot_view("ch_lfp")
         self._workingDataBase["isLfpSideloaded"][0] = psortDataBase_topLevel[
             "isLfpSideloaded"
         ][0]
+        # the whole recording is filtered once and sliced per slot, register the
+        # top level arrays by reference so they are not copied again
+        psort_topLevel_pointer = self.psortDataBase.get_grandDataBase_Pointer()[-1]
+        sample_rate = psort_topLevel_pointer["sample_rate"][0]
+        signals_lib.recording_filter.set_recording(
+            "ch_data", psort_topLevel_pointer["ch_data"], sample_rate
+        )
+        if psort_topLevel_pointer["isLfpSideloaded"][0]:
+            signals_lib.recording_filter.set_recording(
+                "ch_lfp", psort_topLevel_pointer["ch_lfp"], sample_rate
+            )
         # if the SLOT is already analyzed then transfer the data over,
         # otherwise, do not transfer and use the current values for the new slot
         if self._workingDataBase["isAnalyzed"][0]:
@@ -920,11 +920,16 @@ class PsortGuiWidget(QtWidgets.QMainWindow):
         self.actionBtn_menubar_file_open = QtWidgets.QAction("Open File...", self)
         self.actionBtn_menubar_file_lfp = QtWidgets.QAction("Sideload LFP...", self)
         self.actionBtn_menubar_file_restart = QtWidgets.QAction("Restart Session", self)
+        # keep the int16 samples of the loaded file instead of float64
+        self.actionBtn_menubar_file_compact = QtWidgets.QAction(
+            "Load Raw Signal as int16", self, checkable=True
+        )
         self.actionBtn_menubar_file_save = QtWidgets.QAction("Save Session", self)
         self.actionBtn_menubar_file_exit = QtWidgets.QAction("Exit", self)
         self.menu_menubar_file.addAction(self.actionBtn_menubar_file_open)
         self.menu_menubar_file.addAction(self.actionBtn_menubar_file_lfp)
         self.menu_menubar_file.addAction(self.actionBtn_menubar_file_restart)
+        self.menu_menubar_file.addAction(self.actionBtn_menubar_file_compact)
         self.menu_menubar_file.addAction(self.actionBtn_menubar_file_save)
         self.menu_menubar_file.addAction(self.actionBtn_menubar_file_exit)
 
@@ -285,7 +285,10 @@ class CellSummarySignals(CellSummaryWidget):
             self, "Open File", file_path, filter="Data file (*.psort)"
         )
         if os.path.isfile(os.path.realpath(file_fullPath)):
-            self._grandDataBase = lib.load_file_psort(file_fullPath)
+            # the LFP is not needed for the summary, so it is not read at all
+            self._grandDataBase = lib.load_file_psort(
+                file_fullPath, signal_keys=("ch_data", "ch_time")
+            )
         else:
             return 0
         return 1
@@ -293,6 +296,12 @@ class CellSummarySignals(CellSummaryWidget):
     def load_workingDataBase(self):
         for key in self._workingDataBase.keys():
             self._workingDataBase[key] = self._grandDataBase[-1][key]
+        # the topLevel spike indices are sorted sample indices
+        for key in ("ss_index", "cs_index_slow", "cs_index"):
+            if not (self._workingDataBase[key].dtype == bool):
+                self._workingDataBase[key] = lib.index_int_to_bool(
+                    self._workingDataBase[key], self._workingDataBase["ch_data"].size
+                )
         for key in self._grandDataBase[-2].keys():
             if "GLOBAL" in key:
                 self._workingDataBase[key] = self._grandDataBase[-2][key]
@@ -7,10 +7,15 @@ from psort.utils import dictionaries
 
 
 class EditPrefrencesDialog(QtWidgets.QDialog):
-    def __init__(self, parent=None, workingDataBase=None):
+    def __init__(self, parent=None, workingDataBase=None, fileDataBase=None):
         super(EditPrefrencesDialog, self).__init__(parent)
         if workingDataBase is None:
             workingDataBase = deepcopy(dictionaries.GLOBAL_DICT)
+        if fileDataBase is None:
+            fileDataBase = deepcopy(dictionaries._fileDataBase)
+        prefrences = {key: workingDataBase[key] for key in dictionaries.GLOBAL_DICT}
+        for key in dictionaries.SESSION_PREFRENCES_KEYS:
+            prefrences[key] = fileDataBase[key]
         self.setWindowTitle("Edit Prefrences")
         self.layout_grand = QtWidgets.QVBoxLayout()
         self.scrollArea = QtWidgets.QScrollArea()
@@ -19,9 +24,13 @@ class EditPrefrencesDialog(QtWidgets.QDialog):
         self.list_label = []
         self.list_doubleSpinBx = []
         counter_key = int(0)
-        for key in dictionaries.GLOBAL_DICT.keys():
-            value = workingDataBase[key]
-            if value.dtype == np.uint32:
+        for key, value in prefrences.items():
+            if key == "GLOBAL_UMAP_LANDMARK_NUM":
+                # a number of spikes, well above the range of the other counts
+                _dec = 0
+                _max = 1000000
+                _step = 1000
+            elif value.dtype == np.uint32:
                 _dec = 0
                 _max = 1000
                 _step = 1
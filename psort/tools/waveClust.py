@@ -19,6 +19,7 @@ class WaveClustWidget(QtWidgets.QWidget):
     def __init__(self, parent=None):
         super(WaveClustWidget, self).__init__(parent)
         self._workingDataBase = {}
+        self.umapRunner = lib.UmapRunner(self)
         self.list_color = deepcopy(dictionaries.list_color)
         self._localDataBase = {
             "ss_index_labels": np.zeros((0), dtype=np.int32),
@@ -50,6 +51,7 @@ class WaveClustWidget(QtWidgets.QWidget):
         self.init_scatterPlot_popup_shortcut()
         self.init_scatterPlot_popup_plot()
         self.connect_scatterPlot_popup_signals()
+        self.umapRunner.return_signal.connect(self.umap_process_finished)
         return None
 
     # build_scatterPlot_popup_Widget
@@ -938,6 +940,7 @@ class WaveClustWidget(QtWidgets.QWidget):
         self.make_ss_label_list()
         self.make_cs_label_list()
         self.extract_template()
+        self.umap_process_start()
         self.make_scatter_list()
         self.make_clust_centers()
         self.popUp_scatterPlot()
@@ -991,9 +994,11 @@ class WaveClustWidget(QtWidgets.QWidget):
         if self._localDataBase["is_ss"]:
             signals_lib.extract_ss_pca(self._workingDataBase)
             signals_lib.extract_ss_scatter(self._workingDataBase)
+            self.umap_process_start()
         else:
             signals_lib.extract_cs_pca(self._workingDataBase)
             signals_lib.extract_cs_scatter(self._workingDataBase)
+            self.umap_process_start()
 
         self.comboBx_scatterPlot_PcaNum1_Changed()
         self.comboBx_scatterPlot_PcaNum2_Changed()
@@ -1042,9 +1047,11 @@ class WaveClustWidget(QtWidgets.QWidget):
         if self._localDataBase["is_ss"]:
             signals_lib.extract_ss_pca(self._workingDataBase)
             signals_lib.extract_ss_scatter(self._workingDataBase)
+            self.umap_process_start()
         else:
             signals_lib.extract_cs_pca(self._workingDataBase)
             signals_lib.extract_cs_scatter(self._workingDataBase)
+            self.umap_process_start()
 
         self.comboBx_scatterPlot_PcaNum1_Changed()
         self.comboBx_scatterPlot_PcaNum2_Changed()
@@ -1676,6 +1683,7 @@ class WaveClustWidget(QtWidgets.QWidget):
             signals_lib.extract_ss_time(self._workingDataBase)
             signals_lib.extract_ss_pca(self._workingDataBase)
             signals_lib.extract_ss_scatter(self._workingDataBase)
+            self.umap_process_start()
             self.make_ss_label_list()
         else:
             self.update_cs_labels()
@@ -1686,6 +1694,7 @@ class WaveClustWidget(QtWidgets.QWidget):
             signals_lib.extract_cs_time(self._workingDataBase)
             signals_lib.extract_cs_pca(self._workingDataBase)
             signals_lib.extract_cs_scatter(self._workingDataBase)
+            self.umap_process_start()
             self.make_cs_label_list()
 
         # Reset and remove ROI from the plot
@@ -1755,6 +1764,7 @@ class WaveClustWidget(QtWidgets.QWidget):
 
         signals_lib.extract_ss_scatter(self._workingDataBase)
         signals_lib.extract_cs_scatter(self._workingDataBase)
+        self.umap_process_start()
 
         self.make_ss_label_list()
         self.make_cs_label_list()
@@ -2335,6 +2345,7 @@ class WaveClustWidget(QtWidgets.QWidget):
         signals_lib.extract_cs_pca(self._workingDataBase)
         signals_lib.extract_ss_scatter(self._workingDataBase)
         signals_lib.extract_cs_scatter(self._workingDataBase)
+        self.umap_process_start()
         self.make_scatter_list()
         self.make_clust_centers()
         self.comboBx_scatterPlot_PcaNum1_Changed()
@@ -2345,6 +2356,39 @@ class WaveClustWidget(QtWidgets.QWidget):
 
         return 0
 
+    def umap_process_start(self):
+        # submit the embeddings which extract_ss_pca/extract_cs_pca left pending
+        for spike_type in ("ss", "cs"):
+            if not self._workingDataBase[spike_type + "_umap_isPending"][0]:
+                continue
+            self._workingDataBase[spike_type + "_umap_isPending"][0] = False
+            self.umapRunner.submit(
+                spike_type,
+                **signals_lib.get_umap_args(self._workingDataBase, spike_type),
+            )
+        return 0
+
+    def umap_process_finished(self, spike_type, spike_id, embedding):
+        # the spikes might have been changed while the embedding was being computed
+        if not self._workingDataBase["umap_enable"][0]:
+            return 0
+        if not np.array_equal(
+            spike_id, np.flatnonzero(self._workingDataBase[spike_type + "_index"])
+        ):
+            return 0
+        self._workingDataBase[spike_type + "_umap1"] = deepcopy(embedding[:, 0])
+        self._workingDataBase[spike_type + "_umap2"] = deepcopy(embedding[:, 1])
+        if spike_type == "ss":
+            signals_lib.extract_ss_scatter(self._workingDataBase)
+        else:
+            signals_lib.extract_cs_scatter(self._workingDataBase)
+        self.make_scatter_list()
+        self.make_clust_centers()
+        self.comboBx_scatterPlot_PcaNum1_Changed()
+        self.comboBx_scatterPlot_PcaNum2_Changed()
+        self.plot_scatter_popUp()
+        return 0
+
     def reset_plots(self):
         # scatter plot
         self._workingDataBase["popUp_ROI_x"] = np.zeros((0), dtype=np.float32)
@@ -2905,10 +2949,12 @@ class WaveClustWidget(QtWidgets.QWidget):
         return 0
 
     def popUp_task_completed(self):
+        self.umapRunner.cancel()
         self.scatterPoints_popUp_reset_ROI()
         return 0
 
     def popUp_task_cancelled(self):
+        self.umapRunner.cancel()
         self.scatterPoints_popUp_reset_ROI()
         self._localDataBase["ss_index_labels"] = np.copy(
             self._localDataBase["ss_index_labels_old"]
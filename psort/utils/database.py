@@ -1,4 +1,7 @@
 import os
+import shutil
+import tempfile
+import weakref
 from copy import deepcopy
 
 import numpy as np
@@ -8,6 +11,7 @@ from psort.utils import dictionaries, lib
 
 class PsortDataBase:
     def __init__(self):
+        self._memmap_dir = None
         self._grandDataBase = []
         self._grandDataBase.clear()
         self._grandDataBase.append(deepcopy(dictionaries._singleSlotDataBase))
@@ -61,17 +65,16 @@ class PsortDataBase:
         # hard reset _topLevelDataBase
         self._topLevelDataBase["current_slot_num"][0] = current_slot_num
         self._topLevelDataBase["total_slot_num"][0] = total_slot_num
-        self._topLevelDataBase["ch_data"] = deepcopy(ch_data)
+        # a memory-mapped ch_data stays on disk, copying it would pull it into RAM
+        if isinstance(ch_data, np.memmap):
+            self._topLevelDataBase["ch_data"] = ch_data
+        else:
+            self._topLevelDataBase["ch_data"] = deepcopy(ch_data)
         self._topLevelDataBase["ch_time"] = deepcopy(ch_time)
-        self._topLevelDataBase["ss_index"] = np.zeros(
-            (self._topLevelDataBase["ch_data"].size), dtype=bool
-        )
-        self._topLevelDataBase["cs_index"] = np.zeros(
-            (self._topLevelDataBase["ch_data"].size), dtype=bool
-        )
-        self._topLevelDataBase["cs_index_slow"] = np.zeros(
-            (self._topLevelDataBase["ch_data"].size), dtype=bool
-        )
+        # the spikes are kept as sorted sample indices, see get_slot_index
+        self._topLevelDataBase["ss_index"] = np.zeros((0), dtype=np.int64)
+        self._topLevelDataBase["cs_index"] = np.zeros((0), dtype=np.int64)
+        self._topLevelDataBase["cs_index_slow"] = np.zeros((0), dtype=np.int64)
         self._topLevelDataBase["index_slot_edges"] = deepcopy(index_slot_edges)
         self._topLevelDataBase["sample_rate"][0] = sample_rate
 
@@ -90,7 +93,9 @@ class PsortDataBase:
         index_slot_edges[0] = 0
         index_slot_edges[-1] = self._grandDataBase[-1]["ch_data"].size
         total_slot_num = index_slot_edges.size - 1
-        topLevelDataBase_bkp = deepcopy(self._grandDataBase[-1])
+        # the old topLevel dict is dropped below, so its values can be moved over as
+        # they are, a deepcopy would pull a memory-mapped ch_data into RAM
+        topLevelDataBase_bkp = self._grandDataBase[-1]
         # _grandDataBase is a list of dict with len : total_slot_num+1
         # index 0 up to total_slot_num-1 belong to single SlotDataBase
         # index total_slot_num or (-2) is the current SlotDataBase
@@ -112,7 +117,7 @@ class PsortDataBase:
         self._grandDataBase[-2] = deepcopy(self._grandDataBase[current_slot_num])
         # soft reset _topLevelDataBase
         for key in topLevelDataBase_bkp.keys():
-            self._topLevelDataBase[key] = deepcopy(topLevelDataBase_bkp[key])
+            self._topLevelDataBase[key] = topLevelDataBase_bkp[key]
         del topLevelDataBase_bkp
         self._topLevelDataBase["index_slot_edges"] = deepcopy(index_slot_edges)
         self._topLevelDataBase["total_slot_num"][0] = total_slot_num
@@ -136,7 +141,9 @@ class PsortDataBase:
 
     def changeCurrentSlot_to(self, slot_num):
         old_slot_num = self._topLevelDataBase["current_slot_num"][0]
-        self.saveCurrentSlot_to(old_slot_num)
+        # the current_slot is replaced right after, so hand it over to the old slot
+        # instead of copying it there and copying the new slot back again
+        self._grandDataBase[old_slot_num] = self._grandDataBase[-2]
         new_slot_num = slot_num
         self.loadCurrentSlot_from(new_slot_num)
         return int(self._topLevelDataBase["current_slot_num"][0])
@@ -172,14 +179,21 @@ class PsortDataBase:
                     self._grandDataBase[-1][key] = deepcopy(
                         dictionaries._topLevelDataBase[key]
                     )
+            # the spike indices are saved as bool masks, see lib.PSORT_INDEX_KEYS
+            for key in ("ss_index", "cs_index", "cs_index_slow"):
+                self._grandDataBase[-1][key] = lib.index_bool_to_int(
+                    self._grandDataBase[-1][key]
+                )
             self._currentSlotDataBase = self._grandDataBase[-2]
             self._topLevelDataBase = self._grandDataBase[-1]
             self.set_file_fullPath(file_fullPath)
             return 0
 
         if not (isCommonAverage):
-            _ch_data = deepcopy(ch_data)
-            _ch_time = deepcopy(ch_time)
+            _ch_data = self.store_signal(ch_data, "ch_data")
+            _ch_time = lib.TimeRamp.from_array(ch_time)
+            if _ch_time is None:
+                _ch_time = np.array(ch_time)
             _sample_rate = deepcopy(sample_rate)
             self.init_slotsDataBase_hard(_ch_data, _ch_time, _sample_rate)
             self.set_file_fullPath(file_fullPath)
@@ -195,8 +209,10 @@ class PsortDataBase:
                 self._topLevelDataBase["file_fullPathCommonAvg"] = np.array(
                     [file_fullPath], dtype=np.unicode_
                 )
-                self._topLevelDataBase["ch_data"] = (
-                    self._topLevelDataBase["ch_data"] - _ch_data_cmn
+                self.replace_signal(
+                    "ch_data",
+                    lambda chunk, index_start, index_end: chunk
+                    - _ch_data_cmn[index_start:index_end],
                 )
             else:
                 print(
@@ -215,15 +231,85 @@ class PsortDataBase:
         )
         self._topLevelDataBase["isLfpSideloaded"][0] = True
         # check _ch_data_lfp_orig size
-        if _ch_data_lfp_orig.size == _ch_data.size:
-            self._topLevelDataBase["ch_lfp"] = deepcopy(_ch_data_lfp_orig)
-        else:
+        if not (_ch_data_lfp_orig.size == _ch_data.size):
             _ch_data_lfp_orig = lib.resample(
-                x_input=_ch_time_lfp_orig, y_input=_ch_data_lfp_orig, x_output=_ch_time
+                x_input=np.asarray(_ch_time_lfp_orig),
+                y_input=np.asarray(_ch_data_lfp_orig),
+                x_output=_ch_time,
+            )
+        self.release_signal(self._topLevelDataBase.get("ch_lfp"))
+        self._topLevelDataBase["ch_lfp"] = self.store_signal(
+            _ch_data_lfp_orig, "ch_lfp"
+        )
+        return 0
+
+    def store_signal(self, data, key, func=None):
+        # signals above lib.MEMMAP_MIN_NBYTES are written to a sidecar .npy and
+        # memory-mapped read-only, so only the pages of the visited slots are in RAM
+        # data can be any sliceable signal, e.g. a lib.LazySignal of a loader, it is
+        # copied one chunk at a time
+        if isinstance(data, lib.ScaledSignal) and (func is None):
+            # only the native samples are stored, they stay compact
+            return lib.ScaledSignal(
+                self.store_signal(data.raw, key), data.gain, data.offset
             )
-            self._topLevelDataBase["ch_lfp"] = deepcopy(_ch_data_lfp_orig)
+        if (
+            isinstance(data, np.memmap)
+            and (func is None)
+            and (data.ndim == 1)
+            and (data.mode == "r")
+        ):
+            # already a read-only memmap, nothing to copy
+            return data
+        if data.nbytes < lib.MEMMAP_MIN_NBYTES:
+            if func is None:
+                return np.array(data)
+            return np.asarray(func(np.asarray(data), 0, data.size), dtype=data.dtype)
+        file_descriptor, memmap_fullPath = tempfile.mkstemp(
+            prefix=key + "_", suffix=".npy", dir=self.get_memmap_dir()
+        )
+        os.close(file_descriptor)
+        return lib.memmap_signal(memmap_fullPath, data, func=func)
+
+    def replace_signal(self, key, func):
+        # apply func(chunk, index_start, index_end) to a topLevel signal
+        data = self._topLevelDataBase[key]
+        self._topLevelDataBase[key] = self.store_signal(data, key, func=func)
+        self.release_signal(data)
+        return 0
+
+    def scale_signal(self, key, scale_value):
+        data = self._topLevelDataBase[key]
+        if isinstance(data, lib.ScaledSignal):
+            self._topLevelDataBase[key] = data.scaled(scale_value)
+            return 0
+        self.replace_signal(
+            key, lambda chunk, index_start, index_end: chunk * scale_value
+        )
         return 0
 
+    def release_signal(self, data):
+        # drop the sidecar of a signal which is not part of the dataBase anymore
+        # the views still held elsewhere stay valid, the OS frees the file after them
+        if isinstance(data, lib.ScaledSignal):
+            data = data.raw
+        if not isinstance(data, np.memmap) or (self._memmap_dir is None):
+            return 0
+        if os.path.dirname(os.path.abspath(data.filename)) == self._memmap_dir:
+            try:
+                os.remove(data.filename)
+            except OSError:
+                pass
+        return 0
+
+    def get_memmap_dir(self):
+        # one folder per session in the temp folder, tempfile.gettempdir, which can
+        # be moved with the TMPDIR environment variable; removed with the PsortDataBase
+        if self._memmap_dir is None:
+            self._memmap_dir = os.path.abspath(tempfile.mkdtemp(prefix="psort_"))
+            weakref.finalize(self, shutil.rmtree, self._memmap_dir, True)
+        return self._memmap_dir
+
     def is_all_slots_analyzed(self):
         self.saveCurrentSlot_to(self._topLevelDataBase["current_slot_num"][0])
         total_slot_isAnalyzed = self.get_total_slot_isAnalyzed()
@@ -272,12 +358,100 @@ class PsortDataBase:
         # This function should be used just for save data function
         return self._grandDataBase
 
+    def get_grandDataBase_snapshot(self, guiSignals_workingDataBase=None):
+        # copy of the grandDataBase for a save running in the background, with the
+        # current slot taken from guiSignals_workingDataBase if given; the large
+        # topLevel arrays are shared as they are only ever replaced, and the slots
+        # not read yet from a .psort file are None
+        snapshot = []
+        for counter_slot in range(len(self._grandDataBase) - 1):
+            if isinstance(self._grandDataBase, lib.LazyGrandDataBase) and not (
+                self._grandDataBase.is_loaded(counter_slot)
+            ):
+                snapshot.append(None)
+            else:
+                snapshot.append(deepcopy(self._grandDataBase[counter_slot]))
+        topLevel_snapshot = {}
+        for key, value in self._topLevelDataBase.items():
+            if isinstance(value, np.ndarray) and (value.size < lib.MEMMAP_CHUNK_LEN):
+                value = value.copy()
+            topLevel_snapshot[key] = value
+        snapshot.append(topLevel_snapshot)
+        if guiSignals_workingDataBase is None:
+            return snapshot
+        currentSlot_snapshot = snapshot[-2]
+        for key in currentSlot_snapshot.keys():
+            currentSlot_snapshot[key] = deepcopy(guiSignals_workingDataBase[key])
+        index_start_on_ch_data = currentSlot_snapshot["index_start_on_ch_data"][0]
+        index_end_on_ch_data = currentSlot_snapshot["index_end_on_ch_data"][0]
+        for key in ("ss_index", "cs_index", "cs_index_slow"):
+            topLevel_snapshot[key] = lib.index_int_replace(
+                topLevel_snapshot[key],
+                index_start_on_ch_data,
+                index_end_on_ch_data,
+                lib.index_bool_to_int(guiSignals_workingDataBase[key]),
+            )
+        return snapshot
+
     def get_currentSlotDataBase(self):
         return deepcopy(self._currentSlotDataBase)
 
     def get_topLevelDataBase(self):
         return deepcopy(self._grandDataBase[-1])
 
+    def get_topLevelDataBase_view(self):
+        # read-only views of the topLevel arrays, nothing is copied
+        # writing to them raises, use update_dataBase_based_on_signals instead
+        topLevelDataBase_view = {}
+        for key in self._grandDataBase[-1].keys():
+            value = self._grandDataBase[-1][key]
+            if isinstance(value, np.ndarray):
+                value = value.view()
+                value.flags.writeable = False
+            topLevelDataBase_view[key] = value
+        return topLevelDataBase_view
+
+    def get_slot_view(self, key, slot_num=None):
+        # read-only view of a topLevel array over the bounds of slot_num
+        if slot_num is None:
+            slot_num = int(self._topLevelDataBase["current_slot_num"][0])
+        index_start_on_ch_data = self._grandDataBase[slot_num][
+            "index_start_on_ch_data"
+        ][0]
+        index_end_on_ch_data = self._grandDataBase[slot_num]["index_end_on_ch_data"][0]
+        value = self._grandDataBase[-1][key]
+        if isinstance(value, lib.ScaledSignal):
+            # the native samples of the slot, they are decoded chunk by chunk where
+            # they are read, see signals_lib.filter_recording_or_slot
+            value_raw = value.raw[index_start_on_ch_data:index_end_on_ch_data]
+            if isinstance(value_raw, np.ndarray):
+                value_raw.flags.writeable = False
+            return lib.ScaledSignal(value_raw, value.gain, value.offset)
+        value = value[index_start_on_ch_data:index_end_on_ch_data]
+        # a lazy signal, e.g. a TimeRamp, may not hand out an np.ndarray
+        if isinstance(value, np.ndarray):
+            value.flags.writeable = False
+        return value
+
+    def get_slot_index(self, key, slot_num=None):
+        # bool mask of a topLevel spike index over the bounds of slot_num
+        if slot_num is None:
+            slot_num = int(self._topLevelDataBase["current_slot_num"][0])
+        index_start_on_ch_data = int(
+            self._grandDataBase[slot_num]["index_start_on_ch_data"][0]
+        )
+        index_end_on_ch_data = int(
+            self._grandDataBase[slot_num]["index_end_on_ch_data"][0]
+        )
+        return lib.index_int_to_bool(
+            lib.index_int_slice(
+                self._grandDataBase[-1][key],
+                index_start_on_ch_data,
+                index_end_on_ch_data,
+            ),
+            index_end_on_ch_data - index_start_on_ch_data,
+        )
+
     def reassign_slot_boundaries(self, index_slot_edges, restart_mode="soft"):
         self.init_slotsDataBase_soft(index_slot_edges)
         isAnalyzed_ = True
@@ -299,15 +473,13 @@ class PsortDataBase:
 
         index_start_on_ch_data = psortDataBase_currentSlot["index_start_on_ch_data"][0]
         index_end_on_ch_data = psortDataBase_currentSlot["index_end_on_ch_data"][0]
-        psortDataBase_topLevel["ss_index"][
-            index_start_on_ch_data:index_end_on_ch_data
-        ] = guiSignals_workingDataBase["ss_index"]
-        psortDataBase_topLevel["cs_index"][
-            index_start_on_ch_data:index_end_on_ch_data
-        ] = guiSignals_workingDataBase["cs_index"]
-        psortDataBase_topLevel["cs_index_slow"][
-            index_start_on_ch_data:index_end_on_ch_data
-        ] = guiSignals_workingDataBase["cs_index_slow"]
+        for key in ("ss_index", "cs_index", "cs_index_slow"):
+            psortDataBase_topLevel[key] = lib.index_int_replace(
+                psortDataBase_topLevel[key],
+                index_start_on_ch_data,
+                index_end_on_ch_data,
+                lib.index_bool_to_int(guiSignals_workingDataBase[key]),
+            )
         return 0
 
     def backward_compatibility_for_Psort_03(self):
@@ -97,6 +97,9 @@ GLOBAL_DICT = {
     "GLOBAL_CS_ALIGN_CSTEMPLATE_BEFORE": np.array([0.004], dtype=np.float32),
     # second, default is 0.001s  or 1ms
     "GLOBAL_CS_ALIGN_CSTEMPLATE_AFTER": np.array([0.001], dtype=np.float32),
+    # Integer, number of spikes UMAP is fitted on, the others are projected onto
+    # them, default is 20000, 0 fits all the spikes
+    "GLOBAL_UMAP_LANDMARK_NUM": np.array([20000], dtype=np.uint32),
 }
 
 
@@ -196,9 +199,9 @@ _topLevelDataBase = {
     "total_slot_isAnalyzed": np.zeros((1), dtype=np.uint32),
     "ch_data": np.zeros((0), dtype=np.float64),
     "ch_time": np.zeros((0), dtype=np.float64),
-    "ss_index": np.zeros((0), dtype=bool),
-    "cs_index_slow": np.zeros((0), dtype=bool),
-    "cs_index": np.zeros((0), dtype=bool),
+    "ss_index": np.zeros((0), dtype=np.int64),
+    "cs_index_slow": np.zeros((0), dtype=np.int64),
+    "cs_index": np.zeros((0), dtype=np.int64),
     "sample_rate": np.zeros((1), dtype=np.uint32),
     "isLfpSideloaded": np.zeros((1), dtype=bool),
 }
@@ -268,17 +271,17 @@ _workingDataBase = {
     "cs_scatter1": np.zeros((0), dtype=np.float32),
     "cs_scatter2": np.zeros((0), dtype=np.float32),
     "umap_enable": np.array([False], dtype=bool),
+    "flag_umap_async": np.array([False], dtype=bool),
+    "ss_umap_isPending": np.array([False], dtype=bool),
+    "cs_umap_isPending": np.array([False], dtype=bool),
     "popUp_ROI_x": np.zeros((0), dtype=np.float32),
     "popUp_ROI_y": np.zeros((0), dtype=np.float32),
     "popUp_mode": np.array(["ss_pca_manual"], dtype=np.unicode_),
     "flag_index_detection": np.array([True], dtype=bool),
     "flag_tools_prefrences": np.array([False], dtype=bool),
-    "ss_index_undoRedo": np.zeros((0, 0), dtype=bool),
-    "cs_index_slow_undoRedo": np.zeros((0, 0), dtype=bool),
-    "cs_index_undoRedo": np.zeros((0, 0), dtype=bool),
     "index_undoRedo": np.zeros((1), dtype=int),
     "length_undoRedo": np.zeros((1), dtype=int),
-    "batch_size_undoRedo": np.full((1), 20, dtype=np.uint32),
+    "max_length_undoRedo": np.full((1), 200, dtype=np.uint32),
     "isLfpSideloaded": np.zeros((1), dtype=bool),
 }
 
@@ -291,5 +294,10 @@ _fileDataBase = {
     "isMainSignal": np.zeros((1), dtype=bool),
     "isCommonAverage": np.zeros((1), dtype=bool),
     "isLfpSignal": np.zeros((1), dtype=bool),
+    "autosave_file_fullPath": np.array([""], dtype=np.unicode_),
+    # minute, default is 5min, 0 disables the autosave
+    "autosave_interval": np.array([5], dtype=np.uint32),
 }
+# the prefrences of the session, they are kept in _fileDataBase and not per slot
+SESSION_PREFRENCES_KEYS = ["autosave_interval"]
 ## ################################################################################################
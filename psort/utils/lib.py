@@ -1,14 +1,24 @@
+import atexit
+import functools
+import hashlib
 import os
+import shutil
 import sys
+import tempfile
+import threading
+import weakref
+from collections.abc import MutableSequence
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 from numbers import Number
 
+import h5py
 import numpy as np
 import pkg_resources
 import pyqtgraph as pg
 import scipy.stats
+import tables
 from matplotlib import path
-from neo.io import spike2io
 from numba import jit
 from PyQt5 import QtCore, QtGui
 from scipy import signal
@@ -30,6 +40,19 @@ GLOBAL_FONT.setPointSize(10)
 GLOBAL_FONT.setWeight(QtGui.QFont.Normal)
 GLOBAL_PG_PEN = pg.mkPen(color="k", width=1, style=QtCore.Qt.SolidLine)
 nanLabel = -9999
+# PyTables, h5py and the HDF5 library under them are not thread safe, every access to
+# an .h5, .mat or .psort file takes turns on this lock, whichever thread it runs in.
+# It is reentrant as the locked functions call each other.
+_H5_LOCK = threading.RLock()
+
+
+def h5_locked(func):
+    @functools.wraps(func)
+    def h5_locked_func(*args, **kwargs):
+        with _H5_LOCK:
+            return func(*args, **kwargs)
+
+    return h5_locked_func
 
 
 # Set widget Defaults
@@ -76,7 +99,7 @@ def get_fullPath_components(file_fullPath):
     return file_fullPath, file_path, file_name, file_ext, file_name_without_ext
 
 
-def load_file_continuous(file_fullPath):
+def load_file_continuous(file_fullPath, isCompact=False):
     _, _, _, file_ext, _ = get_fullPath_components(file_fullPath)
     if not (file_ext == ".continuous"):
         print("Error: <lib.load_file_continuous: file extension is not .continuous.>")
@@ -84,30 +107,264 @@ def load_file_continuous(file_fullPath):
     if not (os.path.isfile(file_fullPath)):
         print("Error: <lib.load_file_continuous: file_fullPath is not valid>")
         return 0, 0, 0
-    data_continuous = openephys_package.OpenEphys.load(file_fullPath)
-    ch_data = deepcopy(data_continuous["data"])
+    data_continuous = load_continuous_records(file_fullPath)
+    if data_continuous is None:
+        return 0, 0, 0
+    samples = data_continuous["samples"]
+    bitVolts = data_continuous["header"]["bitVolts"]
+    # the records are only read when ch_data is, one block at a time
+    if isCompact:
+        # the int16 samples are kept, decoded on the fly with bitVolts
+        ch_data = ScaledSignal(
+            LazySignal(
+                lambda index_start, index_end: read_continuous_samples(
+                    samples, bitVolts, index_start, index_end, isRaw=True
+                ),
+                samples.size,
+                dtype=np.int16,
+            ),
+            gain=bitVolts,
+        )
+    else:
+        ch_data = LazySignal(
+            lambda index_start, index_end: read_continuous_samples(
+                samples, bitVolts, index_start, index_end
+            ),
+            samples.size,
+        )
     sample_rate = int(data_continuous["header"]["sampleRate"])
-    ch_time_first_element = float(data_continuous["timestamps"][0]) / float(
-        data_continuous["header"]["sampleRate"]
+    ch_time = TimeRamp(
+        float(data_continuous["timestamps"][0]) / float(sample_rate),
+        1.0 / float(sample_rate),
+        ch_data.size,
     )
-    ch_time_size = ch_data.size
-    time_step = 1.0 / float(sample_rate)
-    time_range = time_step * ch_time_size
-    ch_time_last_element = ch_time_first_element + time_range - time_step
-    ch_time = np.linspace(
-        ch_time_first_element,
-        ch_time_last_element,
-        num=ch_time_size,
-        endpoint=True,
-        dtype=float,
+    return ch_data, ch_time, sample_rate
+
+
+# OpenEphys readers
+# The records of the OpenEphys files have a fixed layout, so instead of reading them
+# field by field they are mapped as one structured array right after the 1024 byte
+# header. Nothing is read from disk until a field is accessed.
+OPENEPHYS_HEADER_BYTES = 1024
+OPENEPHYS_SAMPLES_PER_RECORD = 1024
+OPENEPHYS_CONTINUOUS_RECORD_DTYPE = np.dtype(
+    [
+        ("timestamp", "<i8"),
+        ("N", "<u2"),
+        ("recordingNumber", ">u2"),
+        ("samples", ">i2", (OPENEPHYS_SAMPLES_PER_RECORD,)),
+        ("marker", "u1", (10,)),
+    ]
+)
+
+
+def load_openephys_header(file_fullPath):
+    with open(file_fullPath, "rb") as file_handle:
+        header = openephys_package.OpenEphys.readHeader(file_handle)
+    return header
+
+
+def load_openephys_records(file_fullPath, record_dtype, allow_partial=False):
+    # read-only memmap of the records, None if the file size does not fit the layout
+    # with allow_partial a trailing incomplete record, e.g. of an interrupted
+    # acquisition, is ignored instead
+    record_bytes = os.path.getsize(file_fullPath) - OPENEPHYS_HEADER_BYTES
+    if record_bytes < 0:
+        return None
+    if record_bytes % record_dtype.itemsize != 0:
+        if not allow_partial:
+            return None
+        print(
+            "Warning: <lib.load_openephys_records: "
+            + "ignoring the incomplete last record.>"
+        )
+    num_records = record_bytes // record_dtype.itemsize
+    if num_records == 0:
+        return np.zeros((0), dtype=record_dtype)
+    return np.memmap(
+        file_fullPath,
+        dtype=record_dtype,
+        mode="r",
+        offset=OPENEPHYS_HEADER_BYTES,
+        shape=(num_records,),
     )
-    if not (ch_time.size == ch_data.size):
+
+
+def load_continuous_records(file_fullPath):
+    """
+    -> same fields as OpenEphys.loadContinuous, but samples is the memory-mapped
+       (num_records, 1024) big-endian int16 array, see continuous_samples_to_float
+    """
+    records = load_openephys_records(file_fullPath, OPENEPHYS_CONTINUOUS_RECORD_DTYPE)
+    if records is None:
         print(
-            "Error: <lib.load_file_continuous: "
-            + "size of ch_time and ch_data are not the same.>"
+            "Error: <lib.load_continuous_records: "
+            + "file size is not consistent with a continuous file.>"
         )
-    del data_continuous
-    return ch_data, ch_time, sample_rate
+        return None
+    if np.any(records["N"] != OPENEPHYS_SAMPLES_PER_RECORD):
+        print("Error: <lib.load_continuous_records: found corrupted record.>")
+        return None
+    data_continuous = {}
+    data_continuous["header"] = load_openephys_header(file_fullPath)
+    data_continuous["timestamps"] = np.array(records["timestamp"], dtype=np.int64)
+    data_continuous["recordingNumber"] = np.array(
+        records["recordingNumber"], dtype=np.uint16
+    )
+    data_continuous["samples"] = records["samples"]
+    return data_continuous
+
+
+def get_spikes_record_dtype(num_channels, num_samples):
+    return np.dtype(
+        [
+            ("eventType", "u1"),
+            ("timestamp", "<i8"),
+            ("software_timestamp", "<i8"),
+            ("source", "<u2"),
+            ("numChannels", "<u2"),
+            ("numSamples", "<u2"),
+            ("sortedId", "<u2"),
+            ("electrodeId", "<u2"),
+            ("channel", "<u2"),
+            ("color", "u1", (3,)),
+            ("pcProj", "<f4", (2,)),
+            ("sampleFreq", "<u2"),
+            ("waveforms", "<u2", (num_channels, num_samples)),
+            ("gain", "<f4", (num_channels,)),
+            ("thresh", "<u2", (num_channels,)),
+            ("recordingNumber", "<u2"),
+        ]
+    )
+
+
+OPENEPHYS_EVENTS_RECORD_DTYPE = np.dtype(
+    [
+        ("timestamp", "<i8"),
+        ("sampleNum", "<i2"),
+        ("eventType", "u1"),
+        ("nodeId", "u1"),
+        ("eventId", "u1"),
+        ("channel", "u1"),
+        ("recordingNumber", "<u2"),
+    ]
+)
+
+
+def load_spikes_records(file_fullPath):
+    """
+    -> columnar version of OpenEphys.loadSpikes, every field is one array over all
+       the spikes of the file, spikes is (num_spikes, num_samples, num_channels) in uV
+    -> the record size is taken from the first record, a file with mixed record sizes
+       is rejected
+    """
+    header = load_openephys_header(file_fullPath)
+    if float(header.get(" version", header.get("version", 0))) < 0.4:
+        print("Error: <lib.load_spikes_records: .spikes version is older than 0.4.>")
+        return None
+    # numChannels and numSamples of the first record define the record size
+    num_channels, num_samples = 0, 0
+    with open(file_fullPath, "rb") as file_handle:
+        file_handle.seek(OPENEPHYS_HEADER_BYTES + 1 + 8 + 8 + 2)
+        _shape = np.fromfile(file_handle, np.dtype("<u2"), 2)
+    if _shape.size == 2:
+        num_channels, num_samples = int(_shape[0]), int(_shape[1])
+    record_dtype = get_spikes_record_dtype(num_channels, num_samples)
+    records = load_openephys_records(file_fullPath, record_dtype, allow_partial=True)
+    if records is None:
+        print(
+            "Error: <lib.load_spikes_records: "
+            + "file size is not consistent with a spikes file.>"
+        )
+        return None
+    if np.any(records["numChannels"] != num_channels) or np.any(
+        records["numSamples"] != num_samples
+    ):
+        print("Error: <lib.load_spikes_records: records have different sizes.>")
+        return None
+    data_spikes = {}
+    data_spikes["header"] = header
+    for key in (
+        "timestamp",
+        "software_timestamp",
+        "source",
+        "sortedId",
+        "electrodeId",
+        "channel",
+        "color",
+        "pcProj",
+        "sampleFreq",
+        "gain",
+        "thresh",
+        "recordingNumber",
+    ):
+        data_spikes[key] = np.array(records[key])
+    data_spikes["timestamps"] = data_spikes.pop("timestamp")
+    # uV = (waveform - 32768) / (gain * 1000), stored as samples by channels
+    spikes = records["waveforms"].astype(np.float64) - 32768.0
+    spikes /= data_spikes["gain"][:, :, np.newaxis] * 1000.0
+    data_spikes["spikes"] = np.ascontiguousarray(spikes.transpose(0, 2, 1))
+    return data_spikes
+
+
+def load_events_records(file_fullPath):
+    """
+    -> columnar version of OpenEphys.loadEvents, every field is one array over all
+       the events of the file
+    """
+    header = load_openephys_header(file_fullPath)
+    if float(header.get(" version", header.get("version", 0))) < 0.4:
+        print("Error: <lib.load_events_records: .events version is older than 0.4.>")
+        return None
+    records = load_openephys_records(
+        file_fullPath, OPENEPHYS_EVENTS_RECORD_DTYPE, allow_partial=True
+    )
+    if records is None:
+        print(
+            "Error: <lib.load_events_records: "
+            + "file size is not consistent with an events file.>"
+        )
+        return None
+    data_events = {}
+    data_events["header"] = header
+    for key in OPENEPHYS_EVENTS_RECORD_DTYPE.names:
+        data_events[key] = np.array(records[key])
+    data_events["timestamps"] = data_events.pop("timestamp")
+    return data_events
+
+
+def continuous_samples_to_float(samples, bitVolts, chunk_records=4096, out=None):
+    # convert to voltage a chunk of records at a time, so the only full size array is
+    # the float output
+    if out is None:
+        ch_data = np.zeros((samples.size), dtype=np.float64)
+    else:
+        ch_data = out
+    _ch_data = ch_data.reshape(samples.shape)
+    bitVolts = float(bitVolts)
+    for index_start in range(0, samples.shape[0], chunk_records):
+        index_end = min(index_start + chunk_records, samples.shape[0])
+        np.multiply(
+            samples[index_start:index_end],
+            bitVolts,
+            out=_ch_data[index_start:index_end],
+        )
+    return ch_data
+
+
+def read_continuous_samples(samples, bitVolts, index_start, index_end, isRaw=False):
+    # only the records that overlap the block are read, with isRaw the samples are
+    # returned as native int16 instead of voltage
+    record_start = index_start // OPENEPHYS_SAMPLES_PER_RECORD
+    record_end = -(-index_end // OPENEPHYS_SAMPLES_PER_RECORD)
+    offset = record_start * OPENEPHYS_SAMPLES_PER_RECORD
+    if isRaw:
+        data_records = np.array(samples[record_start:record_end], dtype=np.int16)
+    else:
+        data_records = continuous_samples_to_float(
+            samples[record_start:record_end], bitVolts
+        )
+    return data_records.reshape(-1)[index_start - offset : index_end - offset]
 
 
 def load_file_matlab(file_fullPath):
@@ -118,9 +375,19 @@ def load_file_matlab(file_fullPath):
     if not (os.path.isfile(file_fullPath)):
         print("Error: <lib.load_file_matlab: file_fullPath is not valid>")
         return 0, 0, 0
-    data_mat = pymatreader_package.pymatreader.read_mat(file_fullPath)
-    ch_data = deepcopy(data_mat["ch_data"])
-    ch_time = deepcopy(data_mat["ch_time"])
+    matlab_reader = MatlabH5Reader(file_fullPath)
+    if matlab_reader.data_size is not None:
+        ch_data = matlab_reader.read("ch_data")
+        ch_time = matlab_reader.read("ch_time")
+        sample_rate = matlab_reader.sample_rate
+        matlab_reader.close()
+        return ch_data, ch_time, sample_rate
+    # v5 files, or v7.3 files with ch_data/ch_time stored in another form
+    data_mat = pymatreader_package.pymatreader.read_mat(
+        file_fullPath, variable_names=MATLAB_VARIABLE_NAMES
+    )
+    ch_data = data_mat["ch_data"]
+    ch_time = data_mat["ch_time"]
     if "ch_info" in data_mat:
         sample_rate = int(data_mat["ch_info"]["header"]["sampleRate"])
     elif "sample_rate" in data_mat:
@@ -131,7 +398,109 @@ def load_file_matlab(file_fullPath):
     return ch_data, ch_time, sample_rate
 
 
-def load_file_h5(file_fullPath):
+# MATLAB v7.3 reader
+# From v7.3 on a .mat file is an HDF5 file with one dataset per variable, so only
+# the ch_data, ch_time and sample_rate datasets are opened and the other variables
+# of the file are never read. MATLAB stores the vectors as (1, N) or (N, 1).
+MATLAB_VARIABLE_NAMES = ["ch_data", "ch_time", "ch_info", "sample_rate"]
+MATLAB_SAMPLE_RATE_PATHS = ("ch_info/header/sampleRate", "sample_rate")
+
+
+class MatlabH5Reader:
+    """
+    -> partial reads of the ch_data and ch_time vectors of a v7.3 .mat file,
+       converted by HDF5 straight into the float64 output
+    -> data_size is None if the file is not a v7.3 file or has no ch_data and
+       ch_time vectors of the same size, it is then left to read_mat
+    """
+
+    def __init__(self, file_fullPath):
+        self.file_fullPath = file_fullPath
+        self.data_size = None
+        self.sample_rate = 0
+        self._h5file = None
+        self._dataset_dict = {}
+        if not (h5py.is_hdf5(file_fullPath)):
+            return None
+        with _H5_LOCK:
+            h5file = h5py.File(file_fullPath, "r")
+            dataset_dict = {}
+            for key in ("ch_data", "ch_time"):
+                dataset = h5file.get(key)
+                if not (
+                    isinstance(dataset, h5py.Dataset)
+                    and (dataset.ndim in (1, 2))
+                    and (dataset.size == max(dataset.shape, default=0))
+                    and (dataset.dtype.kind in "iuf")
+                    and not ("MATLAB_empty" in dataset.attrs)
+                ):
+                    h5file.close()
+                    return None
+                dataset_dict[key] = dataset
+            if not (dataset_dict["ch_data"].size == dataset_dict["ch_time"].size):
+                h5file.close()
+                return None
+            self._h5file = h5file
+            self._dataset_dict = dataset_dict
+            self.data_size = int(dataset_dict["ch_data"].size)
+            self.sample_rate = self.get_sample_rate()
+        return None
+
+    def get_sample_rate(self):
+        for sample_rate_path in MATLAB_SAMPLE_RATE_PATHS:
+            dataset = self._h5file.get(sample_rate_path)
+            if isinstance(dataset, h5py.Dataset) and (dataset.size > 0):
+                return int(np.asarray(dataset[()]).reshape(-1)[0])
+        # the mean of diff(ch_time) only depends on its first and last element
+        ch_time = self._dataset_dict["ch_time"]
+        index_last = self.data_size - 1
+        time_first = float(ch_time[self.get_selection(ch_time, 0, 1)].flat[0])
+        time_last = float(
+            ch_time[self.get_selection(ch_time, index_last, index_last + 1)].flat[0]
+        )
+        return int(np.round(float(self.data_size - 1) / (time_last - time_first)))
+
+    @staticmethod
+    def get_selection(dataset, index_start, index_end):
+        # the singleton axis is kept, HDF5 reads an integer index element-wise
+        if dataset.ndim == 1:
+            return np.s_[index_start:index_end]
+        if dataset.shape[0] == 1:
+            return np.s_[:, index_start:index_end]
+        return np.s_[index_start:index_end, :]
+
+    def read(self, key, index_start=0, index_end=None, out=None):
+        if (index_end is None) or (index_end > self.data_size):
+            index_end = self.data_size
+        if out is None:
+            out = np.zeros((index_end - index_start), dtype=np.float64)
+        if index_end > index_start:
+            dataset = self._dataset_dict[key]
+            # out is written through a view of the same shape as the selection
+            if dataset.ndim == 1:
+                out_view = out
+            elif dataset.shape[0] == 1:
+                out_view = out.reshape((1, -1))
+            else:
+                out_view = out.reshape((-1, 1))
+            with _H5_LOCK:
+                dataset.read_direct(
+                    out_view,
+                    source_sel=self.get_selection(dataset, index_start, index_end),
+                )
+        return out
+
+    def close(self):
+        if self._h5file is not None:
+            with _H5_LOCK:
+                self._h5file.close()
+        self._h5file = None
+        self._dataset_dict = {}
+        return 0
+
+
+@h5_locked
+def load_file_h5(file_fullPath, isCompact=False):
     _, _, _, file_ext, _ = get_fullPath_components(file_fullPath)
     if not (file_ext == ".h5"):
         print("Error: <lib.load_file_h5: file extension is not .h5.>")
@@ -139,15 +508,61 @@ def load_file_h5(file_fullPath):
     if not (os.path.isfile(file_fullPath)):
         print("Error: <lib.load_file_h5: file_fullPath is not valid>")
         return 0, 0, 0
+    with tables.open_file(file_fullPath, mode="r") as h5file:
+        ch_data_scale = get_h5_signal_scale(h5file.root.ch_data)
+        isLazy = (
+            ("/sample_rate" in h5file)
+            and isinstance(h5file.root.ch_data, tables.Array)
+            and isinstance(h5file.root.ch_time, tables.Array)
+            and (h5file.root.ch_data.ndim == 1)
+            and (h5file.root.ch_time.shape == h5file.root.ch_data.shape)
+            and not ("zeroarray_dtype" in h5file.root.ch_data._v_attrs)
+        )
+        if isLazy:
+            ch_data = H5SignalView(
+                file_fullPath,
+                "/ch_data",
+                h5file.root.ch_data.shape,
+                h5file.root.ch_data.atom.dtype,
+            )
+            ch_time = H5SignalView(
+                file_fullPath,
+                "/ch_time",
+                h5file.root.ch_time.shape,
+                h5file.root.ch_time.atom.dtype,
+            )
+            sample_rate = h5file.root.sample_rate[0]
+    if isLazy:
+        # ch_data and ch_time are read from the file when they are used, one
+        # block at a time
+        if ch_data_scale is None:
+            return ch_data, ch_time, sample_rate
+        if isCompact:
+            return ScaledSignal(ch_data, *ch_data_scale), ch_time, sample_rate
+        ch_data_view = ch_data
+        ch_data = LazySignal(
+            lambda index_start, index_end: (
+                ch_data_view[index_start:index_end] * ch_data_scale[0]
+                + ch_data_scale[1]
+            ),
+            ch_data_view.size,
+        )
+        return ch_data, ch_time, sample_rate
     load_dict = deepdish.io.load(file_fullPath)
-    ch_data = deepcopy(load_dict["ch_data"])
+    if ch_data_scale is None:
+        ch_data = deepcopy(load_dict["ch_data"])
+    elif isCompact:
+        ch_data = ScaledSignal(load_dict["ch_data"], *ch_data_scale)
+    else:
+        ch_data = load_dict["ch_data"] * ch_data_scale[0] + ch_data_scale[1]
     ch_time = deepcopy(load_dict["ch_time"])
     sample_rate = load_dict["sample_rate"][0]
     del load_dict
     return ch_data, ch_time, sample_rate
 
 
-def load_file_psort(file_fullPath):
+@h5_locked
+def load_file_psort(file_fullPath, signal_keys=None):
     _, _, _, file_ext, _ = get_fullPath_components(file_fullPath)
     if not (file_ext == ".psort"):
         print("Error: <lib.load_file_psort: file extension is not .psort.>")
@@ -155,11 +570,335 @@ def load_file_psort(file_fullPath):
     if not (os.path.isfile(file_fullPath)):
         print("Error: <lib.load_file_psort: file_fullPath is not valid>")
         return 0
-    grandDataBase = deepdish.io.load(file_fullPath)
+    if not (LazyGrandDataBase.is_lazy_loadable(file_fullPath)):
+        grandDataBase = deepdish.io.load(file_fullPath)
+        return grandDataBase
+    # only the topLevel and the signals of signal_keys are read now, the slots are
+    # read the first time they are used and the other signals are read from the
+    # file a slice at a time, see LazyGrandDataBase.keep_signal_views
+    if signal_keys is None:
+        signal_keys = ()
+    grandDataBase = LazyGrandDataBase(file_fullPath)
+    # the changes autosaved after the file was last saved
+    merge_file_psort_journal(grandDataBase, file_fullPath)
+    grandDataBase.load_signals(signal_keys)
+    grandDataBase.keep_signal_views()
     return grandDataBase
 
 
-def load_file_smr(file_fullPath, ch_index):
+# Spike2 reader
+# A .smr file (CED SON format, Spike2 up to v8) starts with a file header followed
+# by one 140 byte header per channel at SMR_CHANNEL_HEADER_OFFSET. The samples of a
+# waveform channel are kept in a linked list of blocks, each one starting with a
+# 20 byte block header. The headers are parsed once per file and the samples are
+# read through a memmap of the file.
+SMR_CHANNEL_HEADER_OFFSET = 512
+SMR_DISK_BLOCK_BYTES = 512
+SMR_FILE_HEADER_DTYPE = np.dtype(
+    [
+        ("system_id", "<i2"),
+        ("copyright", "S10"),
+        ("creator", "S8"),
+        ("us_per_time", "<i2"),
+        ("time_per_adc", "<i2"),
+        ("filestate", "<i2"),
+        ("first_data", "<i4"),
+        ("channels", "<i2"),
+        ("chan_size", "<i2"),
+        ("extra_data", "<i2"),
+        ("buffersize", "<i2"),
+        ("os_format", "<i2"),
+        ("max_ftime", "<i4"),
+        ("dtime_base", "<f8"),
+    ]
+)
+# scale/offset of the Adc channels are min/max for the RealWave channels and divide
+# is the clock divider of the files before system_id 6, the interleave after it
+SMR_CHANNEL_HEADER_DTYPE = np.dtype(
+    [
+        ("del_size", "<i2"),
+        ("next_del_block", "<i4"),
+        ("firstblock", "<i4"),
+        ("lastblock", "<i4"),
+        ("blocks", "<i2"),
+        ("n_extra", "<i2"),
+        ("pre_trig", "<i2"),
+        ("free0", "<i2"),
+        ("py_sz", "<i2"),
+        ("max_data", "<i2"),
+        ("comment", "S72"),
+        ("max_chan_time", "<i4"),
+        ("l_chan_dvd", "<i4"),
+        ("phy_chan", "<i2"),
+        ("title", "S10"),
+        ("ideal_rate", "<f4"),
+        ("kind", "u1"),
+        ("unused1", "i1"),
+        ("scale", "<f4"),
+        ("offset", "<f4"),
+        ("unit", "S6"),
+        ("divide", "<i2"),
+    ]
+)
+SMR_BLOCK_HEADER_DTYPE = np.dtype(
+    [
+        ("pred_block", "<i4"),
+        ("succ_block", "<i4"),
+        ("start_time", "<i4"),
+        ("end_time", "<i4"),
+        ("channel_num", "<i2"),
+        ("items", "<i2"),
+    ]
+)
+# kind 1 is Adc (int16 samples), kind 9 is RealWave (float32 samples)
+SMR_WAVEFORM_DTYPES = {1: np.dtype("<i2"), 9: np.dtype("<f4")}
+_smr_file_reader_cache = {}
+
+
+def smr_pascal_string(value):
+    # the strings of a .smr header are stored with their length in the first byte
+    value = bytes(value)
+    if len(value) == 0:
+        return ""
+    return value[1 : value[0] + 1].decode("iso-8859-1")
+
+
+class SmrFileReader:
+    """
+    -> waveform channels (Adc and RealWave) of a Spike2 .smr file, without neo
+    -> channel_list[ch_index] describes the channel read by read(ch_index, ...),
+       the samples are converted to float32 from a memmap of the file, only for
+       the requested index range
+    -> data_size is None if the file could not be parsed
+    """
+
+    def __init__(self, file_fullPath):
+        self.file_fullPath = file_fullPath
+        self.data_size = None
+        self.channel_list = []
+        file_size = os.path.getsize(file_fullPath)
+        if file_size < SMR_CHANNEL_HEADER_OFFSET:
+            print("Error: <lib.SmrFileReader: file is too small for a .smr file.>")
+            return None
+        self._memmap = np.memmap(file_fullPath, dtype=np.uint8, mode="r")
+        file_header = self._memmap[: SMR_FILE_HEADER_DTYPE.itemsize].view(
+            SMR_FILE_HEADER_DTYPE
+        )[0]
+        system_id = int(file_header["system_id"])
+        us_per_time = float(file_header["us_per_time"])
+        num_channels = int(file_header["channels"])
+        if (system_id < 1) or (system_id > 9) or (num_channels < 1):
+            print("Error: <lib.SmrFileReader: file header is not a .smr header.>")
+            return None
+        if system_id < 6:
+            dtime_base = 1e-6
+        else:
+            dtime_base = float(file_header["dtime_base"])
+        # from system_id 9 on, the block pointers count disk blocks, not bytes
+        if system_id == 9:
+            block_unit = SMR_DISK_BLOCK_BYTES
+        else:
+            block_unit = 1
+        self.time_base = us_per_time * dtime_base
+        channel_headers = self._memmap[
+            SMR_CHANNEL_HEADER_OFFSET : SMR_CHANNEL_HEADER_OFFSET
+            + num_channels * SMR_CHANNEL_HEADER_DTYPE.itemsize
+        ].view(SMR_CHANNEL_HEADER_DTYPE)
+        for counter_channel in range(num_channels):
+            channel_header = channel_headers[counter_channel]
+            kind = int(channel_header["kind"])
+            if not (kind in SMR_WAVEFORM_DTYPES):
+                continue
+            if system_id < 6:
+                sample_interval = (
+                    float(channel_header["divide"])
+                    * us_per_time
+                    * float(file_header["time_per_adc"])
+                    * 1e-6
+                )
+            else:
+                sample_interval = float(channel_header["l_chan_dvd"]) * self.time_base
+            if not (sample_interval > 0):
+                continue
+            blocks = self.get_block_table(
+                int(channel_header["firstblock"]),
+                int(channel_header["blocks"]),
+                block_unit,
+                file_size,
+            )
+            if blocks is None:
+                print(
+                    "Error: <lib.SmrFileReader: "
+                    + "broken block list in channel "
+                    + str(counter_channel)
+                    + ".>"
+                )
+                return None
+            channel = {}
+            channel["channel_num"] = counter_channel
+            channel["title"] = smr_pascal_string(channel_header["title"])
+            channel["unit"] = smr_pascal_string(channel_header["unit"])
+            channel["kind"] = kind
+            channel["dtype"] = SMR_WAVEFORM_DTYPES[kind]
+            channel["sample_interval"] = sample_interval
+            channel["sample_rate"] = 1.0 / sample_interval
+            if kind == 1:
+                channel["gain"] = float(channel_header["scale"]) / 6553.6
+                channel["offset"] = float(channel_header["offset"])
+            else:
+                channel["gain"] = 1.0
+                channel["offset"] = 0.0
+            channel["blocks"] = blocks
+            channel["data_size"] = int(blocks["size"].sum())
+            channel["block_view"] = self.get_block_view(blocks, channel["dtype"])
+            self.channel_list.append(channel)
+        self.data_size = [channel["data_size"] for channel in self.channel_list]
+        return None
+
+    def get_block_table(self, first_block, num_blocks, block_unit, file_size):
+        # (pos, size, cumsum, start_time) of the blocks in the order of the list,
+        # pos is the byte offset of the samples, start_time is in clock ticks
+        blocks = np.zeros(
+            (num_blocks),
+            dtype=[
+                ("pos", np.int64),
+                ("size", np.int64),
+                ("cumsum", np.int64),
+                ("start_time", np.int64),
+            ],
+        )
+        header_pos = first_block * block_unit
+        for counter_block in range(num_blocks):
+            if (header_pos <= 0) or (
+                header_pos + SMR_BLOCK_HEADER_DTYPE.itemsize > file_size
+            ):
+                return None
+            block_header = self._memmap[
+                header_pos : header_pos + SMR_BLOCK_HEADER_DTYPE.itemsize
+            ].view(SMR_BLOCK_HEADER_DTYPE)[0]
+            blocks[counter_block]["pos"] = header_pos + SMR_BLOCK_HEADER_DTYPE.itemsize
+            blocks[counter_block]["size"] = block_header["items"]
+            blocks[counter_block]["start_time"] = block_header["start_time"]
+            header_pos = int(block_header["succ_block"]) * block_unit
+        blocks["cumsum"][1:] = np.cumsum(blocks["size"][:-1])
+        return blocks
+
+    def get_block_view(self, blocks, dtype):
+        # when the leading blocks have the same size and are evenly spaced in the
+        # file, they are mapped as one (num_blocks, block_size) array, so whole
+        # blocks are converted at once instead of one by one
+        if blocks.size < 2:
+            return None
+        block_size = int(blocks["size"][0])
+        block_stride = int(blocks["pos"][1] - blocks["pos"][0])
+        if (block_size < 1) or (block_stride < block_size * dtype.itemsize):
+            return None
+        isRegular = (blocks["size"] == block_size) & (
+            blocks["pos"] == blocks["pos"][0] + np.arange(blocks.size) * block_stride
+        )
+        num_regular = blocks.size if isRegular.all() else int(np.argmin(isRegular))
+        if num_regular < 2:
+            return None
+        return np.ndarray(
+            (num_regular, block_size),
+            dtype=dtype,
+            buffer=self._memmap,
+            offset=int(blocks["pos"][0]),
+            strides=(block_stride, dtype.itemsize),
+        )
+
+    def read(self, ch_index, index_start=0, index_end=None, out=None, isRaw=False):
+        # with isRaw the native samples are copied as they are, without the scale
+        channel = self.channel_list[int(ch_index)]
+        if (index_end is None) or (index_end > channel["data_size"]):
+            index_end = channel["data_size"]
+        if out is None:
+            out = np.zeros(
+                (index_end - index_start),
+                dtype=channel["dtype"] if isRaw else np.float32,
+            )
+        blocks = channel["blocks"]
+        block_view = channel["block_view"]
+        counter_block = np.searchsorted(blocks["cumsum"], index_start, side="right") - 1
+        index = index_start
+        while index < index_end:
+            block_offset = index - int(blocks["cumsum"][counter_block])
+            num_whole_blocks = 0
+            if (block_view is not None) and (block_offset == 0):
+                num_whole_blocks = min(
+                    block_view.shape[0] - counter_block,
+                    (index_end - index) // block_view.shape[1],
+                )
+            if num_whole_blocks > 0:
+                samples = block_view[counter_block : counter_block + num_whole_blocks]
+                counter_block += num_whole_blocks
+            else:
+                block_pos = int(blocks["pos"][counter_block])
+                block_size = int(blocks["size"][counter_block])
+                samples = self._memmap[
+                    block_pos : block_pos + block_size * channel["dtype"].itemsize
+                ].view(channel["dtype"])
+                samples = samples[block_offset : block_offset + index_end - index]
+                counter_block += 1
+            out_chunk = out[
+                index - index_start : index - index_start + samples.size
+            ].reshape(samples.shape)
+            if isRaw:
+                out_chunk[...] = samples
+            else:
+                np.multiply(
+                    samples,
+                    channel["gain"],
+                    out=out_chunk,
+                    dtype=out.dtype,
+                    casting="unsafe",
+                )
+                out_chunk += channel["offset"]
+            index += samples.size
+        return out
+
+    def read_time(self, ch_index, index_start=0, index_end=None):
+        channel = self.channel_list[int(ch_index)]
+        if (index_end is None) or (index_end > channel["data_size"]):
+            index_end = channel["data_size"]
+        blocks = channel["blocks"]
+        index = np.arange(index_start, index_end)
+        counter_block = np.searchsorted(blocks["cumsum"], index, side="right") - 1
+        return (
+            blocks["start_time"][counter_block] * self.time_base
+            + (index - blocks["cumsum"][counter_block]) * channel["sample_interval"]
+        )
+
+    def get_time_ramp(self, ch_index):
+        # the blocks follow each other without pauses in the recording
+        channel = self.channel_list[int(ch_index)]
+        blocks = channel["blocks"]
+        if blocks.size == 0:
+            return None
+        block_time = blocks["start_time"] * self.time_base
+        ramp_time = block_time[0] + blocks["cumsum"] * channel["sample_interval"]
+        if np.any(np.abs(block_time - ramp_time) > channel["sample_interval"]):
+            return None
+        return TimeRamp(block_time[0], channel["sample_interval"], channel["data_size"])
+
+
+def get_smr_file_reader(file_fullPath):
+    # the reader of a file is kept until the file changes on disk
+    file_realPath = os.path.realpath(file_fullPath)
+    file_stat = os.stat(file_realPath)
+    cache_key = (file_stat.st_mtime_ns, file_stat.st_size)
+    cache_entry = _smr_file_reader_cache.get(file_realPath)
+    if (cache_entry is not None) and (cache_entry[0] == cache_key):
+        return cache_entry[1]
+    reader = SmrFileReader(file_realPath)
+    if reader.data_size is None:
+        _smr_file_reader_cache.pop(file_realPath, None)
+        return None
+    _smr_file_reader_cache[file_realPath] = (cache_key, reader)
+    return reader
+
+
+def load_file_smr(file_fullPath, ch_index, isCompact=False):
     _, _, _, file_ext, _ = get_fullPath_components(file_fullPath)
     if not (file_ext == ".smr"):
         print("Error: <lib.load_file_smr: file extension is not .smr.>")
@@ -167,16 +906,51 @@ def load_file_smr(file_fullPath, ch_index):
     if not (os.path.isfile(file_fullPath)):
         print("Error: <lib.load_file_smr: file_fullPath is not valid>")
         return 0, 0, 0
-    reader = spike2io.Spike2IO(filename=file_fullPath)
-    seg = reader.read_segment(lazy=True)
-    sigproxy = seg.analogsignals[int(ch_index)]
-    asig = sigproxy.load(time_slice=None)
-    ch_data = np.array(asig)
-    ch_data = deepcopy(ch_data.reshape(-1).astype(np.float64))
-    ch_time = asig.times.rescale("s").magnitude
-    ch_time = deepcopy(ch_time.reshape(-1).astype(np.float64))
-    sample_rate = float(asig.sampling_rate)
-    del reader, seg, sigproxy, asig
+    reader = get_smr_file_reader(file_fullPath)
+    if reader is None:
+        return 0, 0, 0
+    if not (0 <= int(ch_index) < len(reader.channel_list)):
+        print("Error: <lib.load_file_smr: ch_index is not valid>")
+        return 0, 0, 0
+    data_size = reader.data_size[int(ch_index)]
+    channel = reader.channel_list[int(ch_index)]
+    # the blocks are only read when ch_data is, one chunk at a time
+    if isCompact:
+        ch_data = ScaledSignal(
+            LazySignal(
+                lambda index_start, index_end: reader.read(
+                    ch_index, index_start, index_end, isRaw=True
+                ),
+                data_size,
+                dtype=channel["dtype"],
+            ),
+            gain=channel["gain"],
+            offset=channel["offset"],
+        )
+    else:
+        # converted straight into float64, without a float32 copy
+        ch_data = LazySignal(
+            lambda index_start, index_end: reader.read(
+                ch_index,
+                index_start,
+                index_end,
+                out=np.zeros((index_end - index_start), dtype=np.float64),
+            ),
+            data_size,
+        )
+    ch_time = reader.get_time_ramp(ch_index)
+    if ch_time is None:
+        print(
+            "Warning: <lib.load_file_smr: "
+            + "the recording is paused, ch_time is not evenly sampled.>"
+        )
+        ch_time = LazySignal(
+            lambda index_start, index_end: reader.read_time(
+                ch_index, index_start, index_end
+            ),
+            data_size,
+        )
+    sample_rate = reader.channel_list[int(ch_index)]["sample_rate"]
     return ch_data, ch_time, sample_rate
 
 
@@ -184,31 +958,31 @@ def get_smr_file_info(file_fullPath):
     _, _, _, file_ext, _ = get_fullPath_components(file_fullPath)
     if not (file_ext == ".smr"):
         print("Error: <lib.get_smr_file_info: file extension is not .smr.>")
-        return "invalid_file_extension", 0
+        return "invalid_file_extension", 0, 0
     if not (os.path.isfile(file_fullPath)):
         print("Error: <lib.get_smr_file_info: file_fullPath is not valid>")
-        return "invalid_file_fullPath", 0
-    reader = spike2io.Spike2IO(filename=file_fullPath)
-    seg = reader.read_segment(lazy=True)
+        return "invalid_file_fullPath", 0, 0
+    reader = get_smr_file_reader(file_fullPath)
+    if (reader is None) or (len(reader.channel_list) == 0):
+        return "invalid_file_content", 0, 0
     sampling_rate_list = []
     info_str = ""
-    for counter_sig in range(len(seg.analogsignals)):
+    for counter_sig, channel in enumerate(reader.channel_list):
         info_str += (
             "ch_"
             + str(counter_sig)
             + "."
             + " sampling_rate: "
-            + str(round(seg.analogsignals[counter_sig].sampling_rate))
+            + str(round(channel["sample_rate"]))
             + "\t units: "
-            + str(seg.analogsignals[counter_sig].units)
+            + str(channel["unit"])
             + "\t name: "
-            + str(seg.analogsignals[counter_sig].name)
+            + str(channel["title"])
             + "\n"
         )
-        sampling_rate_list.append(round(seg.analogsignals[counter_sig].sampling_rate))
+        sampling_rate_list.append(round(channel["sample_rate"]))
     ch_index_max_sampling_rate = np.argmax(sampling_rate_list)
     num_channels = len(sampling_rate_list)
-    del reader, seg, sampling_rate_list
     return info_str, num_channels, ch_index_max_sampling_rate
 
 
@@ -218,26 +992,1489 @@ def save_file_h5(file_fullPath, ch_data, ch_time, sample_rate):
         file_fullPath = file_fullPath + ".h5"
     if not (os.path.isdir(file_path)):
         return "Error: <lib.save_file_h5: file_path is not valid>"
-    save_dict = {
-        "ch_data": ch_data,
-        "ch_time": ch_time,
-        "sample_rate": np.array([sample_rate]),
-    }
-    deepdish.io.save(file_fullPath, save_dict, "zlib")
-    del save_dict
+    # ch_data can also be an iterable of consecutive blocks, e.g. a streaming
+    # common average, every block is appended to the file as soon as it arrives
+    expectedrows = None
+    ch_data_dtype = np.float64
+    ch_data_scale = None
+    if isinstance(ch_data, ScaledSignal):
+        # the native samples are written, with their scale as an attribute
+        ch_data_scale = (ch_data.gain, ch_data.offset)
+        ch_data = ch_data.raw
+        ch_data_dtype = ch_data.dtype
+    ch_data_blocks = ch_data
+    if isinstance(ch_data, np.ndarray):
+        ch_data = ch_data.reshape(-1)
+        expectedrows = ch_data.size
+        ch_data_blocks = (
+            ch_data[index_start : index_start + MEMMAP_CHUNK_LEN]
+            for index_start in range(0, ch_data.size, MEMMAP_CHUNK_LEN)
+        )
+    h5file = open_file_h5_signal(
+        file_fullPath, sample_rate, expectedrows, ch_data_dtype, ch_data_scale
+    )
+    try:
+        index_start = 0
+        # the lock is not held while the next block is computed, its readers take it
+        for ch_data_block in ch_data_blocks:
+            ch_data_block = np.asarray(ch_data_block, dtype=ch_data_dtype).reshape(-1)
+            index_end = index_start + ch_data_block.size
+            ch_time_block = np.asarray(
+                ch_time[index_start:index_end], dtype=np.float64
+            ).reshape(-1)
+            with _H5_LOCK:
+                h5file.root.ch_data.append(ch_data_block)
+                h5file.root.ch_time.append(ch_time_block)
+            index_start = index_end
+    finally:
+        with _H5_LOCK:
+            h5file.close()
     return 0
 
 
+@h5_locked
+def open_file_h5_signal(
+    file_fullPath,
+    sample_rate,
+    expectedrows=None,
+    ch_data_dtype=np.float64,
+    ch_data_scale=None,
+):
+    """
+    -> creates an .h5 file with extendable ch_data and ch_time arrays, in the
+       same layout as deepdish.io.save so load_file_h5 reads it back unchanged
+    -> ch_data_scale is the (gain, offset) of native ch_data samples
+    """
+    h5file = tables.open_file(file_fullPath, mode="w")
+    h5file.root._v_attrs[deepdish.io.hdf5io.DEEPDISH_IO_VERSION_STR] = (
+        deepdish.io.hdf5io.IO_VERSION
+    )
+    # same compression as deepdish.io.save(..., "zlib")
+    filters = tables.Filters(complevel=9, complib="zlib", shuffle=True)
+    if expectedrows is None:
+        expectedrows = MEMMAP_CHUNK_LEN
+    for key, dtype in [("ch_data", ch_data_dtype), ("ch_time", np.float64)]:
+        h5file.create_earray(
+            h5file.root,
+            key,
+            atom=tables.Atom.from_dtype(np.dtype(dtype)),
+            shape=(0,),
+            filters=filters,
+            expectedrows=max(int(expectedrows), 1),
+        )
+    if ch_data_scale is not None:
+        h5file.root.ch_data._v_attrs[SIGNAL_SCALE_ATTR] = np.array(
+            ch_data_scale, dtype=np.float64
+        )
+    h5file.create_array(h5file.root, "sample_rate", obj=np.array([sample_rate]))
+    return h5file
+
+
 def save_file_psort(file_fullPath, grandDataBase):
+    """
+    -> saves the grandDataBase in the deepdish layout, so deepdish.io.load and
+       every version of psort can read it; the exception is a signal saved with
+       its native samples, a ScaledSignal, only the versions which know
+       SIGNAL_SCALE_ATTR decode it, the others read its raw integer samples
+    -> the raw signals are written once as chunked arrays with a fast codec,
+       see get_psort_filters
+    -> when the file already holds a grandDataBase of the same length, it is
+       copied next to the target, only the values whose digest changed since the
+       last save are written into the copy and the untouched slots of a
+       LazyGrandDataBase of that file are skipped; otherwise the file is written
+       anew next to the target; either way the new file is moved over the target
+       in a single rename, so a crash leaves the previous file intact
+    -> _H5_LOCK is taken per HDF5 call, the digests are computed without it, so
+       the signal views of other threads keep reading while the file is written
+    """
     _, file_path, _, file_ext, _ = get_fullPath_components(file_fullPath)
     if not (file_ext == ".psort"):
         file_fullPath = file_fullPath + ".psort"
     if not (os.path.isdir(file_path)):
         return "Error: <lib.save_file_psort: file_path is not valid>"
-    deepdish.io.save(file_fullPath, grandDataBase, "zlib")
+    close_h5_signal_view_files(file_fullPath)
+    num_entries = len(grandDataBase)
+    isUpdate = (
+        get_psort_num_entries(file_fullPath, isDigestRequired=True) == num_entries
+    )
+    isLazySource = isinstance(grandDataBase, LazyGrandDataBase) and (
+        os.path.realpath(grandDataBase.file_fullPath) == os.path.realpath(file_fullPath)
+    )
+    if isLazySource and not isUpdate:
+        # every slot still in the file is read before the file is replaced, the
+        # signals are copied from it chunk by chunk
+        grandDataBase.keep_signal_views()
+        grandDataBase = list(grandDataBase)
+        isLazySource = False
+    file_descriptor, save_fullPath = tempfile.mkstemp(
+        prefix=".psort_", suffix=".psort", dir=file_path
+    )
+    os.close(file_descriptor)
+    try:
+        if isUpdate:
+            # the copy is written to, the target is never modified in place
+            shutil.copyfile(file_fullPath, save_fullPath)
+        if os.path.isfile(file_fullPath):
+            # the new file keeps the permissions of the one it replaces
+            shutil.copymode(file_fullPath, save_fullPath)
+    except OSError:
+        os.remove(save_fullPath)
+        raise
+    with _H5_LOCK:
+        if isUpdate:
+            h5file = tables.open_file(save_fullPath, mode="a")
+        else:
+            h5file = tables.open_file(save_fullPath, mode="w")
+            h5file.root._v_attrs[deepdish.io.hdf5io.DEEPDISH_IO_VERSION_STR] = (
+                deepdish.io.hdf5io.IO_VERSION
+            )
+            h5file.root._v_attrs[deepdish.io.hdf5io.DEEPDISH_IO_UNPACK] = True
+            h5file.create_group(h5file.root, "data", "list:{}".format(num_entries))
+    signal_view_target = []
+    try:
+        filters = get_psort_filters()
+        with _H5_LOCK:
+            if "PSORT_DIGEST" in h5file.root._v_attrs:
+                digest_dict = dict(h5file.root._v_attrs["PSORT_DIGEST"])
+            else:
+                digest_dict = {}
+        for counter_entry in range(num_entries):
+            entry_name = "i{}".format(counter_entry)
+            if isLazySource and not grandDataBase.is_loaded(counter_entry):
+                continue
+            entry = dict(grandDataBase[counter_entry])
+            # the signals a LazyGrandDataBase has not read yet are already in its
+            # own file, or are copied from it chunk by chunk into another file
+            signal_view_keys = []
+            if isinstance(grandDataBase, LazyGrandDataBase) and (
+                counter_entry == num_entries - 1
+            ):
+                signal_view_dict = grandDataBase.get_signal_views()
+                signal_view_keys = list(signal_view_dict.keys())
+                if not isLazySource:
+                    entry.update(signal_view_dict)
+            isTopLevel = counter_entry == num_entries - 1
+            entry_digest = {}
+            for key, value in entry.items():
+                if isTopLevel and (key in PSORT_INDEX_KEYS):
+                    data_size = int(entry["index_slot_edges"][-1])
+                    entry_digest[key] = get_index_mask_digest(value, data_size)
+                else:
+                    entry_digest[key] = get_value_digest(value)
+            with _H5_LOCK:
+                if not (entry_name in h5file.root.data):
+                    h5file.create_group(h5file.root.data, entry_name)
+                group = h5file.root.data._f_get_child(entry_name)
+                group_keys = list(group._v_children.keys())
+                group_keys += group._v_attrs._f_list("user")
+                for key in group_keys:
+                    if not (key in entry) and not (key in signal_view_keys):
+                        remove_psort_value(group, key)
+                        digest_dict.pop(entry_name + "/" + key, None)
+            for key, value in entry.items():
+                digest_key = entry_name + "/" + key
+                signal_view = value.raw if isinstance(value, ScaledSignal) else value
+                if isinstance(signal_view, H5SignalView):
+                    # the node holds the same samples once the file is saved
+                    signal_view_target.append(
+                        (signal_view, group._v_pathname + "/" + key)
+                    )
+                digest = entry_digest[key]
+                with _H5_LOCK:
+                    isInFile = (key in group._v_children) or (key in group._v_attrs)
+                if isInFile and (digest is not None):
+                    if digest_dict.get(digest_key) == digest:
+                        continue
+                if isTopLevel and (key in PSORT_INDEX_KEYS):
+                    value = index_int_to_mask(value, data_size)
+                write_psort_value(h5file, group, key, value, filters)
+                digest_dict[digest_key] = digest
+            with _H5_LOCK:
+                group._v_title = "dict:{}".format(
+                    len(set(entry.keys()).union(signal_view_keys))
+                )
+        with _H5_LOCK:
+            h5file.root._v_attrs["PSORT_DIGEST"] = digest_dict
+    except Exception:
+        with _H5_LOCK:
+            h5file.close()
+        os.remove(save_fullPath)
+        raise
+    with _H5_LOCK:
+        h5file.close()
+        # a handle opened meanwhile would keep reading the replaced file, none
+        # is opened between the close and the rename while the lock is held
+        close_h5_signal_view_files(file_fullPath)
+        os.replace(save_fullPath, file_fullPath)
+        # the signals still read from a file are read from this one from now on,
+        # the file they came from may be replaced or removed
+        for signal_view, node_path in signal_view_target:
+            signal_view.retarget(file_fullPath, node_path)
+    return 0
+
+
+@h5_locked
+def get_psort_num_entries(file_fullPath, isDigestRequired=False):
+    # length of the grandDataBase in a .psort file, None if it is not a list of
+    # entries or, with isDigestRequired, if it was not saved by save_file_psort
+    if not (os.path.isfile(file_fullPath)):
+        return None
+    try:
+        with tables.open_file(file_fullPath, mode="r") as h5file:
+            if not ("/data" in h5file):
+                return None
+            node = h5file.get_node("/data")
+            if not (
+                isinstance(node, tables.Group) and node._v_title.startswith("list:")
+            ):
+                return None
+            if isDigestRequired and not ("PSORT_DIGEST" in h5file.root._v_attrs):
+                return None
+            return int(node._v_title.split(":")[1])
+    except (OSError, tables.HDF5ExtError):
+        return None
+
+
+def get_psort_filters():
+    # blosc:lz4 is a lot faster than zlib at a similar ratio on these signals,
+    # it is part of PyTables so every reader of the file can decode it
+    if "blosc:lz4" in tables.filters.all_complibs:
+        return tables.Filters(complevel=5, complib="blosc:lz4", shuffle=True)
+    return tables.Filters(complevel=1, complib="zlib", shuffle=True)
+
+
+# the spike indices and the signals of a session are replaced, never modified in
+# place, so the digest of a large array is computed once per array object
+_signal_digest_cache = {}
+
+
+def get_value_digest(value):
+    # None if the value cannot be compared, it is then written on every save
+    if isinstance(value, ScaledSignal):
+        # the native samples and the scale, as they are written to the file
+        cache_entry = _signal_digest_cache.get(id(value))
+        if (cache_entry is not None) and (cache_entry[0]() is value):
+            return cache_entry[1]
+        raw_digest = get_value_digest(value.raw)
+        if raw_digest is None:
+            return None
+        digest = hashlib.sha1(
+            "{}*{!r}+{!r}".format(raw_digest, value.gain, value.offset).encode("ascii")
+        ).hexdigest()
+        set_value_digest(value, digest)
+        return digest
+    if isinstance(value, np.ndarray):
+        if value.dtype == np.object_:
+            return None
+        value_flat = value.reshape(-1)
+    elif isinstance(value, (TimeRamp, H5SignalView)) and (value.ndim == 1):
+        # hashed by content, the same as the array read back from the file
+        value_flat = value
+    else:
+        return None
+    # a digest registered with set_value_digest is used whatever the size, the
+    # signal may not even be readable at the moment, e.g. while its file is written
+    cache_entry = _signal_digest_cache.get(id(value))
+    if (cache_entry is not None) and (cache_entry[0]() is value):
+        return cache_entry[1]
+    isLarge = value_flat.size * value_flat.dtype.itemsize >= MEMMAP_CHUNK_LEN
+    value_hash = hashlib.sha1(
+        "{}:{}".format(value.dtype.str, value.shape).encode("ascii")
+    )
+    for index_start in range(0, value_flat.size, MEMMAP_CHUNK_LEN):
+        value_hash.update(
+            np.ascontiguousarray(
+                value_flat[index_start : index_start + MEMMAP_CHUNK_LEN],
+                dtype=value.dtype,
+            )
+        )
+    digest = value_hash.hexdigest()
+    if isLarge:
+        set_value_digest(value, digest)
+    return digest
+
+
+def set_value_digest(value, digest):
+    # registers the known digest of a large array, e.g. one just read from a file
+    key = id(value)
+    _signal_digest_cache[key] = (
+        weakref.ref(value, lambda _, key=key: _signal_digest_cache.pop(key, None)),
+        digest,
+    )
+    return 0
+
+
+def remove_psort_value(group, key):
+    with _H5_LOCK:
+        if key in group._v_children:
+            group._f_get_child(key)._f_remove(recursive=True)
+        elif key in group._v_attrs:
+            group._v_attrs._f_remove(key)
+    return 0
+
+
+def write_psort_value(h5file, group, key, value, filters):
+    # takes _H5_LOCK per HDF5 call, a signal is read outside of it chunk by chunk
+    with _H5_LOCK:
+        node = group._v_children.get(key)
+        # a numeric array that keeps its shape is overwritten in place, so the
+        # repeated saves do not leave unused space behind in the file
+        if (
+            isinstance(value, np.ndarray)
+            and (value.dtype.kind in "biuf")
+            and (value.size > 0)
+            and isinstance(node, tables.Array)
+            and not ("zeroarray_dtype" in node._v_attrs)
+            and not (SIGNAL_SCALE_ATTR in node._v_attrs)
+            and (node.shape == value.shape)
+            and (node.atom.dtype == value.dtype)
+        ):
+            node[...] = value
+            return 0
+    remove_psort_value(group, key)
+    if (key in PSORT_SIGNAL_KEYS) and (value.ndim == 1) and (value.size > 0):
+        signal_scale = None
+        if isinstance(value, ScaledSignal):
+            # the native samples are written, with their scale as an attribute
+            signal_scale = (value.gain, value.offset)
+            value = value.raw
+        data_size = value.size
+        with _H5_LOCK:
+            node = h5file.create_carray(
+                group,
+                key,
+                atom=tables.Atom.from_dtype(np.dtype(value.dtype)),
+                shape=(data_size,),
+                filters=filters,
+                chunkshape=(min(data_size, PSORT_SIGNAL_CHUNK_LEN),),
+            )
+        for index_start in range(0, data_size, MEMMAP_CHUNK_LEN):
+            index_end = min(index_start + MEMMAP_CHUNK_LEN, data_size)
+            data_chunk = np.asarray(value[index_start:index_end])
+            with _H5_LOCK:
+                node[index_start:index_end] = data_chunk
+        if signal_scale is not None:
+            with _H5_LOCK:
+                node._v_attrs[SIGNAL_SCALE_ATTR] = np.array(
+                    signal_scale, dtype=np.float64
+                )
+        return 0
+    with _H5_LOCK:
+        deepdish.io.hdf5io._save_level(
+            h5file, group, value, name=key, filters=filters, idtable={}
+        )
+    return 0
+
+
+# Autosave journal
+# The autosave never writes into a .psort file that already exists. The entries that
+# differ from it are written to a journal next to it instead, which is merged back
+# when the file is loaded and removed once the session is saved. The raw signals of
+# the topLevel, e.g. after a common average, are too large to be written on every
+# autosave, they are written once to a sidecar and the journal records their digest.
+_psort_file_digest_cache = {}
+
+
+def get_psort_journal_fullPath(file_fullPath):
+    return file_fullPath + ".journal"
+
+
+def get_psort_signals_fullPath(file_fullPath):
+    return file_fullPath + ".signals"
+
+
+def get_psort_file_digest(file_fullPath):
+    """
+    -> digest of every value of a .psort file, as recorded by save_file_psort,
+       for a file of an older version it is computed once from its content
+    -> None if the file is not a .psort list of entries
+    """
+    num_entries = get_psort_num_entries(file_fullPath)
+    if num_entries is None:
+        return None
+    file_stat = os.stat(file_fullPath)
+    cache_key = (os.path.realpath(file_fullPath), file_stat.st_mtime_ns)
+    if not (cache_key in _psort_file_digest_cache):
+        with _H5_LOCK:
+            with tables.open_file(file_fullPath, mode="r") as h5file:
+                if "PSORT_DIGEST" in h5file.root._v_attrs:
+                    digest_dict = dict(h5file.root._v_attrs["PSORT_DIGEST"])
+                else:
+                    digest_dict = None
+        if digest_dict is None:
+            grandDataBase = LazyGrandDataBase(file_fullPath)
+            entry_list = list(grandDataBase)
+            entry_list[-1] = dict(entry_list[-1])
+            entry_list[-1].update(grandDataBase.get_signal_views())
+            digest_dict = {}
+            for counter_entry in range(num_entries):
+                entry_name = "i{}".format(counter_entry)
+                isTopLevel = counter_entry == num_entries - 1
+                for key, value in entry_list[counter_entry].items():
+                    if isTopLevel and (key in PSORT_INDEX_KEYS):
+                        digest = get_index_mask_digest(
+                            value, int(entry_list[-1]["index_slot_edges"][-1])
+                        )
+                    else:
+                        digest = get_value_digest(value)
+                    digest_dict[entry_name + "/" + key] = digest
+        _psort_file_digest_cache.clear()
+        _psort_file_digest_cache[cache_key] = digest_dict
+    return _psort_file_digest_cache[cache_key]
+
+
+def get_digest_dict_hash(digest_dict):
+    return hashlib.sha1(repr(sorted(digest_dict.items())).encode("utf-8")).hexdigest()
+
+
+def get_psort_signals_digest(signals_fullPath):
+    # {key: digest} of the signals in the sidecar, empty if there is none
+    if not (os.path.isfile(signals_fullPath)):
+        return {}
+    try:
+        with _H5_LOCK:
+            with tables.open_file(signals_fullPath, mode="r") as h5file:
+                if not ("PSORT_DIGEST" in h5file.root._v_attrs):
+                    return {}
+                return dict(h5file.root._v_attrs["PSORT_DIGEST"])
+    except (OSError, tables.HDF5ExtError):
+        return {}
+
+
+def save_file_psort_signals(file_fullPath, signal_dict):
+    """
+    -> writes the raw signals of the journal, {key: (value, digest)}, to the
+       sidecar of the .psort file at file_fullPath, the signals of the sidecar
+       which are not in signal_dict are removed
+    -> nothing is written while the sidecar holds the same digests, so a signal
+       is written once, not on every autosave
+    -> the sidecar is copied, updated and moved over itself in a single rename,
+       so a crash leaves the previous one intact
+    """
+    signals_fullPath = get_psort_signals_fullPath(file_fullPath)
+    sidecar_digest_dict = get_psort_signals_digest(signals_fullPath)
+    digest_dict = {key: digest for key, (_, digest) in signal_dict.items()}
+    if sidecar_digest_dict == digest_dict:
+        return 0
+    file_descriptor, save_fullPath = tempfile.mkstemp(
+        prefix=".psort_", suffix=".signals", dir=os.path.dirname(signals_fullPath)
+    )
+    os.close(file_descriptor)
+    isUpdate = len(sidecar_digest_dict) > 0
+    try:
+        if isUpdate:
+            shutil.copyfile(signals_fullPath, save_fullPath)
+    except OSError:
+        os.remove(save_fullPath)
+        raise
+    with _H5_LOCK:
+        h5file = tables.open_file(save_fullPath, mode="a" if isUpdate else "w")
+    try:
+        filters = get_psort_filters()
+        for key in set(sidecar_digest_dict.keys()).difference(digest_dict.keys()):
+            remove_psort_value(h5file.root, key)
+        for key, (value, digest) in signal_dict.items():
+            if sidecar_digest_dict.get(key) == digest:
+                continue
+            write_psort_value(h5file, h5file.root, key, value, filters)
+        with _H5_LOCK:
+            h5file.root._v_attrs["PSORT_DIGEST"] = digest_dict
+    except Exception:
+        with _H5_LOCK:
+            h5file.close()
+        os.remove(save_fullPath)
+        raise
+    with _H5_LOCK:
+        h5file.close()
+        close_h5_signal_view_files(signals_fullPath)
+        os.replace(save_fullPath, signals_fullPath)
+    return 0
+
+
+def save_file_psort_journal(file_fullPath, grandDataBase):
+    """
+    -> writes the entries of grandDataBase which differ from the .psort file at
+       file_fullPath to its journal, entries that are None are unchanged
+    -> a changed slot is written whole, of the topLevel only the changed values,
+       the changed raw signals to the sidecar, see save_file_psort_signals
+    -> the new journal replaces the old one in a single rename, so a crash leaves
+       one of the two intact
+    """
+    base_digest_dict = get_psort_file_digest(file_fullPath)
+    if base_digest_dict is None:
+        return "Error: <lib.save_file_psort_journal: file_fullPath is not valid>"
+    base_num_entries = get_psort_num_entries(file_fullPath)
+    num_entries = len(grandDataBase)
+    journal_entries = {}
+    signal_dict = {}
+    for counter_entry in range(num_entries):
+        entry = grandDataBase[counter_entry]
+        if entry is None:
+            continue
+        isTopLevel = counter_entry == num_entries - 1
+        # the topLevel is compared with the topLevel of the file
+        if isTopLevel:
+            base_entry_name = "i{}".format(base_num_entries - 1)
+        else:
+            base_entry_name = "i{}".format(counter_entry)
+        changed_entry = {}
+        for key, value in entry.items():
+            isIndex = isTopLevel and (key in PSORT_INDEX_KEYS)
+            if isIndex:
+                data_size = int(entry["index_slot_edges"][-1])
+                digest = get_index_mask_digest(value, data_size)
+            else:
+                digest = get_value_digest(value)
+            if (digest is not None) and (
+                base_digest_dict.get(base_entry_name + "/" + key) == digest
+            ):
+                continue
+            if isTopLevel and (key in PSORT_SIGNAL_KEYS) and (digest is not None):
+                signal_dict[key] = (value, digest)
+                continue
+            if isinstance(value, (TimeRamp, H5SignalView, ScaledSignal)):
+                value = np.asarray(value)
+            if isIndex:
+                value = index_int_to_mask(value, data_size)
+            changed_entry[key] = value
+        if isTopLevel:
+            journal_entries["topLevel"] = changed_entry
+        elif (len(changed_entry) > 0) or (counter_entry >= base_num_entries - 1):
+            journal_entries["i{}".format(counter_entry)] = entry
+    save_file_psort_signals(file_fullPath, signal_dict)
+    journal = {
+        "base_digest": get_digest_dict_hash(base_digest_dict),
+        "num_entries": np.array([num_entries], dtype=np.uint32),
+        "entries": journal_entries,
+        "signals": {key: digest for key, (_, digest) in signal_dict.items()},
+    }
+    journal_fullPath = get_psort_journal_fullPath(file_fullPath)
+    file_descriptor, save_fullPath = tempfile.mkstemp(
+        prefix=".psort_", suffix=".journal", dir=os.path.dirname(journal_fullPath)
+    )
+    os.close(file_descriptor)
+    filters = get_psort_filters()
+    try:
+        with _H5_LOCK:
+            deepdish.io.save(
+                save_fullPath, journal, (filters.complib, filters.complevel)
+            )
+    except Exception:
+        os.remove(save_fullPath)
+        raise
+    os.replace(save_fullPath, journal_fullPath)
+    return 0
+
+
+def load_file_psort_signals(file_fullPath, digest_dict):
+    """
+    -> views of the sidecar signals recorded by a journal, {key: digest}, see
+       save_file_psort_signals, an evenly sampled ch_time as a TimeRamp
+    -> None if the sidecar does not hold these digests
+    """
+    signals_fullPath = get_psort_signals_fullPath(file_fullPath)
+    sidecar_digest_dict = get_psort_signals_digest(signals_fullPath)
+    signal_dict = {}
+    for key, digest in digest_dict.items():
+        if not (sidecar_digest_dict.get(key) == digest):
+            return None
+        with _H5_LOCK:
+            node = get_h5_signal_view_file(signals_fullPath).get_node("/" + key)
+            signal_view = H5SignalView(
+                signals_fullPath, "/" + key, node.shape, node.atom.dtype
+            )
+            signal_scale = get_h5_signal_scale(node)
+        if signal_scale is not None:
+            signal_view = ScaledSignal(signal_view, *signal_scale)
+        ch_time = None
+        if (key == "ch_time") and isinstance(signal_view, H5SignalView):
+            ch_time = TimeRamp.from_array(signal_view)
+        signal_dict[key] = signal_view if (ch_time is None) else ch_time
+        set_value_digest(signal_dict[key], digest)
+    return signal_dict
+
+
+def merge_file_psort_journal(grandDataBase, file_fullPath):
+    # returns 1 if a journal of the file was merged into the LazyGrandDataBase
+    journal_fullPath = get_psort_journal_fullPath(file_fullPath)
+    if not (os.path.isfile(journal_fullPath)):
+        return 0
+    with _H5_LOCK:
+        journal = deepdish.io.load(journal_fullPath)
+    base_digest_dict = get_psort_file_digest(file_fullPath)
+    if not (journal["base_digest"] == get_digest_dict_hash(base_digest_dict)):
+        print(
+            "Warning: <lib.merge_file_psort_journal: "
+            + "the journal was written for another version of the file, ignored.>"
+        )
+        return 0
+    signal_dict = load_file_psort_signals(file_fullPath, journal.get("signals", {}))
+    if signal_dict is None:
+        # the spike sorting is kept, the signals are the ones of the file
+        print(
+            "Warning: <lib.merge_file_psort_journal: "
+            + "the signals of the journal are missing, the saved ones are used.>"
+        )
+    else:
+        journal["entries"].setdefault("topLevel", {}).update(signal_dict)
+    grandDataBase.merge_journal(journal)
+    return 1
+
+
+def remove_file_psort_journal(file_fullPath):
+    journal_fullPath = get_psort_journal_fullPath(file_fullPath)
+    if os.path.isfile(journal_fullPath):
+        os.remove(journal_fullPath)
+    signals_fullPath = get_psort_signals_fullPath(file_fullPath)
+    close_h5_signal_view_files(signals_fullPath)
+    if os.path.isfile(signals_fullPath):
+        os.remove(signals_fullPath)
+    return 0
+
+
+# Raw signal store
+MEMMAP_MIN_NBYTES = 1024 * 1024 * 1024
+MEMMAP_CHUNK_LEN = 4 * 1024 * 1024
+
+
+class TimeRamp:
+    """
+    -> read-only stand-in for an evenly sampled ch_time: start + index * step
+    -> indexing returns regular numpy arrays, so slot sized slices are materialized
+       while the whole recording never is, unless np.asarray is called on it
+    """
+
+    def __init__(self, start, step, size):
+        self.start = float(start)
+        self.step = float(step)
+        self.size = int(size)
+        self.shape = (self.size,)
+        self.ndim = 1
+        self.dtype = np.dtype(np.float64)
+        return None
+
+    @classmethod
+    def from_array(cls, ch_time, chunk_len=MEMMAP_CHUNK_LEN):
+        # returns None if ch_time is not an affine ramp, ch_time can be any
+        # sliceable 1D array, it is only read chunk by chunk
+        if not hasattr(ch_time, "ndim"):
+            ch_time = np.asarray(ch_time)
+        if (ch_time.ndim != 1) or (ch_time.size < 2):
+            return None
+        start = float(ch_time[0])
+        step = (float(ch_time[-1]) - start) / float(ch_time.size - 1)
+        if not (step > 0):
+            return None
+        tolerance = 1e-3 * step
+        for index_start in range(0, ch_time.size, chunk_len):
+            index_end = min(index_start + chunk_len, ch_time.size)
+            ramp = start + np.arange(index_start, index_end) * step
+            if np.max(np.abs(ch_time[index_start:index_end] - ramp)) > tolerance:
+                return None
+        return cls(start, step, ch_time.size)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            index = np.arange(*key.indices(self.size))
+        elif isinstance(key, (int, np.integer)):
+            if key < 0:
+                key = key + self.size
+            if (key < 0) or (key >= self.size):
+                raise IndexError("index out of range for TimeRamp")
+            return np.float64(self.start + key * self.step)
+        else:
+            key = np.asarray(key)
+            if key.dtype == bool:
+                index = np.flatnonzero(key)
+            else:
+                index = np.where(key < 0, key + self.size, key)
+        return self.start + index * self.step
+
+    def __array__(self, dtype=None):
+        data = self.start + np.arange(self.size) * self.step
+        if dtype is not None:
+            data = data.astype(dtype)
+        return data
+
+    def __deepcopy__(self, memo):
+        # immutable, sharing is safe
+        return self
+
+    def copy(self):
+        return self
+
+
+# the scale of a signal saved with its native samples, attribute of its .h5 array
+SIGNAL_SCALE_ATTR = "PSORT_SCALE"
+
+
+class ScaledSignal:
+    """
+    -> read-only stand-in for a signal kept as its native integer samples, the
+       value of a sample is raw * gain + offset, e.g. the int16 samples and the
+       bitVolts of a .continuous file
+    -> indexing decodes only the requested samples, to float32, the whole signal
+       is decoded only if np.asarray is called on it
+    """
+
+    def __init__(self, raw, gain=1.0, offset=0.0):
+        self.raw = raw
+        self.gain = float(gain)
+        self.offset = float(offset)
+        self.shape = tuple(raw.shape)
+        self.ndim = len(self.shape)
+        self.size = int(np.prod(self.shape))
+        self.dtype = np.dtype(np.float32)
+        self.nbytes = int(raw.nbytes)
+        return None
+
+    def decode(self, raw):
+        data = np.multiply(raw, self.gain, dtype=self.dtype)
+        data += self.dtype.type(self.offset)
+        return data
+
+    def scaled(self, scale_value):
+        # same samples, the scale is applied to gain and offset only
+        return ScaledSignal(
+            self.raw, self.gain * scale_value, self.offset * scale_value
+        )
+
+    def max(self, axis=None, out=None):
+        if self.gain < 0:
+            return self.decode(np.min(self.raw))
+        return self.decode(np.max(self.raw))
+
+    def min(self, axis=None, out=None):
+        if self.gain < 0:
+            return self.decode(np.max(self.raw))
+        return self.decode(np.min(self.raw))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        return self.decode(self.raw[key])
+
+    def __array__(self, dtype=None):
+        data = np.zeros(self.shape, dtype=self.dtype)
+        for index_start in range(0, self.size, MEMMAP_CHUNK_LEN):
+            index_end = min(index_start + MEMMAP_CHUNK_LEN, self.size)
+            data[index_start:index_end] = self[index_start:index_end]
+        if dtype is not None:
+            data = data.astype(dtype)
+        return data
+
+    def __deepcopy__(self, memo):
+        # immutable, sharing is safe
+        return self
+
+    def copy(self):
+        return self
+
+
+class LazySignal:
+    """
+    -> read-only stand-in for a signal read from its file on demand, the samples
+       of a range are read(index_start, index_end), as dtype
+    -> indexing reads only the requested samples, the whole signal is read only if
+       np.asarray is called on it, so PsortDataBase.store_signal can copy it to a
+       memory-mapped sidecar one chunk at a time
+    """
+
+    def __init__(self, read, size, dtype=np.float64):
+        self.read = read
+        self.size = int(size)
+        self.shape = (self.size,)
+        self.ndim = 1
+        self.dtype = np.dtype(dtype)
+        self.nbytes = self.size * self.dtype.itemsize
+        return None
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            index_start, index_end, step = key.indices(self.size)
+            if step < 0:
+                return np.asarray(self)[key]
+            if index_end <= index_start:
+                return np.zeros((0), dtype=self.dtype)
+            data = np.asarray(self.read(index_start, index_end), dtype=self.dtype)
+            return data[::step]
+        if isinstance(key, (int, np.integer)):
+            if key < 0:
+                key = key + self.size
+            if (key < 0) or (key >= self.size):
+                raise IndexError("index out of range for LazySignal")
+            return self[key : key + 1][0]
+        return np.asarray(self)[key]
+
+    def __array__(self, dtype=None):
+        data = np.zeros(self.shape, dtype=self.dtype)
+        for index_start in range(0, self.size, MEMMAP_CHUNK_LEN):
+            index_end = min(index_start + MEMMAP_CHUNK_LEN, self.size)
+            data[index_start:index_end] = self[index_start:index_end]
+        if dtype is not None:
+            data = data.astype(dtype)
+        return data
+
+    def __deepcopy__(self, memo):
+        # read-only, sharing is safe
+        return self
+
+    def copy(self):
+        return self
+
+
+def get_h5_signal_scale(node):
+    # (gain, offset) of a tables.Array saved from a ScaledSignal, None otherwise
+    if not (SIGNAL_SCALE_ATTR in node._v_attrs):
+        return None
+    gain, offset = np.asarray(node._v_attrs[SIGNAL_SCALE_ATTR], dtype=np.float64)
+    return float(gain), float(offset)
+
+
+def memmap_signal(file_fullPath, data, func=None, dtype=None):
+    # write data chunk by chunk into a .npy file and map it back read-only,
+    # func(chunk, index_start, index_end) can transform each chunk on the way
+    if dtype is None:
+        dtype = data.dtype
+    data_size = len(data)
+    _data = np.lib.format.open_memmap(
+        file_fullPath, mode="w+", dtype=dtype, shape=(data_size,)
+    )
+    for index_start in range(0, data_size, MEMMAP_CHUNK_LEN):
+        index_end = min(index_start + MEMMAP_CHUNK_LEN, data_size)
+        chunk = np.asarray(data[index_start:index_end])
+        if func is not None:
+            chunk = func(chunk, index_start, index_end)
+        _data[index_start:index_end] = chunk
+    _data.flush()
+    del _data
+    return np.load(file_fullPath, mmap_mode="r")
+
+
+# Lazy .psort reader
+# A .psort file is the grandDataBase list saved by deepdish as /data/i0 ... /data/iN,
+# the last entry being the topLevel. Each entry and each raw signal can be read on
+# its own through the group and sel arguments of deepdish.io.load.
+PSORT_SIGNAL_KEYS = ("ch_data", "ch_time", "ch_lfp")
+PSORT_SIGNAL_CHUNK_LEN = 128 * 1024
+
+
+# the files read by H5SignalView are kept open, one handle per file, and closed
+# before the file is written to, see close_h5_signal_view_files
+_h5_signal_view_files = {}
+
+
+@h5_locked
+def get_h5_signal_view_file(file_fullPath):
+    file_key = os.path.realpath(file_fullPath)
+    h5file = _h5_signal_view_files.get(file_key)
+    if (h5file is None) or not (h5file.isopen):
+        h5file = tables.open_file(file_fullPath, mode="r")
+        _h5_signal_view_files[file_key] = h5file
+    return h5file
+
+
+@h5_locked
+def close_h5_signal_view_files(file_fullPath=None):
+    # PyTables can not open a file for writing while it is open for reading
+    if file_fullPath is None:
+        file_key_list = list(_h5_signal_view_files.keys())
+    else:
+        file_key_list = [os.path.realpath(file_fullPath)]
+    for file_key in file_key_list:
+        h5file = _h5_signal_view_files.pop(file_key, None)
+        if h5file is not None:
+            h5file.close()
     return 0
 
 
+atexit.register(close_h5_signal_view_files)
+
+
+class H5SignalView:
+    """
+    -> read-only 1D array stored in an .h5 file, slicing reads only that part
+       of the file and np.asarray reads all of it
+    -> the node is looked up once and read through the shared open handle of the
+       file, it is looked up again if the file has been closed in between
+    """
+
+    def __init__(self, file_fullPath, node_path, shape, dtype):
+        self.file_fullPath = file_fullPath
+        self.node_path = node_path
+        self.shape = tuple(shape)
+        self.ndim = len(self.shape)
+        self.size = int(np.prod(self.shape))
+        self.dtype = np.dtype(dtype)
+        self.nbytes = self.size * self.dtype.itemsize
+        self._h5file = None
+        self._node = None
+        return None
+
+    def __len__(self):
+        return self.shape[0]
+
+    def get_node(self):
+        # should be called with _H5_LOCK held
+        if (self._h5file is None) or not (self._h5file.isopen):
+            self._h5file = get_h5_signal_view_file(self.file_fullPath)
+            self._node = self._h5file.get_node(self.node_path)
+        return self._node
+
+    def __getitem__(self, key):
+        with _H5_LOCK:
+            return self.get_node()[key]
+
+    def __array__(self, dtype=None):
+        with _H5_LOCK:
+            data = self.get_node().read()
+        if dtype is not None:
+            data = data.astype(dtype)
+        return data
+
+    def max(self, axis=None, out=None):
+        return np.max([np.max(data_chunk) for data_chunk in self.iter_chunks()])
+
+    def min(self, axis=None, out=None):
+        return np.min([np.min(data_chunk) for data_chunk in self.iter_chunks()])
+
+    def iter_chunks(self):
+        for index_start in range(0, self.size, MEMMAP_CHUNK_LEN):
+            yield self[index_start : index_start + MEMMAP_CHUNK_LEN]
+
+    def retarget(self, file_fullPath, node_path):
+        # the same samples are read from another node from now on
+        with _H5_LOCK:
+            self.file_fullPath = file_fullPath
+            self.node_path = node_path
+            self._h5file = None
+            self._node = None
+        return 0
+
+    def __deepcopy__(self, memo):
+        # read-only, sharing is safe
+        return self
+
+
+class LazyGrandDataBase(MutableSequence):
+    """
+    -> grandDataBase of a .psort file which reads only what is asked for:
+       the topLevel metadata and spike indices when it is created, a slot the
+       first time it is indexed and the raw signals by load_signals, or a slice
+       at a time once keep_signal_views put them in the topLevel
+    -> can be used in place of the list of dict returned by deepdish.io.load
+    """
+
+    @h5_locked
+    def __init__(self, file_fullPath):
+        self.file_fullPath = file_fullPath
+        self._memmap_dir = None
+        with tables.open_file(file_fullPath, mode="r") as h5file:
+            num_entries = int(h5file.root.data._v_title.split(":")[1])
+            topLevel_path = "/data/i{}".format(num_entries - 1)
+            topLevel_group = h5file.get_node(topLevel_path)
+            if "PSORT_DIGEST" in h5file.root._v_attrs:
+                self._digest_dict = dict(h5file.root._v_attrs["PSORT_DIGEST"])
+            else:
+                self._digest_dict = {}
+            self._topLevel_name = "i{}".format(num_entries - 1)
+            topLevel_keys = list(topLevel_group._v_children.keys())
+            topLevel_keys += topLevel_group._v_attrs._f_list("user")
+            self._signal_view = {}
+            for key in PSORT_SIGNAL_KEYS:
+                if not (key in topLevel_group._v_children):
+                    continue
+                node = topLevel_group._v_children[key]
+                # the zero size arrays are stored as their shape by deepdish
+                if isinstance(node, tables.Array) and not (
+                    "zeroarray_dtype" in node._v_attrs
+                ):
+                    signal_view = H5SignalView(
+                        file_fullPath,
+                        topLevel_path + "/" + key,
+                        node.shape,
+                        node.atom.dtype,
+                    )
+                    signal_scale = get_h5_signal_scale(node)
+                    if signal_scale is not None:
+                        signal_view = ScaledSignal(signal_view, *signal_scale)
+                    self._signal_view[key] = signal_view
+                    topLevel_keys.remove(key)
+        topLevel_values = deepdish.io.load(
+            file_fullPath, [topLevel_path + "/" + key for key in topLevel_keys]
+        )
+        self._entries = [None] * num_entries
+        self._entries[-1] = dict(zip(topLevel_keys, topLevel_values))
+        return None
+
+    @classmethod
+    def is_lazy_loadable(cls, file_fullPath):
+        # False for the files saved with a grandDataBase that is not a plain list
+        return get_psort_num_entries(file_fullPath) is not None
+
+    def is_loaded(self, index):
+        return self._entries[index] is not None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[_index] for _index in range(*index.indices(len(self)))]
+        if index < 0:
+            index = index + len(self)
+        if self._entries[index] is None:
+            with _H5_LOCK:
+                self._entries[index] = deepdish.io.load(
+                    self.file_fullPath, "/data/i{}".format(index)
+                )
+        return self._entries[index]
+
+    def __setitem__(self, index, value):
+        self._entries[index] = value
+
+    def __delitem__(self, index):
+        del self._entries[index]
+
+    def insert(self, index, value):
+        self._entries.insert(index, value)
+
+    def get_signal_view(self, key):
+        # None once the signal is loaded, or if it is not in the file
+        return self._signal_view.get(key)
+
+    def get_signal_views(self):
+        return dict(self._signal_view)
+
+    def keep_signal_views(self, keys=PSORT_SIGNAL_KEYS):
+        """
+        -> moves the views of the raw signals into the topLevel as they are, so
+           a slot reads only its own part of the file, see H5SignalView
+        -> an evenly sampled ch_time is kept as a TimeRamp
+        """
+        topLevel = self._entries[-1]
+        for key in keys:
+            signal_view = self._signal_view.pop(key, None)
+            if signal_view is None:
+                continue
+            ch_time = None
+            if (key == "ch_time") and isinstance(signal_view, H5SignalView):
+                ch_time = TimeRamp.from_array(signal_view)
+            topLevel[key] = signal_view if (ch_time is None) else ch_time
+            # the signal is what the file holds, the next save can skip it
+            digest = self._digest_dict.get(self._topLevel_name + "/" + key)
+            if digest is not None:
+                set_value_digest(topLevel[key], digest)
+        return 0
+
+    def load_signals(self, keys=PSORT_SIGNAL_KEYS, store=None):
+        """
+        -> reads the raw signals into the topLevel, store(signal_view, key) can
+           decide where they are kept, by default signals above
+           MEMMAP_MIN_NBYTES are copied chunk by chunk to a read-only memmap
+        -> an evenly sampled ch_time is kept as a TimeRamp, a signal saved with
+           its native samples as a ScaledSignal of them
+        """
+        topLevel = self._entries[-1]
+        for key in keys:
+            signal_view = self._signal_view.pop(key, None)
+            if signal_view is None:
+                continue
+            signal_scale = None
+            if isinstance(signal_view, ScaledSignal):
+                signal_scale = (signal_view.gain, signal_view.offset)
+                signal_view = signal_view.raw
+            ch_time = None
+            if key == "ch_time":
+                ch_time = TimeRamp.from_array(signal_view)
+            if ch_time is not None:
+                topLevel[key] = ch_time
+            elif store is not None:
+                topLevel[key] = store(signal_view, key)
+            elif signal_view.nbytes < MEMMAP_MIN_NBYTES:
+                topLevel[key] = np.asarray(signal_view)
+            else:
+                topLevel[key] = memmap_signal(
+                    os.path.join(self.get_memmap_dir(), key + ".npy"), signal_view
+                )
+            if signal_scale is not None:
+                topLevel[key] = ScaledSignal(topLevel[key], *signal_scale)
+            # the signal is what the file holds, the next save can skip it
+            digest = self._digest_dict.get(self._topLevel_name + "/" + key)
+            if digest is not None:
+                set_value_digest(topLevel[key], digest)
+        return 0
+
+    def merge_journal(self, journal):
+        # see save_file_psort_journal, slots missing from the journal are unchanged
+        num_entries = int(journal["num_entries"][0])
+        journal_entries = journal["entries"]
+        topLevel = self._entries[-1]
+        for key, value in journal_entries.get("topLevel", {}).items():
+            self._signal_view.pop(key, None)
+            topLevel[key] = value
+        entries = []
+        for counter_entry in range(num_entries - 1):
+            entry_name = "i{}".format(counter_entry)
+            if entry_name in journal_entries:
+                entries.append(journal_entries[entry_name])
+            else:
+                entries.append(self._entries[counter_entry])
+        entries.append(topLevel)
+        self._entries = entries
+        return 0
+
+    def get_memmap_dir(self):
+        if self._memmap_dir is None:
+            self._memmap_dir = tempfile.mkdtemp(prefix="psort_")
+            weakref.finalize(self, shutil.rmtree, self._memmap_dir, True)
+        return self._memmap_dir
+
+
+# Multiple files
+def load_file_channel(file_fullPath):
+    _, _, _, file_ext, _ = get_fullPath_components(file_fullPath)
+    if file_ext == ".continuous":
+        return load_file_continuous(file_fullPath)
+    elif file_ext == ".mat":
+        return load_file_matlab(file_fullPath)
+    elif file_ext == ".h5":
+        return load_file_h5(file_fullPath)
+    print("Error: <lib.load_file_channel: file_ext is not valid>")
+    return 0, 0, 0
+
+
+def load_files_to_array(file_fullPath_list, num_workers=None, progress_callback=None):
+    """
+    -> loads one channel per file into a preallocated (n_files, n_samples) array,
+       the files are read concurrently on a thread pool, each through its
+       SignalFileReader straight into its row
+    -> n_samples is taken from the first file, a file with another size is left as
+       zeros and reported as not loaded in isLoaded
+    -> progress_callback(counter_file, isLoaded) is called from the worker threads
+       as soon as each file is done
+    -> returns (data_all, ch_time, sample_rate, isLoaded)
+    """
+    num_files = len(file_fullPath_list)
+    isLoaded = np.zeros((num_files), dtype=bool)
+    if num_files == 0:
+        return np.zeros((0, 0), dtype=np.float64), np.zeros((0)), 0, isLoaded
+    with tempfile.TemporaryDirectory(prefix="psort_") as memmap_dir:
+        reader_first = SignalFileReader(file_fullPath_list[0], memmap_dir)
+        data_size = reader_first.data_size
+        if data_size is None:
+            return np.zeros((0, 0), dtype=np.float64), np.zeros((0)), 0, isLoaded
+        ch_time = reader_first.read_time(0, data_size)
+        sample_rate = reader_first.sample_rate
+        data_all = np.zeros((num_files, data_size), dtype=np.float64)
+
+        def _load_file(counter_file):
+            if counter_file == 0:
+                reader = reader_first
+            else:
+                reader = SignalFileReader(file_fullPath_list[counter_file], memmap_dir)
+            try:
+                if reader.data_size == data_size:
+                    for index_start in range(0, data_size, MEMMAP_CHUNK_LEN):
+                        index_end = min(index_start + MEMMAP_CHUNK_LEN, data_size)
+                        reader.read(
+                            index_start,
+                            index_end,
+                            out=data_all[counter_file, index_start:index_end],
+                        )
+                    isLoaded[counter_file] = True
+            finally:
+                reader.close()
+            if progress_callback is not None:
+                progress_callback(counter_file, bool(isLoaded[counter_file]))
+            return 0
+
+        if num_workers is None:
+            num_workers = min(num_files, os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=max(int(num_workers), 1)) as executor:
+            list(executor.map(_load_file, range(num_files)))
+    return data_all, ch_time, sample_rate, isLoaded
+
+
+# Common average
+# The common average is computed one time block at a time across all the channels,
+# so the memory in use is (num_channels x block_len) instead of the whole recording.
+COMMON_AVERAGE_BLOCK_NBYTES = 64 * 1024 * 1024
+COMMON_AVERAGE_MODES = ["mean", "median", "trimmed_mean"]
+
+
+class SignalFileReader:
+    """
+    -> block access to a single channel file without loading it as a whole:
+       .continuous records are memory-mapped and converted one block at a time,
+       .h5 and v7.3 .mat files are read with a slice of the ch_data array, any
+       other file is loaded once and kept as a memory-mapped .npy in a folder under memmap_dir
+       that is removed by close()
+    -> data_size is None if the file could not be opened
+    """
+
+    def __init__(self, file_fullPath, memmap_dir=None):
+        self.file_fullPath = file_fullPath
+        self.data_size = None
+        self.sample_rate = 0
+        self._data_continuous = None
+        self._h5file = None
+        self._h5_scale = None
+        self._matlab_reader = None
+        self._ch_data = None
+        self._ch_time = None
+        self._memmap_dir = None
+        _, _, _, file_ext, file_name_without_ext = get_fullPath_components(
+            file_fullPath
+        )
+        if not (os.path.isfile(file_fullPath)):
+            print("Error: <lib.SignalFileReader: file_fullPath is not valid>")
+            return None
+        if file_ext == ".continuous":
+            data_continuous = load_continuous_records(file_fullPath)
+            if data_continuous is None:
+                return None
+            self._data_continuous = data_continuous
+            self.sample_rate = int(data_continuous["header"]["sampleRate"])
+            self.data_size = data_continuous["samples"].size
+            self._ch_time = TimeRamp(
+                float(data_continuous["timestamps"][0]) / float(self.sample_rate),
+                1.0 / float(self.sample_rate),
+                self.data_size,
+            )
+            return None
+        if file_ext == ".h5":
+            with _H5_LOCK:
+                h5file = tables.open_file(file_fullPath, mode="r")
+                if (
+                    ("/ch_data" in h5file)
+                    and ("/ch_time" in h5file)
+                    and (h5file.root.ch_data.ndim == 1)
+                    and (h5file.root.ch_time.shape == h5file.root.ch_data.shape)
+                ):
+                    self._h5file = h5file
+                    self._h5_scale = get_h5_signal_scale(h5file.root.ch_data)
+                    self.sample_rate = h5file.root.sample_rate[0]
+                    self.data_size = h5file.root.ch_data.shape[0]
+                    return None
+                h5file.close()
+        if file_ext == ".mat":
+            matlab_reader = MatlabH5Reader(file_fullPath)
+            if matlab_reader.data_size is not None:
+                self._matlab_reader = matlab_reader
+                self.sample_rate = matlab_reader.sample_rate
+                self.data_size = matlab_reader.data_size
+                return None
+        # no partial reads for this file, it is loaded once and mapped back
+        ch_data, ch_time, sample_rate = load_file_channel(file_fullPath)
+        if not isinstance(ch_data, np.ndarray):
+            return None
+        self._memmap_dir = tempfile.mkdtemp(prefix="psort_", dir=memmap_dir)
+        self._ch_data = memmap_signal(
+            os.path.join(self._memmap_dir, file_name_without_ext + "_ch_data.npy"),
+            ch_data.reshape(-1),
+            dtype=np.float64,
+        )
+        del ch_data
+        self._ch_time = memmap_signal(
+            os.path.join(self._memmap_dir, file_name_without_ext + "_ch_time.npy"),
+            np.asarray(ch_time).reshape(-1),
+            dtype=np.float64,
+        )
+        self.sample_rate = sample_rate
+        self.data_size = self._ch_data.size
+        return None
+
+    def read(self, index_start, index_end, out=None):
+        index_end = min(index_end, self.data_size)
+        if out is None:
+            out = np.zeros((index_end - index_start), dtype=np.float64)
+        if self._data_continuous is not None:
+            out[:] = read_continuous_samples(
+                self._data_continuous["samples"],
+                self._data_continuous["header"]["bitVolts"],
+                index_start,
+                index_end,
+            )
+        elif self._h5file is not None:
+            with _H5_LOCK:
+                out[:] = self._h5file.root.ch_data[index_start:index_end]
+            if self._h5_scale is not None:
+                out *= self._h5_scale[0]
+                out += self._h5_scale[1]
+        elif self._matlab_reader is not None:
+            self._matlab_reader.read("ch_data", index_start, index_end, out=out)
+        else:
+            out[:] = self._ch_data[index_start:index_end]
+        return out
+
+    def read_time(self, index_start, index_end):
+        index_end = min(index_end, self.data_size)
+        if self._h5file is not None:
+            with _H5_LOCK:
+                return np.array(
+                    self._h5file.root.ch_time[index_start:index_end], dtype=np.float64
+                )
+        if self._matlab_reader is not None:
+            return self._matlab_reader.read("ch_time", index_start, index_end)
+        return np.array(self._ch_time[index_start:index_end], dtype=np.float64)
+
+    def close(self):
+        if self._h5file is not None:
+            with _H5_LOCK:
+                self._h5file.close()
+        self._h5file = None
+        if self._matlab_reader is not None:
+            self._matlab_reader.close()
+        self._matlab_reader = None
+        self._data_continuous = None
+        self._ch_data = None
+        self._ch_time = None
+        if self._memmap_dir is not None:
+            shutil.rmtree(self._memmap_dir, ignore_errors=True)
+        self._memmap_dir = None
+        return 0
+
+
+def common_average_blocks(
+    reader_list,
+    mode="median",
+    block_len=None,
+    num_workers=None,
+    proportion_to_cut=0.1,
+):
+    """
+    -> generator of consecutive blocks of the common average of the readers,
+       all the readers should have the same data_size
+    -> mode is one of COMMON_AVERAGE_MODES, trimmed_mean cuts proportion_to_cut
+       of the channels from each end before averaging
+    -> the channels of a block are read concurrently into a reused
+       (num_channels, block_len) buffer
+    """
+    if mode not in COMMON_AVERAGE_MODES:
+        print("Error: <lib.common_average_blocks: mode is not valid>")
+        return None
+    num_channels = len(reader_list)
+    if num_channels == 0:
+        return None
+    data_size = reader_list[0].data_size
+    if block_len is None:
+        block_len = COMMON_AVERAGE_BLOCK_NBYTES // (8 * num_channels)
+    block_len = int(max(min(block_len, data_size), 1))
+    data_block = np.zeros((num_channels, block_len), dtype=np.float64)
+    if num_workers is None:
+        num_workers = min(num_channels, os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=max(int(num_workers), 1)) as executor:
+        for index_start in range(0, data_size, block_len):
+            index_end = min(index_start + block_len, data_size)
+            _data_block = data_block[:, : index_end - index_start]
+            list(
+                executor.map(
+                    lambda counter_channel: reader_list[counter_channel].read(
+                        index_start, index_end, out=_data_block[counter_channel, :]
+                    ),
+                    range(num_channels),
+                )
+            )
+            if mode == "mean":
+                yield np.mean(_data_block, axis=0)
+            elif mode == "median":
+                # the buffer is overwritten by the next block anyway
+                yield np.median(_data_block, axis=0, overwrite_input=True)
+            elif mode == "trimmed_mean":
+                yield scipy.stats.trim_mean(_data_block, proportion_to_cut, axis=0)
+
+
+class SignalFileTime:
+    """
+    -> ch_time of a SignalFileReader for save_file_h5, a slice of it is read from
+       the file when it is asked for
+    """
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.size = reader.data_size
+        return None
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        index_start, index_end, _ = key.indices(self.size)
+        return self.reader.read_time(index_start, index_end)
+
+
+def common_average_files(
+    file_fullPath_list,
+    file_fullPath_out,
+    mode="median",
+    block_len=None,
+    num_workers=None,
+    progress_callback=None,
+    block_callback=None,
+):
+    """
+    -> common average of one channel per file, computed block by block and
+       appended to the .h5 file_fullPath_out as soon as each block is ready,
+       returns (data_size, sample_rate, isLoaded)
+    -> the size and the time of the first file that opens are used, files with
+       another size are reported as not loaded in isLoaded
+    -> progress_callback(counter_file, isLoaded) is called as each file is opened
+       and block_callback(index_end, data_size) after each block
+    """
+    num_files = len(file_fullPath_list)
+    isLoaded = np.zeros((num_files), dtype=bool)
+    with tempfile.TemporaryDirectory(prefix="psort_") as memmap_dir:
+        reader_list = []
+        data_size = None
+        for counter_file in range(num_files):
+            reader = SignalFileReader(file_fullPath_list[counter_file], memmap_dir)
+            if data_size is None:
+                data_size = reader.data_size
+            if (reader.data_size is not None) and (reader.data_size == data_size):
+                isLoaded[counter_file] = True
+                reader_list.append(reader)
+            else:
+                reader.close()
+            if progress_callback is not None:
+                progress_callback(counter_file, bool(isLoaded[counter_file]))
+        if len(reader_list) == 0:
+            return 0, 0, isLoaded
+        sample_rate = reader_list[0].sample_rate
+
+        def _ch_data_blocks():
+            index_end = 0
+            for ch_data_block in common_average_blocks(
+                reader_list, mode=mode, block_len=block_len, num_workers=num_workers
+            ):
+                yield ch_data_block
+                index_end = index_end + ch_data_block.size
+                if block_callback is not None:
+                    block_callback(index_end, data_size)
+
+        try:
+            save_result = save_file_h5(
+                file_fullPath_out,
+                _ch_data_blocks(),
+                SignalFileTime(reader_list[0]),
+                sample_rate,
+            )
+        finally:
+            for reader in reader_list:
+                reader.close()
+        if save_result != 0:
+            print(save_result)
+            isLoaded[:] = False
+    return data_size, sample_rate, isLoaded
+
+
 # load procedure as QThread
 class LoadData(QtCore.QThread):
     return_signal = QtCore.pyqtSignal("PyQt_PyObject", "PyQt_PyObject", "PyQt_PyObject")
@@ -246,22 +2483,29 @@ class LoadData(QtCore.QThread):
         super(LoadData, self).__init__()
         self.file_fullPath = ""
         self.ch_index = int(0)
+        # keep the native samples of the file as a ScaledSignal
+        self.isCompact = False
 
     def run(self):
         file_fullPath = self.file_fullPath
         ch_index = int(self.ch_index)
+        isCompact = bool(self.isCompact)
         _, _, _, file_ext, _ = get_fullPath_components(file_fullPath)
         if file_ext == ".continuous":
-            ch_data, ch_time, sample_rate = load_file_continuous(file_fullPath)
+            ch_data, ch_time, sample_rate = load_file_continuous(
+                file_fullPath, isCompact
+            )
             self.return_signal.emit(ch_data, ch_time, sample_rate)
         elif file_ext == ".mat":
             ch_data, ch_time, sample_rate = load_file_matlab(file_fullPath)
             self.return_signal.emit(ch_data, ch_time, sample_rate)
         elif file_ext == ".h5":
-            ch_data, ch_time, sample_rate = load_file_h5(file_fullPath)
+            ch_data, ch_time, sample_rate = load_file_h5(file_fullPath, isCompact)
             self.return_signal.emit(ch_data, ch_time, sample_rate)
         elif file_ext == ".smr":
-            ch_data, ch_time, sample_rate = load_file_smr(file_fullPath, ch_index)
+            ch_data, ch_time, sample_rate = load_file_smr(
+                file_fullPath, ch_index, isCompact
+            )
             self.return_signal.emit(ch_data, ch_time, sample_rate)
         elif file_ext == ".psort":
             grandDataBase = load_file_psort(file_fullPath)
@@ -271,6 +2515,32 @@ class LoadData(QtCore.QThread):
             self.return_signal.emit(0, 0, 0)
 
 
+class CommonAverageData(QtCore.QThread):
+    return_signal = QtCore.pyqtSignal("PyQt_PyObject", "PyQt_PyObject", "PyQt_PyObject")
+    progress_signal = QtCore.pyqtSignal(int, bool)
+    block_signal = QtCore.pyqtSignal(int)
+
+    def __init__(self):
+        super(CommonAverageData, self).__init__()
+        self.file_fullPath_list = []
+        self.file_fullPath = ""
+        self.mode = "median"
+        self.num_workers = None
+
+    def run(self):
+        data_size, sample_rate, isLoaded = common_average_files(
+            list(self.file_fullPath_list),
+            self.file_fullPath,
+            mode=self.mode,
+            num_workers=self.num_workers,
+            progress_callback=self.progress_signal.emit,
+            block_callback=lambda index_end, data_size: self.block_signal.emit(
+                int(100 * index_end / max(data_size, 1))
+            ),
+        )
+        self.return_signal.emit(data_size, sample_rate, isLoaded)
+
+
 # save procedure as QThread
 class SaveData(QtCore.QThread):
     return_signal = QtCore.pyqtSignal()
@@ -299,6 +2569,28 @@ class SaveData(QtCore.QThread):
             self.return_signal.emit()
 
 
+class AutoSaveData(QtCore.QThread):
+    return_signal = QtCore.pyqtSignal("PyQt_PyObject")
+
+    def __init__(self):
+        super(AutoSaveData, self).__init__()
+        self.file_fullPath = ""
+        self.grandDataBase = []
+
+    def run(self):
+        # the first autosave of a session that has no .psort file yet writes it
+        # in full, later ones only write the journal next to it
+        if get_psort_num_entries(self.file_fullPath) is None:
+            if any(entry is None for entry in self.grandDataBase):
+                print("Error: <lib.AutoSaveData: file_fullPath is not valid>")
+                self.return_signal.emit(1)
+                return None
+            save_file_psort(self.file_fullPath, self.grandDataBase)
+        else:
+            save_file_psort_journal(self.file_fullPath, self.grandDataBase)
+        self.return_signal.emit(0)
+
+
 # Signal Processing
 def bandpass_filter(data, sample_rate=None, lo_cutoff_freq=None, hi_cutoff_freq=None):
     if sample_rate is None:
@@ -330,6 +2622,115 @@ def bandpass_filter(data, sample_rate=None, lo_cutoff_freq=None, hi_cutoff_freq=
     return _data
 
 
+def bandpass_filter_sos(sample_rate=None, lo_cutoff_freq=None, hi_cutoff_freq=None):
+    if sample_rate is None:
+        sample_rate = 30000.0
+    if lo_cutoff_freq is None:
+        lo_cutoff_freq = 1.0
+    if hi_cutoff_freq is None:
+        hi_cutoff_freq = 6000.0
+    if abs(lo_cutoff_freq - hi_cutoff_freq) < 1.0:
+        hi_cutoff_freq = hi_cutoff_freq + 1
+        print(
+            "Warning: <lib.bandpass_filter_sos: "
+            + "lo_cutoff_freq and hi_cutoff_freq are the same.>"
+        )
+    elif lo_cutoff_freq > hi_cutoff_freq:
+        _temp = lo_cutoff_freq
+        lo_cutoff_freq = hi_cutoff_freq
+        hi_cutoff_freq = _temp
+        print(
+            "Warning: <lib.bandpass_filter_sos: "
+            + "lo_cutoff_freq is grater than hi_cutoff_freq.>"
+        )
+    lo_cutoff_wn = float(lo_cutoff_freq) / (float(sample_rate) / 2.0)
+    hi_cutoff_wn = float(hi_cutoff_freq) / (float(sample_rate) / 2.0)
+    # same two 4th order Butterworth stages as bandpass_filter, cascaded as one
+    # second-order-sections filter so the whole band is applied in a single pass
+    sos = np.vstack(
+        (
+            signal.butter(N=4, Wn=lo_cutoff_wn, btype="high", output="sos"),
+            signal.butter(N=4, Wn=hi_cutoff_wn, btype="low", output="sos"),
+        )
+    )
+    return sos, lo_cutoff_freq
+
+
+def bandpass_filter_chunked(
+    data,
+    sample_rate=None,
+    lo_cutoff_freq=None,
+    hi_cutoff_freq=None,
+    chunk_len=None,
+    pad_len=None,
+    num_workers=None,
+    index_start=None,
+    index_end=None,
+    out=None,
+):
+    # -> filters data[index_start:index_end], by default the whole data, into out or
+    #    a new float64 array
+    # -> the chunks are always laid on the same grid from the first sample of data
+    #    and padded from the samples around them, so a range is filtered to the
+    #    exact same values as the same range of the whole filtered data
+    if sample_rate is None:
+        sample_rate = 30000.0
+    sos, lo_cutoff_freq = bandpass_filter_sos(
+        sample_rate=sample_rate,
+        lo_cutoff_freq=lo_cutoff_freq,
+        hi_cutoff_freq=hi_cutoff_freq,
+    )
+    if chunk_len is None:
+        chunk_len = int(30.0 * sample_rate)
+    if pad_len is None:
+        # the impulse response of the high-pass stage decays within a few periods
+        # of lo_cutoff_freq, 10 periods keeps the chunk seams below float precision
+        pad_len = int(10.0 * sample_rate / lo_cutoff_freq)
+    chunk_len = max(int(chunk_len), 1)
+    pad_len = max(int(pad_len), 0)
+    # a ScaledSignal is decoded one padded chunk at a time
+    if not hasattr(data, "ndim"):
+        data = np.asarray(data)
+    data_len = data.size
+    if index_start is None:
+        index_start = 0
+    if index_end is None:
+        index_end = data_len
+    index_start = min(max(int(index_start), 0), data_len)
+    index_end = min(max(int(index_end), index_start), data_len)
+    if out is None:
+        out = np.zeros(index_end - index_start, dtype=np.float64)
+    data_filtered = out
+    if index_end == index_start:
+        return data_filtered
+
+    def _filter_chunk(chunk_start):
+        chunk_end = min(chunk_start + chunk_len, data_len)
+        pad_start = max(chunk_start - pad_len, 0)
+        pad_end = min(chunk_end + pad_len, data_len)
+        _data = signal.sosfiltfilt(sos, data[pad_start:pad_end])
+        # only the part of the chunk inside the requested range is kept
+        copy_start = max(chunk_start, index_start)
+        copy_end = min(chunk_end, index_end)
+        data_filtered[(copy_start - index_start) : (copy_end - index_start)] = _data[
+            (copy_start - pad_start) : (copy_end - pad_start)
+        ]
+        return 0
+
+    index_chunks = range((index_start // chunk_len) * chunk_len, index_end, chunk_len)
+    if num_workers is None:
+        num_workers = min(len(index_chunks), os.cpu_count() or 1)
+    if num_workers <= 1:
+        for chunk_start in index_chunks:
+            _filter_chunk(chunk_start)
+        return data_filtered
+    # sosfiltfilt releases the GIL inside its C loops, threads are enough here and
+    # avoid copying the recording into worker processes
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        list(executor.map(_filter_chunk, index_chunks))
+    return data_filtered
+
+
 def find_peaks(data, threshold=None, peakType=None):
     if peakType is None:
         peakType = "max"
@@ -338,7 +2739,8 @@ def find_peaks(data, threshold=None, peakType=None):
     if (peakType == "max") or (peakType == "Max"):
         pass  # do nothing
     elif (peakType == "min") or (peakType == "Min"):
-        data *= -1.0
+        # negated into a new array, the data may be read-only
+        data = -data
     else:
         print(
             "Error: <lib.find_peaks: " + "peakType should be either max or min.>",
@@ -354,9 +2756,6 @@ def find_peaks(data, threshold=None, peakType=None):
         data[peak_index_below_threshold] < _threshold
     ]
     peak_index_boolean[peak_index_below_threshold] = False
-    # revert the data back to its original form
-    if (peakType == "min") or (peakType == "Min"):
-        data *= -1.0
     return peak_index_boolean
 
 
@@ -365,8 +2764,8 @@ def inter_spike_interval_from_index(index_bool, sample_rate=None):
         sample_rate = 30000.0  # sample_rate in Hz
     if index_bool.dtype == bool:
         index_value = np.where(index_bool)[0]
-    elif index_bool.dtype == int:
-        pass
+    elif np.issubdtype(index_bool.dtype, np.integer):
+        index_value = index_bool
     elif index_bool.dtype == float:
         print(
             "Warning: <lib.inter_spike_interval_from_index: "
@@ -388,8 +2787,8 @@ def instant_firing_rate_from_index(index_bool, sample_rate=None):
         sample_rate = 30000.0  # sample_rate in Hz
     if index_bool.dtype == bool:
         index_value = np.where(index_bool)[0]
-    elif index_bool.dtype == int:
-        pass
+    elif np.issubdtype(index_bool.dtype, np.integer):
+        index_value = index_bool
     elif index_bool.dtype == float:
         print(
             "Warning: <lib.inter_spike_interval_from_index: "
@@ -414,6 +2813,7 @@ def cross_probability(
     bin_size=0.001,
     win_len_before=0.050,
     win_len_after=0.050,
+    data_size=None,
 ):
     """
     the word cross_probability is the mixture of cross correlation and conditional probability
@@ -429,28 +2829,28 @@ def cross_probability(
         win_len_before = 0.050  # window length in sec, the default is 50ms
     if win_len_after is None:
         win_len_after = 0.050  # window length in sec, the default is 50ms
-    if spike1_bool.size != spike2_bool.size:
+    # spikes are either bool masks or sorted sample indices, the latter need data_size
+    if (spike1_bool.dtype == bool) and (spike2_bool.dtype == bool):
+        if spike1_bool.size != spike2_bool.size:
+            print(
+                "Error: <lib.cross_probability: "
+                + "size of spike1 and spike2 should be the same.>",
+                file=sys.stderr,
+            )
+        if data_size is None:
+            data_size = spike1_bool.size
+    elif data_size is None:
         print(
             "Error: <lib.cross_probability: "
-            + "size of spike1 and spike2 should be the same.>",
-            file=sys.stderr,
-        )
-    if spike1_bool.dtype != bool:
-        print(
-            "Error: <lib.cross_probability: spike1 should be bool array.>",
+            + "data_size is required for integer spike indices.>",
             file=sys.stderr,
         )
-    if spike2_bool.dtype != bool:
-        print(
-            "Error: <lib.cross_probability: spike2 should be bool array.>",
-            file=sys.stderr,
-        )
-    spike1_time = np.where(spike1_bool)[0] / float(sample_rate)
+    spike1_time = index_bool_to_int(spike1_bool) / float(sample_rate)
     spike1_int = np.round(spike1_time / float(bin_size)).astype(int)
-    spike2_time = np.where(spike2_bool)[0] / float(sample_rate)
+    spike2_time = index_bool_to_int(spike2_bool) / float(sample_rate)
     spike2_index = np.round(spike2_time / float(bin_size)).astype(int)
     spike2_bool_size = np.round(
-        float(spike1_bool.size) / float(sample_rate) / float(bin_size)
+        float(data_size) / float(sample_rate) / float(bin_size)
     ).astype(int)
     _spike2_bool = np.zeros((spike2_bool_size), dtype=np.int8)
     spike2_index[spike2_index < 1] = 1
@@ -461,16 +2861,9 @@ def cross_probability(
     win_len_after_int = np.round(float(win_len_after) / float(bin_size)).astype(int)
     span_int = np.arange(-win_len_before_int, win_len_after_int + 1, 1)
 
-    _spike1_int = spike1_int.reshape((spike1_int.size, -1))
-    _spike1_int = np.tile(_spike1_int, (1, span_int.size))
-    _span_int = np.tile(span_int, (spike1_int.size, 1))
-    _ind = _spike1_int + _span_int
-    _ind_shape = _ind.shape
-    _ind = _ind.ravel()
-    _ind[_ind < 1] = 1
-    _ind[_ind > (_spike2_bool.size - 1)] = _spike2_bool.size - 1
+    _ind = spike1_int[:, np.newaxis] + span_int[np.newaxis, :]
+    np.clip(_ind, 1, _spike2_bool.size - 1, out=_ind)
     _S1xS2_bool = _spike2_bool[_ind]
-    _S1xS2_bool = _S1xS2_bool.reshape(_ind_shape)
     output_S1xS2 = np.mean(_S1xS2_bool, axis=0)
     output_span = span_int * float(bin_size)
     return output_S1xS2, output_span
@@ -509,14 +2902,130 @@ def extract_waveform(
     return waveform, span
 
 
+def correlate_template(waveform, template):
+    """
+        Row-wise cross-correlation of the waveforms with a template in one shot
+    Args:
+        waveform (np.ndarray): shape (num_spikes, num_data_points), one search window per row
+        template (np.ndarray): shape (num_template_points,)
+    Returns:
+        corr (np.ndarray): shape (num_spikes, num_data_points+num_template_points-1),
+            each row is np.correlate(waveform[row, :], template, "full") up to the
+            rounding of the FFT, about 1e-12 of the largest value, so np.argmax may
+            pick another lag where two lags tie within that rounding
+    """
+    waveform = np.atleast_2d(waveform)
+    template = np.asarray(template).reshape(1, -1)
+    if (waveform.size < 1) or (template.size < 1):
+        return np.zeros((waveform.shape[0], 0), dtype=np.float64)
+    corr = signal.fftconvolve(waveform, template[:, ::-1], mode="full", axes=1)
+    return corr
+
+
+def pearson_correlation(waveform, template, dtype=np.float64):
+    """
+        Row-wise Pearson correlation coefficient between the waveforms and a template
+    Args:
+        waveform (np.ndarray): shape (num_spikes, num_data_points)
+        template (np.ndarray): shape (num_data_points,)
+        dtype (np.dtype): precision of the computation, np.float32 halves the memory
+    Returns:
+        corr (np.ndarray): shape (num_spikes,), each element is equal to
+            np.corrcoef(waveform[row, :], template)[0, 1]
+    """
+    _waveform = np.atleast_2d(waveform).astype(dtype)
+    _template = np.asarray(template).reshape(-1).astype(dtype)
+    _waveform = _waveform - np.mean(_waveform, axis=1, keepdims=True)
+    _template = _template - np.mean(_template)
+    _norm = np.sqrt(
+        np.sum(_waveform * _waveform, axis=1) * np.dot(_template, _template)
+    )
+    # a flat waveform or template has no defined correlation, same as np.corrcoef
+    with np.errstate(divide="ignore", invalid="ignore"):
+        corr = np.dot(_waveform, _template) / _norm
+    return corr
+
+
+PCA_BATCH_MIN_SPIKES = 20000
+PCA_BATCH_NUM_SPIKES = 64 * 1024
+
+
 def extract_pca(waveform):
+    """
+        PCA of the waveform matrix, shape (num_data_points, num_spikes)
+    -> from PCA_BATCH_MIN_SPIKES spikes on, only the top 3 components are
+        computed with extract_pca_batched
+    -> the sign of each component is set so that the largest element of its
+        waveform-domain loading is positive, which keeps pca1..3 stable between
+        refreshes and across both paths
+    Returns:
+        components (np.ndarray): shape (num_components, num_spikes)
+        explained_variance_ratio (np.ndarray): shape (num_components,)
+    """
+    if waveform.shape[1] >= PCA_BATCH_MIN_SPIKES:
+        return extract_pca_batched(waveform)
     _pca = PCA(svd_solver="full")
     _pca.fit(waveform)
     components = _pca.components_
     explained_variance_ratio = _pca.explained_variance_ratio_
+    loading = np.dot(waveform - np.mean(waveform, axis=0), components.T)
+    components = components * get_pca_sign(loading)[:, np.newaxis]
     return components, explained_variance_ratio
 
 
+def extract_pca_batched(waveform, num_components=3, batch_len=PCA_BATCH_NUM_SPIKES):
+    """
+        Top components of the waveform matrix, shape (num_data_points, num_spikes)
+    -> the scatter matrix between the data points is accumulated over batches of
+        spikes, its eigenvectors are the waveform-domain loadings
+    -> the components are the projections of the centered spikes on the loadings,
+        so the result equals PCA(svd_solver="full") up to the sign convention
+    """
+    num_points, num_spikes = waveform.shape
+    num_components = min(num_components, num_points, num_spikes)
+    scatter = np.zeros((num_points, num_points), dtype=np.float64)
+    for index_start in range(0, num_spikes, batch_len):
+        batch = np.asarray(
+            waveform[:, index_start : (index_start + batch_len)], dtype=np.float64
+        )
+        batch = batch - np.mean(batch, axis=0)
+        scatter += np.dot(batch, batch.T)
+    eigval, eigvec = np.linalg.eigh(scatter)
+    eigval = np.maximum(eigval[::-1], 0.0)
+    loading = eigvec[:, ::-1][:, :num_components]
+    loading = loading * get_pca_sign(loading)
+    singular_value = np.sqrt(eigval[:num_components])
+    scale = np.zeros(num_components)
+    scale[singular_value > 0] = 1.0 / singular_value[singular_value > 0]
+    components = np.zeros((num_components, num_spikes), dtype=np.float64)
+    for index_start in range(0, num_spikes, batch_len):
+        batch = np.asarray(
+            waveform[:, index_start : (index_start + batch_len)], dtype=np.float64
+        )
+        batch = batch - np.mean(batch, axis=0)
+        components[:, index_start : (index_start + batch_len)] = (
+            np.dot(loading.T, batch) * scale[:, np.newaxis]
+        )
+    explained_variance_ratio = eigval[:num_components] / max(np.sum(eigval), 1e-300)
+    if np.issubdtype(waveform.dtype, np.floating):
+        components = components.astype(waveform.dtype)
+    return components, explained_variance_ratio
+
+
+def get_pca_sign(loading):
+    """
+        +1/-1 for each column of loading, so that its largest element is positive
+    Args:
+        loading (np.ndarray): shape (num_data_points, num_components)
+    Returns:
+        sign (np.ndarray): shape (num_components,)
+    """
+    index_max = np.argmax(np.abs(loading), axis=0)
+    sign = np.sign(loading[index_max, np.arange(loading.shape[1])])
+    sign[sign == 0] = 1.0
+    return sign
+
+
 def inpolygon(xq, yq, xv, yv):
     """
     returns bool array indicating if the query points specified by xq and yq
@@ -636,19 +3145,382 @@ else:
 umap_object = UMAP()
 
 
-def umap(waveform):
+UMAP_REFIT_FRACTION = 0.1
+UMAP_MAX_MODELS = 8
+UMAP_LANDMARK_NUM_BINS = 10
+UMAP_LANDMARK_NUM_NEIGHBORS = 5
+UMAP_LANDMARK_SEED = 0
+
+
+def match_sorted_index(index_ref, index):
+    """
+        Position of each element of index in the sorted array index_ref
+    Returns:
+        position (np.ndarray): shape (len(index),), position in index_ref
+        isFound (np.ndarray): shape (len(index),), False where the element
+            is not in index_ref, its position is then meaningless
+    """
+    index = np.asarray(index).reshape(-1)
+    if len(index_ref) == 0:
+        return np.zeros(len(index), dtype=np.int64), np.zeros(len(index), dtype=bool)
+    position = np.searchsorted(index_ref, index)
+    position[position >= len(index_ref)] = 0
+    isFound = index_ref[position] == index
+    return position, isFound
+
+
+def subsample_stratified(features, num_subsample, num_bins=10, seed=0):
+    """
+        Random subsample which keeps the distribution of the features
+    -> every column of features is split into num_bins quantile bins, and each
+        combination of bins (stratum) contributes in proportion to its size
+    Args:
+        features (np.ndarray): shape (num_samples, num_features)
+        num_subsample (int): number of samples to keep
+    Returns:
+        index (np.ndarray): shape (num_subsample,), sorted index of the kept samples
+    """
+    features = np.asarray(features, dtype=np.float64).reshape(len(features), -1)
+    num_samples = features.shape[0]
+    if num_subsample >= num_samples:
+        return np.arange(num_samples)
+    rng = np.random.default_rng(seed)
+    stratum = np.zeros(num_samples, dtype=np.int64)
+    for counter_feature in range(features.shape[1]):
+        edges = np.quantile(
+            features[:, counter_feature], np.linspace(0, 1, num_bins + 1)[1:-1]
+        )
+        stratum = stratum * num_bins + np.searchsorted(
+            edges, features[:, counter_feature], side="right"
+        )
+    # random order within each stratum, then the first quota of every stratum
+    order = np.lexsort((rng.random(num_samples), stratum))
+    stratum_sorted = stratum[order]
+    stratum_start = np.flatnonzero(np.r_[True, np.diff(stratum_sorted) != 0])
+    stratum_count = np.diff(np.r_[stratum_start, num_samples])
+    rank = np.arange(num_samples) - np.repeat(stratum_start, stratum_count)
+    quota = np.ceil(stratum_count * (num_subsample / num_samples)).astype(np.int64)
+    index = order[rank < np.repeat(quota, stratum_count)]
+    # the rounding up of the quotas is trimmed at random
+    if len(index) > num_subsample:
+        index = rng.choice(index, num_subsample, replace=False)
+    return np.sort(index)
+
+
+class UmapModelManager:
+    """
+        Fitted UMAP models, one per key (slot and spike type)
+    -> each model remembers the PCA window, the spike ids and the waveforms it
+        was fitted on
+    -> the model is refitted from scratch when the window or the waveforms of
+        its spikes change, or when more than refit_fraction of its spikes have
+        been added or removed
+    -> otherwise the embedding of the fitted spikes is reused and only the
+        spikes added since the fit are projected with model.transform
+    -> the least recently used models are dropped beyond max_models
+    -> the requests of a key are serialized, a request waits for the fit of
+        another worker to be reused instead of fitting the same model again
+    -> with landmark_num, a model of a larger spike set is fitted on a subsample
+        stratified by time (spike id) and amplitude, the other spikes are placed
+        at the distance-weighted mean of their nearest landmarks
+    """
+
+    def __init__(self, refit_fraction=UMAP_REFIT_FRACTION, max_models=UMAP_MAX_MODELS):
+        self.refit_fraction = refit_fraction
+        self.max_models = max_models
+        self._model_dict = {}
+        self._key_lock_dict = {}
+        self._lock = threading.Lock()
+
+    def get_key_lock(self, key):
+        with self._lock:
+            key_lock = self._key_lock_dict.get(key)
+            if key_lock is None:
+                key_lock = threading.Lock()
+                self._key_lock_dict[key] = key_lock
+        return key_lock
+
+    def embed(self, waveform, key, spike_id, window=None, landmark_num=0):
+        """
+        Args:
+            waveform (np.ndarray): shape (num_spikes, num_data_points)
+            key (hashable): identifies the model, e.g. (slot_num, "ss")
+            spike_id (np.ndarray): shape (num_spikes,), sorted unique id of
+                each spike, e.g. its sample index within the slot
+            window (tuple): PCA window the waveforms are sliced with
+            landmark_num (int): maximum number of spikes the model is fitted on,
+                0 fits all the spikes
+        Returns:
+            embedding (np.ndarray): shape (num_spikes, 2), embedded dimensions
+        """
+        waveform = np.ascontiguousarray(waveform, dtype=np.float32)
+        spike_id = np.asarray(spike_id).reshape(-1)
+        with self.get_key_lock(key):
+            with self._lock:
+                model_entry = self._model_dict.pop(key, None)
+            embedding = None
+            if model_entry is not None:
+                embedding = self.update_model(
+                    model_entry, waveform, spike_id, window, landmark_num
+                )
+            if embedding is None:
+                model_entry = self.fit_model(waveform, spike_id, window, landmark_num)
+                embedding = model_entry["embedding"]
+            with self._lock:
+                self._model_dict[key] = model_entry
+                while len(self._model_dict) > self.max_models:
+                    self._model_dict.pop(next(iter(self._model_dict)))
+        return embedding.copy()
+
+    def get_cached_embedding(
+        self, waveform, key, spike_id, window=None, landmark_num=0
+    ):
+        """
+        Embedding of the spikes if it needs neither a fit nor a transform,
+        otherwise None, also None while a worker updates the model of the key
+        -> read-only, the model is left as it is
+        """
+        waveform = np.ascontiguousarray(waveform, dtype=np.float32)
+        spike_id = np.asarray(spike_id).reshape(-1)
+        key_lock = self.get_key_lock(key)
+        if not (key_lock.acquire(blocking=False)):
+            return None
+        try:
+            with self._lock:
+                model_entry = self._model_dict.get(key, None)
+            if model_entry is None:
+                return None
+            embedding = self.update_model(
+                model_entry,
+                waveform,
+                spike_id,
+                window,
+                landmark_num,
+                isTransformAllowed=False,
+            )
+        finally:
+            key_lock.release()
+        return embedding
+
+    def fit_model(self, waveform, spike_id, window, landmark_num=0):
+        model = UMAP()
+        model_entry = {
+            "model": model,
+            "window": window,
+            "landmark_num": landmark_num,
+            "landmark_nn": None,
+            "landmark_embedding": None,
+            "spike_id": spike_id.copy(),
+            "waveform": waveform,
+            "added_spike_id": np.zeros((0), dtype=spike_id.dtype),
+            "added_waveform": np.zeros((0, waveform.shape[1]), dtype=np.float32),
+            "added_embedding": np.zeros((0, 2), dtype=np.float32),
+        }
+        if 0 < landmark_num < len(spike_id):
+            landmark_index = subsample_stratified(
+                np.column_stack((spike_id, np.ptp(waveform, axis=1))),
+                landmark_num,
+                num_bins=UMAP_LANDMARK_NUM_BINS,
+                seed=UMAP_LANDMARK_SEED,
+            )
+            landmark_embedding = np.asarray(
+                model.fit_transform(waveform[landmark_index]), dtype=np.float32
+            )
+            model_entry["landmark_nn"] = NearestNeighbors(
+                n_neighbors=min(UMAP_LANDMARK_NUM_NEIGHBORS, len(landmark_index))
+            ).fit(waveform[landmark_index])
+            model_entry["landmark_embedding"] = landmark_embedding
+            embedding = self.project(model_entry, waveform)
+            embedding[landmark_index] = landmark_embedding
+        else:
+            embedding = np.asarray(model.fit_transform(waveform), dtype=np.float32)
+        model_entry["embedding"] = embedding
+        return model_entry
+
+    @staticmethod
+    def project(model_entry, waveform):
+        """
+        Embedding of new spikes, from the landmarks if the model has them,
+        otherwise with model.transform
+        """
+        if model_entry["landmark_nn"] is None:
+            embedding = model_entry["model"].transform(waveform)
+            return np.asarray(embedding, dtype=np.float32)
+        distance, index = model_entry["landmark_nn"].kneighbors(waveform)
+        # a spike which coincides with a landmark takes its position
+        weight = 1.0 / np.maximum(distance, np.finfo(np.float32).eps)
+        weight = weight / np.sum(weight, axis=1, keepdims=True)
+        embedding = np.sum(
+            model_entry["landmark_embedding"][index] * weight[:, :, np.newaxis], axis=1
+        )
+        return embedding.astype(np.float32)
+
+    def update_model(
+        self,
+        model_entry,
+        waveform,
+        spike_id,
+        window,
+        landmark_num=0,
+        isTransformAllowed=True,
+    ):
+        """
+        Embedding of the spikes from the fitted model, None if it needs a refit
+        (or a transform when isTransformAllowed is False)
+        -> the projected spikes are kept in model_entry for the next update,
+            with isTransformAllowed False model_entry is only read
+        """
+        if (
+            (window != model_entry["window"])
+            or (landmark_num != model_entry["landmark_num"])
+            or (waveform.shape[1] != model_entry["waveform"].shape[1])
+        ):
+            return None
+        position, isFound = match_sorted_index(model_entry["spike_id"], spike_id)
+        num_found = int(isFound.sum())
+        num_changed = (len(spike_id) - num_found) + (
+            len(model_entry["spike_id"]) - num_found
+        )
+        if num_changed > self.refit_fraction * len(model_entry["spike_id"]):
+            return None
+        if not np.array_equal(
+            waveform[isFound], model_entry["waveform"][position[isFound]]
+        ):
+            return None
+        embedding = np.zeros((len(spike_id), 2), dtype=np.float32)
+        embedding[isFound] = model_entry["embedding"][position[isFound]]
+        isAdded = np.logical_not(isFound)
+        added_spike_id = spike_id[isAdded]
+        added_waveform = waveform[isAdded]
+        added_embedding = np.zeros((len(added_spike_id), 2), dtype=np.float32)
+        # spikes added in a previous update keep their projection
+        position, isFound = match_sorted_index(
+            model_entry["added_spike_id"], added_spike_id
+        )
+        isFound[isFound] = np.all(
+            added_waveform[isFound] == model_entry["added_waveform"][position[isFound]],
+            axis=1,
+        )
+        added_embedding[isFound] = model_entry["added_embedding"][position[isFound]]
+        isNew = np.logical_not(isFound)
+        if isNew.any() and not isTransformAllowed:
+            return None
+        if isNew.any():
+            added_embedding[isNew] = self.project(model_entry, added_waveform[isNew])
+        embedding[isAdded] = added_embedding
+        if isTransformAllowed:
+            model_entry["added_spike_id"] = added_spike_id
+            model_entry["added_waveform"] = added_waveform
+            model_entry["added_embedding"] = added_embedding
+        return embedding
+
+    def clear(self):
+        with self._lock:
+            self._model_dict.clear()
+        return 0
+
+
+umap_model_manager = UmapModelManager()
+
+
+def umap(waveform, key=None, spike_id=None, window=None, landmark_num=0):
     """
         Uniform Manifold Approximation and Projection (UMAP)
     Args:
         waveform (np.ndarray): shape (num_spikes,num_data_points), containing the waveform
             of each spike within the region of interest
+        key (hashable): if given, the fitted model is kept in umap_model_manager
+            under this key and reused for small edits of the spike set
+        spike_id (np.ndarray): shape (num_spikes,), sorted unique id of each spike
+        window (tuple): PCA window the waveforms are sliced with
+        landmark_num (int): if the spike set is larger, the model is fitted on a
+            stratified subsample of this size and the other spikes are projected
     Returns:
         embedding (np.ndarray): shape (num_spikes, 2), embedded dimensions
     """
-    embedding = umap_object.fit_transform(waveform)
+    if (key is None) or (spike_id is None):
+        embedding = umap_object.fit_transform(waveform)
+        return embedding
+    embedding = umap_model_manager.embed(
+        waveform, key, spike_id, window=window, landmark_num=landmark_num
+    )
     return embedding
 
 
+class UmapRunner(QtCore.QObject):
+    """
+        UMAP embeddings computed in a worker pool instead of the GUI thread
+    -> submit() cancels the pending request of the same spike type, a result
+        which has been overtaken by a newer request is dropped
+    -> return_signal(spike_type, spike_id, embedding) is emitted in the thread
+        the runner lives in, i.e. the GUI thread
+    """
+
+    return_signal = QtCore.pyqtSignal("PyQt_PyObject", "PyQt_PyObject", "PyQt_PyObject")
+    _done_signal = QtCore.pyqtSignal("PyQt_PyObject", "PyQt_PyObject")
+
+    def __init__(self, parent=None, max_workers=2):
+        super(UmapRunner, self).__init__(parent)
+        # numba's thread pool has to be started from the GUI thread, a tbb pool which
+        # is first started by a worker thread hangs the interpreter at exit
+        try:
+            from numba.np.ufunc.parallel import _launch_threads
+
+            _launch_threads()
+        except ImportError:
+            pass
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._future_dict = {}
+        self._done_signal.connect(self.process_finished)
+
+    def submit(self, spike_type, waveform, key, spike_id, window=None, landmark_num=0):
+        self.cancel(spike_type)
+        future = self._executor.submit(
+            umap,
+            np.array(waveform),
+            key=key,
+            spike_id=spike_id,
+            window=window,
+            landmark_num=landmark_num,
+        )
+        self._future_dict[spike_type] = (future, spike_id)
+        # the callback runs in the worker thread, the signal queues it to the GUI thread
+        future.add_done_callback(
+            lambda _future: self._done_signal.emit(spike_type, _future)
+        )
+        return 0
+
+    def cancel(self, spike_type=None):
+        # a request which has already started is not stopped but its result is dropped
+        if spike_type is None:
+            spike_type_list = list(self._future_dict.keys())
+        else:
+            spike_type_list = [spike_type]
+        for _spike_type in spike_type_list:
+            future_entry = self._future_dict.pop(_spike_type, None)
+            if future_entry is not None:
+                future_entry[0].cancel()
+        return 0
+
+    def isRunning(self, spike_type=None):
+        if spike_type is None:
+            return len(self._future_dict) > 0
+        return spike_type in self._future_dict
+
+    def process_finished(self, spike_type, future):
+        future_entry = self._future_dict.get(spike_type, None)
+        if (future_entry is None) or (future_entry[0] is not future):
+            return 0
+        self._future_dict.pop(spike_type)
+        if future.cancelled():
+            return 0
+        if future.exception() is not None:
+            print("Error: <lib.UmapRunner: " + str(future.exception()) + ">")
+            return 0
+        self.return_signal.emit(spike_type, future_entry[1], future.result())
+        return 0
+
+
 @jit(nopython=True)
 def hold_index_prev(bool_array):
     index_ = np.where(bool_array)[0]
@@ -686,14 +3558,10 @@ def distance_from_prev_element(bool_array_from, bool_array_to):
     """
     if bool_array_from.size != bool_array_to.size:
         return np.zeros(len(bool_array_from), dtype=np.int64)
-    if (bool_array_from.sum() < 1) or (bool_array_to.sum() < 1):
-        return np.zeros(len(bool_array_from), dtype=np.int64)
-    index_from_ = np.zeros(len(bool_array_from), dtype=np.int64)
-    index_from_[bool_array_from] = np.where(bool_array_from)[0]
-    hold_index_prev_to = hold_index_prev(bool_array_to)
-    out_ = index_from_ - hold_index_prev_to
-    out_[hold_index_prev_to == -1] = 0
-    out_[np.logical_not(bool_array_from)] = 0
+    out_ = np.zeros(len(bool_array_from), dtype=np.int64)
+    out_[bool_array_from] = distance_from_prev_index(
+        index_bool_to_int(bool_array_from), index_bool_to_int(bool_array_to)
+    )
     return out_
 
 
@@ -709,14 +3577,102 @@ def distance_to_next_element(bool_array_from, bool_array_to):
     """
     if bool_array_from.size != bool_array_to.size:
         return np.zeros(len(bool_array_from), dtype=np.int64)
-    if (bool_array_from.sum() < 1) or (bool_array_to.sum() < 1):
-        return np.zeros(len(bool_array_from), dtype=np.int64)
-    index_from_ = np.zeros(len(bool_array_from), dtype=np.int64)
-    index_from_[bool_array_from] = np.where(bool_array_from)[0]
-    hold_index_next_to = hold_index_next(bool_array_to)
-    out_ = hold_index_next_to - index_from_
-    out_[hold_index_next_to == -1] = 0
-    out_[np.logical_not(bool_array_from)] = 0
+    out_ = np.zeros(len(bool_array_from), dtype=np.int64)
+    out_[bool_array_from] = distance_to_next_index(
+        index_bool_to_int(bool_array_from), index_bool_to_int(bool_array_to)
+    )
+    return out_
+
+
+# Sparse spike index
+def index_bool_to_int(index_bool):
+    # sorted sample indices of the spikes, integer input is passed through
+    if index_bool.dtype == bool:
+        return np.flatnonzero(index_bool)
+    return np.asarray(index_bool, dtype=np.int64)
+
+
+def index_int_to_bool(index_int, data_size):
+    index_bool = np.zeros((int(data_size)), dtype=bool)
+    index_bool[index_int] = True
+    return index_bool
+
+
+# the topLevel spike indices are sparse in memory, but a .psort file keeps them as
+# bool masks over ch_data, the layout read by the MATLAB scripts and older versions
+PSORT_INDEX_KEYS = ("ss_index", "cs_index", "cs_index_slow")
+
+
+def index_int_to_mask(index_int, data_size):
+    # bool mask as saved in a .psort file, a mask is passed through
+    if index_int.dtype == bool:
+        return index_int
+    return index_int_to_bool(index_int, data_size)
+
+
+def get_index_mask_digest(index_int, data_size):
+    # digest of index_int_to_mask, hashed from the spike indices so it costs the
+    # number of spikes and not the length of the recording
+    index_int = index_bool_to_int(index_int)
+    value_hash = hashlib.sha1("index_mask:{}".format(int(data_size)).encode("ascii"))
+    value_hash.update(np.ascontiguousarray(index_int, dtype=np.int64))
+    return value_hash.hexdigest()
+
+
+def index_int_slice(index_int, index_start, index_end):
+    # spikes within [index_start, index_end), relative to index_start
+    _start, _end = np.searchsorted(index_int, [index_start, index_end], side="left")
+    return index_int[_start:_end] - index_start
+
+
+def index_int_replace(index_int, index_start, index_end, index_int_new):
+    # replace the spikes within [index_start, index_end) with index_int_new, which
+    # is relative to index_start, the result stays sorted
+    _start, _end = np.searchsorted(index_int, [index_start, index_end], side="left")
+    return np.concatenate(
+        (
+            index_int[:_start],
+            np.asarray(index_int_new, dtype=np.int64) + index_start,
+            index_int[_end:],
+        )
+    )
+
+
+def distance_from_prev_index(index_from, index_to):
+    """
+        Distance from each spike of index_from to the nearest previous spike of index_to
+    Args:
+        index_from (np.ndarray, int64): shape (n_spikes_from,), sorted sample indices
+        index_to (np.ndarray, int64): shape (n_spikes_to,), sorted sample indices
+    Returns:
+        out_ (np.ndarray, int64): shape (n_spikes_from,), zero where there is no
+                previous spike
+    """
+    out_ = np.zeros(len(index_from), dtype=np.int64)
+    if (len(index_from) < 1) or (len(index_to) < 1):
+        return out_
+    _prev = np.searchsorted(index_to, index_from, side="left") - 1
+    _valid = _prev >= 0
+    out_[_valid] = index_from[_valid] - index_to[_prev[_valid]]
+    return out_
+
+
+def distance_to_next_index(index_from, index_to):
+    """
+        Distance from each spike of index_from to the nearest next spike of index_to
+    Args:
+        index_from (np.ndarray, int64): shape (n_spikes_from,), sorted sample indices
+        index_to (np.ndarray, int64): shape (n_spikes_to,), sorted sample indices
+    Returns:
+        out_ (np.ndarray, int64): shape (n_spikes_from,), zero where there is no
+                next spike
+    """
+    out_ = np.zeros(len(index_from), dtype=np.int64)
+    if (len(index_from) < 1) or (len(index_to) < 1):
+        return out_
+    _next = np.searchsorted(index_to, index_from, side="right")
+    _valid = _next < len(index_to)
+    out_[_valid] = index_to[_next[_valid]] - index_from[_valid]
     return out_
 
 
@@ -733,62 +3689,60 @@ def resample(x_input, y_input, x_output):
     return y_output
 
 
-def isolation_score(scatter_mat, labels, nknn=6):
-    unique_labels = np.unique(labels)
-    n = unique_labels.shape[0]
-    isolation = np.NaN + np.ones([n, n], dtype=np.float32)
-    iso_score = np.zeros([n], dtype=np.float32)
-    for ii in range(n - 1):
-        loi = unique_labels[ii]
-        num_loi = sum(labels == loi)
-        if num_loi < nknn:
-            isolation[ii, :] = np.NAN
-            isolation[:, ii] = np.NAN
-            continue
-        for i in range(ii + 1, n):
-            label = unique_labels[i]
-
-            num_label = sum(labels == label)
-            if num_label < nknn:
-                isolation[ii, i] = np.NAN
-                isolation[i, ii] = np.NAN
-                continue
-            max_num_events = 500
-            num_events = min(max_num_events, num_loi, num_label)
-            ind_loi = labels == loi
-            ind_label = labels == label
-
-            _data_loi = scatter_mat[ind_loi, :]
-            _data_label = scatter_mat[ind_label, :]
-
-            idx_rnd_loi = np.random.randint(np.sum(ind_loi), size=num_events)
-            idx_rnd_label = np.random.randint(np.sum(ind_label), size=num_events)
+ISOLATION_MAX_NUM_EVENTS = 500
 
-            _data_loi_rnd = _data_loi[idx_rnd_loi, :]
-            _data_label_rnd = _data_label[idx_rnd_label, :]
 
-            _data = np.concatenate([_data_loi_rnd, _data_label_rnd], axis=0)
+def isolation_score_pair(data_loi, data_label, nknn=6):
+    """
+        Isolation of two groups of events in percent, 100 when no neighbor of an
+        event belongs to the other group and 0 when the groups are evenly mixed
+    -> the groups are cut to the same number of events
+    """
+    num_events = min(data_loi.shape[0], data_label.shape[0])
+    _data = np.concatenate([data_loi[:num_events], data_label[:num_events]], axis=0)
+    _, indices = NearestNeighbors(n_neighbors=nknn).fit(_data).kneighbors()
+    group_id = np.arange(num_events * 2) >= num_events
+    # kneighbors() already leaves the event itself out, the first neighbor is
+    # skipped as well to keep the scores of the earlier implementation
+    pct_overlap = np.mean(group_id[indices[:, 1:]] != group_id[:, np.newaxis])
+    return 200 * np.absolute(0.5 - pct_overlap)
 
-            distances, indices = (
-                NearestNeighbors(n_neighbors=nknn, algorithm="auto")
-                .fit(_data)
-                .kneighbors()
-            )
 
-            group_id = np.zeros(_data.shape[0], dtype=int)
-            group_id[0:num_events] = 1
-            group_id[num_events:] = 2
-            num_overlap = 0
-            total = 0
-            for j in range(num_events * 2):
-                for k in range(1, nknn):
-                    ind = indices[j][k]
-                    if group_id[j] != group_id[ind]:
-                        num_overlap = num_overlap + 1
-                    total = total + 1
-            pct_overlap = num_overlap / total
-            isolation[ii, i] = 200 * np.absolute(0.5 - pct_overlap)
-            isolation[i, ii] = isolation[ii, i]
+def isolation_score(scatter_mat, labels, nknn=6, seed=0, num_workers=None):
+    """
+        Isolation score of each label, its lowest isolation against the other labels
+    -> every label is subsampled once, ISOLATION_MAX_NUM_EVENTS events drawn with
+        replacement by a seeded RNG, and all of its pairs share that subsample
+    -> the pairs are evaluated in a thread pool
+    Returns:
+        iso_score (np.ndarray): shape (num_labels,), in the order of np.unique(labels),
+            NaN for the labels with less than nknn events
+    """
+    rng = np.random.default_rng(seed)
+    unique_labels, counts = np.unique(labels, return_counts=True)
+    n = unique_labels.shape[0]
+    isolation = np.NaN + np.ones([n, n], dtype=np.float32)
+    data_list = []
+    for counter_label, label in enumerate(unique_labels):
+        _data = scatter_mat[labels == label, :]
+        num_events = min(ISOLATION_MAX_NUM_EVENTS, counts[counter_label])
+        data_list.append(_data[rng.integers(_data.shape[0], size=num_events), :])
+    pair_list = [
+        (ii, i)
+        for ii in range(n - 1)
+        for i in range(ii + 1, n)
+        if (counts[ii] >= nknn) and (counts[i] >= nknn)
+    ]
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        isolation_list = executor.map(
+            lambda pair: isolation_score_pair(
+                data_list[pair[0]], data_list[pair[1]], nknn=nknn
+            ),
+            pair_list,
+        )
+        for (ii, i), pair_isolation in zip(pair_list, isolation_list):
+            isolation[ii, i] = pair_isolation
+            isolation[i, ii] = pair_isolation
 
     iso_score = np.nanmin(isolation, axis=1)
     return iso_score
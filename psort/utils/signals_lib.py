@@ -1,10 +1,123 @@
+import atexit
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 
 import numpy as np
+from numba import jit
 
 from psort.utils import database, lib
 
 
+# CONFLICT ENGINE
+# The following kernels work on the sorted integer indices of the candidate spikes and
+# update the boolean index array in place. They follow the exact same sequential rules
+# as the original per-spike loops, i.e. each candidate sees the edits made by the
+# candidates before it, but without allocating a window array for every spike.
+@jit(nopython=True)
+def resolve_dominant_peak_conflicts(index_int, index_bool, data, window_len, isPeakMax):
+    index_size = index_bool.size
+    for counter_spike in range(index_int.size):
+        index_local = index_int[counter_spike]
+        # if there is not enough data window before/after the potential spike, then skip it
+        if (index_local < window_len) or (index_local > (index_size - window_len)):
+            index_bool[index_local] = False
+            continue
+        win_begin = index_local - window_len
+        win_end = index_local + window_len
+        # if there is just one spike in window, then all is OK
+        num_spike_in_win = 0
+        for counter_win in range(win_begin, win_end):
+            if index_bool[counter_win]:
+                num_spike_in_win += 1
+        if num_spike_in_win < 2:
+            continue
+        # find the dominant min/max as the index of the spike
+        valid_ind = 0
+        for counter_win in range(win_begin, win_end):
+            index_bool[counter_win] = False
+            if isPeakMax:
+                if data[counter_win] > data[win_begin + valid_ind]:
+                    valid_ind = counter_win - win_begin
+            else:
+                if data[counter_win] < data[win_begin + valid_ind]:
+                    valid_ind = counter_win - win_begin
+        # See the description in resolve_ss_ss_conflicts, the dominant value at the
+        # margin of the window is not a local optima and should be rejected
+        if valid_ind != 0:
+            index_bool[win_begin + valid_ind] = True
+    return 0
+
+
+@jit(nopython=True)
+def resolve_first_spike_conflicts(index_int, index_bool, window_len):
+    index_size = index_bool.size
+    for counter_spike in range(index_int.size):
+        index_local = index_int[counter_spike]
+        # if there is not enough data window before/after the potential spike, then skip it
+        if (index_local < window_len) or (index_local > (index_size - window_len)):
+            index_bool[index_local] = False
+            continue
+        win_begin = index_local - window_len
+        win_end = index_local + window_len
+        # just accept the first index and reject the rest
+        first_ind = -1
+        for counter_win in range(win_begin, win_end):
+            if index_bool[counter_win]:
+                if first_ind < 0:
+                    first_ind = counter_win
+                else:
+                    index_bool[counter_win] = False
+    return 0
+
+
+@jit(nopython=True)
+def resolve_slow_peak_after_spike(
+    index_int, index_bool, index_slow_bool, data, window_len, isPeakMax
+):
+    index_size = index_bool.size
+    for counter_spike in range(index_int.size):
+        index_local = index_int[counter_spike]
+        # if there is not enough data window after the potential spike, then skip it
+        if index_local > (index_size - window_len):
+            index_bool[index_local] = False
+            continue
+        # find the dominant min/max as the index of the slow spike
+        valid_ind = index_local
+        for counter_win in range(index_local, index_local + window_len):
+            if isPeakMax:
+                if data[counter_win] > data[valid_ind]:
+                    valid_ind = counter_win
+            else:
+                if data[counter_win] < data[valid_ind]:
+                    valid_ind = counter_win
+        index_slow_bool[valid_ind] = True
+    return 0
+
+
+@jit(nopython=True)
+def resolve_window_exclusion(index_int, index_bool, window_len_back, window_len_front):
+    index_size = index_bool.size
+    for counter_spike in range(index_int.size):
+        index_local = index_int[counter_spike]
+        # the window is clipped at the end of the data, the original per-spike loop
+        # raised IndexError for a spike closer than window_len_front to the end
+        win_end = min(index_local + window_len_front, index_size)
+        for counter_win in range(index_local - window_len_back, win_end):
+            # negative indices wrap around as they do with numpy fancy indexing
+            if counter_win < 0:
+                index_bool[counter_win + index_size] = False
+            else:
+                index_bool[counter_win] = False
+    return 0
+
+
 # DATA MANAGEMENT
 def resolve_ss_ss_conflicts(_workingDataBase):
     win_look_around = _workingDataBase["GLOBAL_CONFLICT_SS_SS_AROUND"][0]
@@ -17,40 +130,11 @@ def resolve_ss_ss_conflicts(_workingDataBase):
     _data_ss = _workingDataBase["ch_data_ss"]
     _ss_index = _workingDataBase["ss_index"]
     _ss_index_int = np.where(_workingDataBase["ss_index"])[0]
-    for counter_ss in range(_ss_index_int.size):
-        _ss_index_local = _ss_index_int[counter_ss]
-        # if there is not enough data window before the potential SS, then skip it
-        if _ss_index_local < window_len:
-            _ss_index[_ss_index_local] = False
-            continue
-        # if there is not enough data window after the potential SS, then skip it
-        if _ss_index_local > (_ss_index.size - window_len):
-            _ss_index[_ss_index_local] = False
-            continue
-        search_win_inds = np.arange(
-            _ss_index_local - window_len, _ss_index_local + window_len, 1
-        )
-        ss_search_win_bool = _ss_index[search_win_inds]
-        ss_search_win_int = np.where(ss_search_win_bool)[0]
-        ss_search_win_data = _data_ss[search_win_inds]
-        # if there is just one SS in window, then all is OK
-        if ss_search_win_int.size < 2:
-            continue
-        if ss_search_win_int.size > 1:
-            # find the dominant min/max as the index of the spike
-            if _peakType == "min":
-                valid_ind = np.argmin(ss_search_win_data)
-            elif _peakType == "max":
-                valid_ind = np.argmax(ss_search_win_data)
-            ss_search_win_bool = np.zeros(search_win_inds.shape, dtype=bool)
-            # following is to address the bug that the dominant value takes place at the margin of the
-            # window and is not a local optima. This results in erroneous alignments.
-            # instead of "ss_search_win_bool[valid_ind] = True" , "ss_search_win_bool[0] = False",
-            # and "ss_search_win_bool[-1] = False"
-            ss_search_win_bool[valid_ind] = not (
-                (valid_ind == 0) or (valid_ind == ss_search_win_bool.size)
-            )
-            _ss_index[search_win_inds] = deepcopy(ss_search_win_bool)
+    # the dominant value may take place at the margin of the window and is not a local
+    # optima. This results in erroneous alignments, so such a window is left empty.
+    resolve_dominant_peak_conflicts(
+        _ss_index_int, _ss_index, _data_ss, window_len, _peakType == "max"
+    )
     return 0
 
 
@@ -65,38 +149,9 @@ def resolve_cs_slow_cs_slow_conflicts(_workingDataBase):
     _data_cs = _workingDataBase["ch_data_cs"]
     _cs_index_slow = _workingDataBase["cs_index_slow"]
     _cs_index_slow_int = np.where(_workingDataBase["cs_index_slow"])[0]
-    for counter_cs in range(_cs_index_slow_int.size):
-        _cs_index_slow_local = _cs_index_slow_int[counter_cs]
-        # if there is not enough data window before the potential CS, then skip it
-        if _cs_index_slow_local < window_len:
-            _cs_index_slow[_cs_index_slow_local] = False
-            continue
-        # if there is not enough data window after the potential CS, then skip it
-        if _cs_index_slow_local > (_cs_index_slow.size - window_len):
-            _cs_index_slow[_cs_index_slow_local] = False
-            continue
-        search_win_inds = np.arange(
-            _cs_index_slow_local - window_len, _cs_index_slow_local + window_len, 1
-        )
-        cs_search_win_bool = _cs_index_slow[search_win_inds]
-        cs_search_win_int = np.where(cs_search_win_bool)[0]
-        cs_search_win_data = _data_cs[search_win_inds]
-        # if there is just one CS in window, then all is OK
-        if cs_search_win_int.size < 2:
-            continue
-        if cs_search_win_int.size > 1:
-            # find the dominant min/max as the index of the spike
-            if _peakType == "min":
-                valid_ind = np.argmin(cs_search_win_data)
-            elif _peakType == "max":
-                valid_ind = np.argmax(cs_search_win_data)
-            cs_search_win_bool = np.zeros(search_win_inds.shape, dtype=bool)
-            # See the description in resolve_ss_ss_conflicts
-            # removed "cs_search_win_bool[valid_ind] = True"
-            cs_search_win_bool[valid_ind] = not (
-                (valid_ind == 0) or (valid_ind == cs_search_win_bool.size)
-            )
-            _cs_index_slow[search_win_inds] = deepcopy(cs_search_win_bool)
+    resolve_dominant_peak_conflicts(
+        _cs_index_slow_int, _cs_index_slow, _data_cs, window_len, _peakType == "max"
+    )
     return 0
 
 
@@ -105,30 +160,7 @@ def resolve_cs_cs_conflicts(_workingDataBase):
     window_len = int(win_look_around * _workingDataBase["sample_rate"][0])
     _cs_index = _workingDataBase["cs_index"]
     _cs_index_int = np.where(_workingDataBase["cs_index"])[0]
-    for counter_cs in range(_cs_index_int.size):
-        _cs_index_local = _cs_index_int[counter_cs]
-        # if there is not enough data window before the potential CS, then skip it
-        if _cs_index_local < window_len:
-            _cs_index[_cs_index_local] = False
-            continue
-        # if there is not enough data window after the potential CS, then skip it
-        if _cs_index_local > (_cs_index.size - window_len):
-            _cs_index[_cs_index_local] = False
-            continue
-        search_win_inds = np.arange(
-            _cs_index_local - window_len, _cs_index_local + window_len, 1
-        )
-        cs_search_win_bool = _cs_index[search_win_inds]
-        cs_search_win_int = np.where(cs_search_win_bool)[0]
-        # if there is just one CS in window, then all is OK
-        if cs_search_win_int.size < 2:
-            continue
-        if cs_search_win_int.size > 1:
-            # just accept the first index and reject the rest
-            cs_search_win_int = cs_search_win_int + _cs_index_local - window_len
-            valid_ind = cs_search_win_int[0]
-            _cs_index[cs_search_win_int] = False
-            _cs_index[valid_ind] = True
+    resolve_first_spike_conflicts(_cs_index_int, _cs_index, window_len)
     return 0
 
 
@@ -144,22 +176,15 @@ def resolve_cs_cs_slow_conflicts(_workingDataBase):
     _cs_index_int = np.where(_workingDataBase["cs_index"])[0]
     _workingDataBase["cs_index_slow"] = np.zeros((_cs_index.size), dtype=bool)
     _cs_index_slow = _workingDataBase["cs_index_slow"]
-    for counter_cs in range(_cs_index_int.size):
-        _cs_index_local = _cs_index_int[counter_cs]
-        # if there is not enough data window after the potential CS, then skip it
-        if _cs_index_local > (_cs_index.size - window_len):
-            _cs_index[_cs_index_local] = False
-            continue
-        search_win_inds = np.arange(_cs_index_local, _cs_index_local + window_len, 1)
-        cs_search_win_data = _data_cs[search_win_inds]
-        # find the dominant min/max as the index of the spike
-        if _peakType == "max":
-            _cs_index_slow_local = np.argmax(cs_search_win_data)
-        elif _peakType == "min":
-            _cs_index_slow_local = np.argmin(cs_search_win_data)
-        _cs_index_slow_local = _cs_index_slow_local + _cs_index_local
-        # ESN: decided not to reject the edges, look at resolve_ss_ss_conflicts
-        _cs_index_slow[_cs_index_slow_local] = True
+    # ESN: decided not to reject the edges, look at resolve_ss_ss_conflicts
+    resolve_slow_peak_after_spike(
+        _cs_index_int,
+        _cs_index,
+        _cs_index_slow,
+        _data_cs,
+        window_len,
+        _peakType == "max",
+    )
     return 0
 
 
@@ -170,17 +195,10 @@ def resolve_cs_ss_conflicts(_workingDataBase):
     window_len_front = int(win_look_after * _workingDataBase["sample_rate"][0])
     _cs_index_int = np.where(_workingDataBase["cs_index"])[0]
     _ss_index = _workingDataBase["ss_index"]
-    for counter_cs in range(_cs_index_int.size):
-        _cs_index_local = _cs_index_int[counter_cs]
-        search_win_inds = np.arange(
-            _cs_index_local - window_len_back, _cs_index_local + window_len_front, 1
-        )
-        ss_search_win_bool = _ss_index[search_win_inds]
-        ss_search_win_int = np.where(ss_search_win_bool)[0]
-        if ss_search_win_int.size > 0:
-            # invalidate SS around a CS
-            _ss_ind_invalid = ss_search_win_int + _cs_index_local - window_len_back
-            _ss_index[_ss_ind_invalid] = False
+    # invalidate SS around a CS
+    resolve_window_exclusion(
+        _cs_index_int, _ss_index, window_len_back, window_len_front
+    )
     return 0
 
 
@@ -215,6 +233,35 @@ def align_cs_wrt_ss_index(_workingDataBase):
     return 0
 
 
+def align_cs_wrt_template(
+    _workingDataBase, _temp, window_len_before, window_len_after, window_len_temp
+):
+    _cs_index_slow = _workingDataBase["cs_index_slow"]
+    _cs_index_slow_int = np.where(_workingDataBase["cs_index_slow"])[0]
+    _workingDataBase["cs_index"] = np.zeros((_cs_index_slow.size), dtype=bool)
+    _cs_index = _workingDataBase["cs_index"]
+    _data_ss = _workingDataBase["ch_data_ss"]
+    # if there is not enough data window before/after the potential CS, then skip it
+    _is_valid = np.logical_and(
+        _cs_index_slow_int >= window_len_before,
+        _cs_index_slow_int <= (_data_ss.size - window_len_after),
+    )
+    _cs_index_slow[_cs_index_slow_int[np.logical_not(_is_valid)]] = False
+    _cs_slow_index = _cs_index_slow_int[_is_valid]
+    if _cs_slow_index.size < 1:
+        return 0
+    # gather all the search windows and correlate them with the template at once
+    search_win_inds = _cs_slow_index.reshape(-1, 1) + np.arange(
+        -window_len_before, window_len_after, 1
+    ).reshape(1, -1)
+    ss_data_search_win = _data_ss[search_win_inds]
+    corr = lib.correlate_template(ss_data_search_win, _temp)
+    cs_ind_search_win = np.argmax(corr, axis=1) - window_len_temp + 2
+    cs_ind = cs_ind_search_win + _cs_slow_index - window_len_before
+    _cs_index[cs_ind] = True
+    return 0
+
+
 def align_cs_wrt_ss_temp(_workingDataBase):
     win_look_before = _workingDataBase["GLOBAL_CS_ALIGN_SSTEMPLATE_BEFORE"][0]
     win_look_after = _workingDataBase["GLOBAL_CS_ALIGN_SSTEMPLATE_AFTER"][0]
@@ -227,30 +274,13 @@ def align_cs_wrt_ss_temp(_workingDataBase):
         (win_look_after + win_ss_template_after) * _workingDataBase["sample_rate"][0]
     )
     window_len_ss_temp = int(win_ss_template_after * _workingDataBase["sample_rate"][0])
-    _cs_index_slow = _workingDataBase["cs_index_slow"]
-    _cs_index_slow_int = np.where(_workingDataBase["cs_index_slow"])[0]
-    _workingDataBase["cs_index"] = np.zeros((_cs_index_slow.size), dtype=bool)
-    _cs_index = _workingDataBase["cs_index"]
-    _data_ss = _workingDataBase["ch_data_ss"]
-    _ss_temp = _workingDataBase["ss_wave_template"]
-    for counter_cs in range(_cs_index_slow_int.size):
-        _cs_slow_index = _cs_index_slow_int[counter_cs]
-        # if there is not enough data window before the potential CS, then skip it
-        if _cs_slow_index < window_len_before:
-            _cs_index_slow[_cs_slow_index] = False
-            continue
-        # if there is not enough data window after the potential CS, then skip it
-        if _cs_slow_index > (_data_ss.size - window_len_after):
-            _cs_index_slow[_cs_slow_index] = False
-            continue
-        search_win_inds = np.arange(
-            _cs_slow_index - window_len_before, _cs_slow_index + window_len_after, 1
-        )
-        ss_data_search_win = _data_ss[search_win_inds]
-        corr = np.correlate(ss_data_search_win, _ss_temp, "full")
-        cs_ind_search_win = np.argmax(corr) - window_len_ss_temp + 2
-        cs_ind = cs_ind_search_win + _cs_slow_index - window_len_before
-        _cs_index[cs_ind] = True
+    align_cs_wrt_template(
+        _workingDataBase,
+        _workingDataBase["ss_wave_template"],
+        window_len_before,
+        window_len_after,
+        window_len_ss_temp,
+    )
     return 0
 
 
@@ -266,30 +296,13 @@ def align_cs_wrt_cs_temp(_workingDataBase):
         (win_look_after + win_cs_template_after) * _workingDataBase["sample_rate"][0]
     )
     window_len_cs_temp = int(win_cs_template_after * _workingDataBase["sample_rate"][0])
-    _cs_index_slow = _workingDataBase["cs_index_slow"]
-    _cs_index_slow_int = np.where(_workingDataBase["cs_index_slow"])[0]
-    _workingDataBase["cs_index"] = np.zeros((_cs_index_slow.size), dtype=bool)
-    _cs_index = _workingDataBase["cs_index"]
-    _data_ss = _workingDataBase["ch_data_ss"]
-    _cs_temp = _workingDataBase["cs_wave_template"]
-    for counter_cs in range(_cs_index_slow_int.size):
-        _cs_slow_index = _cs_index_slow_int[counter_cs]
-        # if there is not enough data window before the potential CS, then skip it
-        if _cs_slow_index < window_len_before:
-            _cs_index_slow[_cs_slow_index] = False
-            continue
-        # if there is not enough data window after the potential CS, then skip it
-        if _cs_slow_index > (_data_ss.size - window_len_after):
-            _cs_index_slow[_cs_slow_index] = False
-            continue
-        search_win_inds = np.arange(
-            _cs_slow_index - window_len_before, _cs_slow_index + window_len_after, 1
-        )
-        ss_data_search_win = _data_ss[search_win_inds]
-        corr = np.correlate(ss_data_search_win, _cs_temp, "full")
-        cs_ind_search_win = np.argmax(corr) - window_len_cs_temp + 2
-        cs_ind = cs_ind_search_win + _cs_slow_index - window_len_before
-        _cs_index[cs_ind] = True
+    align_cs_wrt_template(
+        _workingDataBase,
+        _workingDataBase["cs_wave_template"],
+        window_len_before,
+        window_len_after,
+        window_len_cs_temp,
+    )
     return 0
 
 
@@ -306,26 +319,375 @@ def align_cs(_workingDataBase):
     return 0
 
 
+# the signals are only ever replaced, never edited in place, so their identity tells
+# whether they have changed without hashing the whole signal
+FINGERPRINT_BY_IDENTITY_KEYS = (
+    "ch_data",
+    "ch_time",
+    "ch_lfp",
+    "ch_data_ss",
+    "ch_data_cs",
+    "ss_wave",
+    "cs_wave",
+)
+
+
+class IdentityFingerprint:
+    """
+    -> fingerprint of a value by its identity, the value is held by a weak reference
+    -> two fingerprints are equal only if they refer to the same live object, so a new
+       object which happens to reuse the address of a freed one is still a change
+    """
+
+    def __init__(self, value):
+        self._ref = weakref.ref(value)
+        return None
+
+    def __eq__(self, other):
+        if not isinstance(other, IdentityFingerprint):
+            return False
+        value = self._ref()
+        return (value is not None) and (value is other._ref())
+
+
+def fingerprint_value(value, by_identity=False):
+    # a missing key, e.g. ch_lfp before any LFP is sideloaded, has the None fingerprint
+    if value is None:
+        return None
+    if isinstance(value, lib.ScaledSignal) and not (by_identity):
+        # the native samples and the scale, the signal is not decoded for it
+        return ("scaled", value.gain, value.offset, fingerprint_value(value.raw))
+    if by_identity:
+        # the rule is enforced, an array fingerprinted by identity can not be edited
+        # in place, it has to be replaced
+        if isinstance(value, np.ndarray):
+            value.flags.writeable = False
+        try:
+            return IdentityFingerprint(value)
+        except TypeError:
+            # the value does not support weak references, fall back to its content
+            pass
+    value = np.ascontiguousarray(value)
+    return (value.dtype.str, value.shape, hashlib.sha1(value).digest())
+
+
+class FilterCache:
+    """
+    -> keeps the filtered signals of the recently visited slots
+    -> entries are evicted in least-recently-used order once max_bytes is exceeded
+    -> the cached arrays are never handed out, callers always receive a copy
+    """
+
+    def __init__(self, max_bytes=512 * 1024 * 1024):
+        self.max_bytes = int(max_bytes)
+        self._cache = OrderedDict()
+        self._total_bytes = 0
+        return None
+
+    def get(self, key, index_slice=slice(None)):
+        if key not in self._cache:
+            return None
+        self._cache.move_to_end(key)
+        return self._cache[key][index_slice].copy()
+
+    def put(self, key, data, copy=True):
+        self.discard(key)
+        if data.nbytes > self.max_bytes:
+            return 0
+        self._cache[key] = data.copy() if copy else data
+        self._total_bytes += data.nbytes
+        while self._total_bytes > self.max_bytes:
+            _, data_evicted = self._cache.popitem(last=False)
+            self._total_bytes -= data_evicted.nbytes
+        return 0
+
+    def discard(self, key):
+        if key in self._cache:
+            self._total_bytes -= self._cache.pop(key).nbytes
+        return 0
+
+    def keys(self):
+        return list(self._cache.keys())
+
+    def clear(self):
+        self._cache.clear()
+        self._total_bytes = 0
+        return 0
+
+
+filter_cache = FilterCache()
+
+
+def bandpass_filter_cached(_workingDataBase, data_key, lo_cutoff_key, hi_cutoff_key):
+    data = _workingDataBase[data_key]
+    # the slot bounds alone can not tell two recordings apart, so the content of the
+    # raw signal is part of the key as well
+    key = (
+        data_key,
+        int(_workingDataBase["index_start_on_ch_data"][0]),
+        int(_workingDataBase["index_end_on_ch_data"][0]),
+        float(_workingDataBase["sample_rate"][0]),
+        float(_workingDataBase[lo_cutoff_key][0]),
+        float(_workingDataBase[hi_cutoff_key][0]),
+        fingerprint_value(data),
+    )
+    data_filtered = filter_cache.get(key)
+    if data_filtered is None:
+        # same filter as RecordingFilter, only without the samples around the slot
+        data_filtered = lib.bandpass_filter_chunked(
+            data,
+            sample_rate=_workingDataBase["sample_rate"][0],
+            lo_cutoff_freq=_workingDataBase[lo_cutoff_key][0],
+            hi_cutoff_freq=_workingDataBase[hi_cutoff_key][0],
+        )
+        filter_cache.put(key, data_filtered)
+    return data_filtered
+
+
+class RecordingFilter:
+    """
+    -> filters the whole recording once per cutoff pair and hands out slot slices
+    -> the recording is registered by reference, it is never copied here
+    -> a slot is only served if its raw signal matches the registered recording,
+       otherwise the caller falls back to filtering the slot on its own
+    -> the whole recording is filtered in a worker thread, until it is ready the
+       slot is filtered on its own range of the recording, with the same chunks and
+       padding, so a slot is filtered to the same values either way
+    -> the filtered recordings share the least-recently-used eviction of FilterCache,
+       those above lib.MEMMAP_MIN_NBYTES are written to a memory-mapped .npy in the
+       temp folder instead, at most max_memmap of them are kept
+    """
+
+    def __init__(self, max_bytes=2 * lib.MEMMAP_MIN_NBYTES, max_memmap=4):
+        self._filtered = FilterCache(max_bytes=max_bytes)
+        self._filtered_slot = FilterCache()
+        self._filtered_memmap = OrderedDict()
+        self.max_memmap = int(max_memmap)
+        self._memmap_dir = None
+        self._recording = {}
+        self._future_dict = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        return None
+
+    def set_recording(self, data_key, data, sample_rate):
+        recording = self._recording.get(data_key)
+        if (
+            (recording is not None)
+            and (recording[0] is data)
+            and (recording[1] == float(sample_rate))
+        ):
+            return 0
+        self._recording[data_key] = (data, float(sample_rate))
+        self.discard_recording(data_key)
+        return 0
+
+    def discard_recording(self, data_key):
+        # a filtering which has already started is not stopped but its result is dropped
+        with self._lock:
+            for key in list(self._future_dict.keys()):
+                if key[0] == data_key:
+                    self._future_dict.pop(key).cancel()
+            for key in self._filtered.keys():
+                if key[0] == data_key:
+                    self._filtered.discard(key)
+            for key in self._filtered_slot.keys():
+                if key[0] == data_key:
+                    self._filtered_slot.discard(key)
+            for key in list(self._filtered_memmap.keys()):
+                if key[0] == data_key:
+                    self.release_memmap(self._filtered_memmap.pop(key))
+        return 0
+
+    def get_memmap_dir(self):
+        if self._memmap_dir is None:
+            self._memmap_dir = tempfile.mkdtemp(prefix="psort_filter_")
+        return self._memmap_dir
+
+    def release_memmap(self, data_filtered):
+        # the slices handed out are copies, nothing else refers to the file
+        if isinstance(data_filtered, np.memmap):
+            try:
+                os.remove(data_filtered.filename)
+            except OSError:
+                pass
+        return 0
+
+    def filter_recording(self, key, data, sample_rate):
+        data_size = len(data)
+        out = None
+        if data_size * np.dtype(np.float64).itemsize >= lib.MEMMAP_MIN_NBYTES:
+            file_descriptor, memmap_fullPath = tempfile.mkstemp(
+                prefix=key[0] + "_", suffix=".npy", dir=self.get_memmap_dir()
+            )
+            os.close(file_descriptor)
+            out = np.lib.format.open_memmap(
+                memmap_fullPath, mode="w+", dtype=np.float64, shape=(data_size,)
+            )
+        data_filtered = lib.bandpass_filter_chunked(
+            data,
+            sample_rate=sample_rate,
+            lo_cutoff_freq=key[1],
+            hi_cutoff_freq=key[2],
+            out=out,
+        )
+        if out is not None:
+            data_filtered.flush()
+            del data_filtered, out
+            data_filtered = np.load(memmap_fullPath, mmap_mode="r")
+        return data_filtered
+
+    def filter_slot(self, key, data, sample_rate, index_start, index_end):
+        data_filtered = lib.bandpass_filter_chunked(
+            data,
+            sample_rate=sample_rate,
+            lo_cutoff_freq=key[1],
+            hi_cutoff_freq=key[2],
+            index_start=index_start,
+            index_end=index_end,
+        )
+        return data_filtered
+
+    def process_finished(self, key, future):
+        if future.cancelled():
+            return 0
+        with self._lock:
+            if self._future_dict.get(key) is not future:
+                if future.exception() is None:
+                    self.release_memmap(future.result())
+                return 0
+            del self._future_dict[key]
+            if future.exception() is not None:
+                print(
+                    "Error: <signals_lib.RecordingFilter: "
+                    + str(future.exception())
+                    + ">"
+                )
+                return 0
+            data_filtered = future.result()
+            if not isinstance(data_filtered, np.memmap):
+                self._filtered.put(key, data_filtered, copy=False)
+                return 0
+            self._filtered_memmap[key] = data_filtered
+            while len(self._filtered_memmap) > self.max_memmap:
+                _, data_evicted = self._filtered_memmap.popitem(last=False)
+                self.release_memmap(data_evicted)
+        return 0
+
+    def get_filtered_slot(self, key, index_start, index_end):
+        # must be called with the lock held
+        data_filtered = self._filtered.get(key, slice(index_start, index_end))
+        if (data_filtered is None) and (key in self._filtered_memmap):
+            self._filtered_memmap.move_to_end(key)
+            data_filtered = np.array(self._filtered_memmap[key][index_start:index_end])
+        if data_filtered is None:
+            data_filtered = self._filtered_slot.get((*key, index_start, index_end))
+        return data_filtered
+
+    def get_slot(self, _workingDataBase, data_key, lo_cutoff_key, hi_cutoff_key):
+        recording = self._recording.get(data_key)
+        if recording is None:
+            return None
+        data, sample_rate = recording
+        if sample_rate != float(_workingDataBase["sample_rate"][0]):
+            return None
+        index_start = int(_workingDataBase["index_start_on_ch_data"][0])
+        index_end = int(_workingDataBase["index_end_on_ch_data"][0])
+        data_slot = _workingDataBase.get(data_key)
+        if (data_slot is None) or (index_end > len(data)):
+            return None
+        if isinstance(data, lib.ScaledSignal) and isinstance(
+            data_slot, lib.ScaledSignal
+        ):
+            # the native samples are compared, neither of them is decoded
+            isSameSlot = (data.gain == data_slot.gain) and (
+                data.offset == data_slot.offset
+            )
+            isSameSlot = isSameSlot and np.array_equal(
+                data.raw[index_start:index_end], data_slot.raw
+            )
+        else:
+            isSameSlot = np.array_equal(data[index_start:index_end], data_slot)
+        if not (isSameSlot):
+            return None
+        key = (
+            data_key,
+            float(_workingDataBase[lo_cutoff_key][0]),
+            float(_workingDataBase[hi_cutoff_key][0]),
+        )
+        future = None
+        with self._lock:
+            data_filtered = self.get_filtered_slot(key, index_start, index_end)
+            if (data_filtered is None) and (key not in self._future_dict):
+                future = self._executor.submit(
+                    self.filter_recording, key, data, sample_rate
+                )
+                self._future_dict[key] = future
+        # the callback takes the lock, it runs in the worker thread or right here if
+        # the filtering has already finished
+        if future is not None:
+            future.add_done_callback(
+                lambda _future: self.process_finished(key, _future)
+            )
+        if data_filtered is None:
+            data_filtered = self.filter_slot(
+                key, data, sample_rate, index_start, index_end
+            )
+            with self._lock:
+                self._filtered_slot.put((*key, index_start, index_end), data_filtered)
+        return data_filtered
+
+    def clear(self):
+        with self._lock:
+            for future in self._future_dict.values():
+                future.cancel()
+            self._future_dict.clear()
+            self._filtered.clear()
+            self._filtered_slot.clear()
+            self._filtered_memmap.clear()
+            if self._memmap_dir is not None:
+                shutil.rmtree(self._memmap_dir, ignore_errors=True)
+                self._memmap_dir = None
+        self._recording.clear()
+        return 0
+
+
+recording_filter = RecordingFilter()
+atexit.register(recording_filter.clear)
+
+
+def filter_recording_or_slot(_workingDataBase, data_key, lo_cutoff_key, hi_cutoff_key):
+    data_filtered = recording_filter.get_slot(
+        _workingDataBase, data_key, lo_cutoff_key, hi_cutoff_key
+    )
+    if data_filtered is None:
+        data_filtered = bandpass_filter_cached(
+            _workingDataBase, data_key, lo_cutoff_key, hi_cutoff_key
+        )
+    return data_filtered
+
+
 def filter_data(_workingDataBase):
-    _workingDataBase["ch_data_ss"] = lib.bandpass_filter(
-        _workingDataBase["ch_data"],
-        sample_rate=_workingDataBase["sample_rate"][0],
-        lo_cutoff_freq=_workingDataBase["ss_min_cutoff_freq"][0],
-        hi_cutoff_freq=_workingDataBase["ss_max_cutoff_freq"][0],
+    filter_ss_data(_workingDataBase)
+    filter_cs_data(_workingDataBase)
+    return 0
+
+
+def filter_ss_data(_workingDataBase):
+    _workingDataBase["ch_data_ss"] = filter_recording_or_slot(
+        _workingDataBase, "ch_data", "ss_min_cutoff_freq", "ss_max_cutoff_freq"
     )
+    return 0
+
+
+def filter_cs_data(_workingDataBase):
     if _workingDataBase["isLfpSideloaded"][0]:
-        _workingDataBase["ch_data_cs"] = lib.bandpass_filter(
-            _workingDataBase["ch_lfp"],
-            sample_rate=_workingDataBase["sample_rate"][0],
-            lo_cutoff_freq=_workingDataBase["cs_min_cutoff_freq"][0],
-            hi_cutoff_freq=_workingDataBase["cs_max_cutoff_freq"][0],
+        _workingDataBase["ch_data_cs"] = filter_recording_or_slot(
+            _workingDataBase, "ch_lfp", "cs_min_cutoff_freq", "cs_max_cutoff_freq"
         )
     else:
-        _workingDataBase["ch_data_cs"] = lib.bandpass_filter(
-            _workingDataBase["ch_data"],
-            sample_rate=_workingDataBase["sample_rate"][0],
-            lo_cutoff_freq=_workingDataBase["cs_min_cutoff_freq"][0],
-            hi_cutoff_freq=_workingDataBase["cs_max_cutoff_freq"][0],
+        _workingDataBase["ch_data_cs"] = filter_recording_or_slot(
+            _workingDataBase, "ch_data", "cs_min_cutoff_freq", "cs_max_cutoff_freq"
         )
     return 0
 
@@ -502,12 +864,13 @@ def extract_ss_xprob(_workingDataBase):
             _workingDataBase["ss_xprob"],
             _workingDataBase["ss_xprob_span"],
         ) = lib.cross_probability(
-            _workingDataBase["ss_index"],
-            _workingDataBase["ss_index"],
+            lib.index_bool_to_int(_workingDataBase["ss_index"]),
+            lib.index_bool_to_int(_workingDataBase["ss_index"]),
             sample_rate=_workingDataBase["sample_rate"][0],
             bin_size=_workingDataBase["GLOBAL_XPROB_SS_BINSIZE"][0],
             win_len_before=_workingDataBase["GLOBAL_XPROB_SS_BEFORE"][0],
             win_len_after=_workingDataBase["GLOBAL_XPROB_SS_AFTER"][0],
+            data_size=_workingDataBase["ss_index"].size,
         )
         _win_len_before_int = np.round(
             float(_workingDataBase["GLOBAL_XPROB_SS_BEFORE"][0])
@@ -526,12 +889,13 @@ def extract_cs_xprob(_workingDataBase):
             _workingDataBase["cs_xprob"],
             _workingDataBase["cs_xprob_span"],
         ) = lib.cross_probability(
-            _workingDataBase["cs_index"],
-            _workingDataBase["ss_index"],
+            lib.index_bool_to_int(_workingDataBase["cs_index"]),
+            lib.index_bool_to_int(_workingDataBase["ss_index"]),
             sample_rate=_workingDataBase["sample_rate"][0],
             bin_size=_workingDataBase["GLOBAL_XPROB_CS_BINSIZE"][0],
             win_len_before=_workingDataBase["GLOBAL_XPROB_CS_BEFORE"][0],
             win_len_after=_workingDataBase["GLOBAL_XPROB_CS_AFTER"][0],
+            data_size=_workingDataBase["cs_index"].size,
         )
     else:
         _workingDataBase["cs_xprob"] = np.zeros((0), dtype=np.float32)
@@ -539,6 +903,90 @@ def extract_cs_xprob(_workingDataBase):
     return 0
 
 
+def get_pca_window(_workingDataBase, spike_type):
+    """
+    -> the columns of {spike_type}_wave within the PCA bounds, as (minPca, maxPca)
+    -> the window is at least 4 samples wide
+    """
+    _minPca = int(
+        (
+            _workingDataBase[spike_type + "_pca_bound_min"][0]
+            + _workingDataBase["GLOBAL_WAVE_PLOT_" + spike_type.upper() + "_BEFORE"][0]
+        )
+        * _workingDataBase["sample_rate"][0]
+    )
+    _maxPca = int(
+        (
+            _workingDataBase[spike_type + "_pca_bound_max"][0]
+            + _workingDataBase["GLOBAL_WAVE_PLOT_" + spike_type.upper() + "_BEFORE"][0]
+        )
+        * _workingDataBase["sample_rate"][0]
+    )
+    if (_maxPca - _minPca) < 4:
+        _maxPca += 2
+        _minPca -= 2
+    return _minPca, _maxPca
+
+
+def get_umap_args(_workingDataBase, spike_type):
+    """
+    -> the arguments of lib.umap for the spikes of spike_type
+    -> the model is kept per slot and spike type, the spikes are identified by
+       their index within the slot
+    """
+    _minPca, _maxPca = get_pca_window(_workingDataBase, spike_type)
+    umap_args = {
+        "waveform": _workingDataBase[spike_type + "_wave"][:, _minPca : (_maxPca + 1)],
+        "key": (int(_workingDataBase["current_slot_num"][0]), spike_type),
+        "spike_id": np.flatnonzero(_workingDataBase[spike_type + "_index"]),
+        "window": (_minPca, _maxPca),
+        "landmark_num": int(_workingDataBase["GLOBAL_UMAP_LANDMARK_NUM"][0]),
+    }
+    return umap_args
+
+
+def extract_umap(_workingDataBase, spike_type):
+    """
+    -> the default n_neighbors for UMAP algorithm is 15 and based on that we will not use
+       UMAP when we have few datapoints. This will prevent the divergence of UMAP
+       and program crashing due to that.
+    -> with flag_umap_async the embedding is only taken from the fitted model if it
+       needs no computation, otherwise pca1 and pca2 stand in for umap1 and umap2 and
+       {spike_type}_umap_isPending is set for the GUI to compute it with lib.UmapRunner
+    """
+    num_spikes = _workingDataBase[spike_type + "_index"].sum()
+    _workingDataBase[spike_type + "_umap_isPending"][0] = False
+    if not _workingDataBase["umap_enable"][0]:
+        _workingDataBase[spike_type + "_umap1"] = np.zeros(
+            (num_spikes), dtype=np.float32
+        )
+        _workingDataBase[spike_type + "_umap2"] = np.zeros(
+            (num_spikes), dtype=np.float32
+        )
+        return 0
+    if num_spikes <= 15:
+        _workingDataBase[spike_type + "_umap1"] = np.random.rand(num_spikes)
+        _workingDataBase[spike_type + "_umap2"] = np.random.rand(num_spikes)
+        return 0
+    umap_args = get_umap_args(_workingDataBase, spike_type)
+    if _workingDataBase["flag_umap_async"][0]:
+        embedding_ = lib.umap_model_manager.get_cached_embedding(**umap_args)
+        if embedding_ is None:
+            _workingDataBase[spike_type + "_umap_isPending"][0] = True
+            _workingDataBase[spike_type + "_umap1"] = deepcopy(
+                _workingDataBase[spike_type + "_pca1"]
+            )
+            _workingDataBase[spike_type + "_umap2"] = deepcopy(
+                _workingDataBase[spike_type + "_pca2"]
+            )
+            return 0
+    else:
+        embedding_ = lib.umap(**umap_args)
+    _workingDataBase[spike_type + "_umap1"] = deepcopy(embedding_[:, 0])
+    _workingDataBase[spike_type + "_umap2"] = deepcopy(embedding_[:, 1])
+    return 0
+
+
 def extract_ss_pca(_workingDataBase):
     """
     -> check the minPca and maxPca and make sure they are less than 1s
@@ -555,23 +1003,7 @@ def extract_ss_pca(_workingDataBase):
             "GLOBAL_WAVE_TEMPLATE_SS_AFTER"
         ][0]
 
-    _minPca = int(
-        (
-            _workingDataBase["ss_pca_bound_min"][0]
-            + _workingDataBase["GLOBAL_WAVE_PLOT_SS_BEFORE"][0]
-        )
-        * _workingDataBase["sample_rate"][0]
-    )
-    _maxPca = int(
-        (
-            _workingDataBase["ss_pca_bound_max"][0]
-            + _workingDataBase["GLOBAL_WAVE_PLOT_SS_BEFORE"][0]
-        )
-        * _workingDataBase["sample_rate"][0]
-    )
-    if (_maxPca - _minPca) < 4:
-        _maxPca += 2
-        _minPca -= 2
+    _minPca, _maxPca = get_pca_window(_workingDataBase, "ss")
     if _workingDataBase["ss_index"].sum() > 1:
         ss_pca_mat_, ss_pca_variance_ = lib.extract_pca(
             _workingDataBase["ss_wave"][:, _minPca : (_maxPca + 1)].T
@@ -584,30 +1016,7 @@ def extract_ss_pca(_workingDataBase):
         else:
             _workingDataBase["ss_pca3"] = deepcopy(ss_pca_mat_[2, :])
         _workingDataBase["ss_pca_variance"] = deepcopy(ss_pca_variance_[0:3])
-        if _workingDataBase["umap_enable"][0]:
-            """the default n_neighbors for UMAP algorithm is 15 and based on that we will not use
-            UMAP when we have few datapoints. This will prevent the divergence of UMAP
-            and program crashing due to that."""
-            if _workingDataBase["ss_index"].sum() > 15:
-                ss_embedding_ = lib.umap(
-                    _workingDataBase["ss_wave"][:, _minPca : (_maxPca + 1)]
-                )
-                _workingDataBase["ss_umap1"] = deepcopy(ss_embedding_[:, 0])
-                _workingDataBase["ss_umap2"] = deepcopy(ss_embedding_[:, 1])
-            else:
-                _workingDataBase["ss_umap1"] = np.random.rand(
-                    _workingDataBase["ss_index"].sum()
-                )
-                _workingDataBase["ss_umap2"] = np.random.rand(
-                    _workingDataBase["ss_index"].sum()
-                )
-        else:
-            _workingDataBase["ss_umap1"] = np.zeros(
-                (ss_pca_mat_.shape[1]), dtype=np.float32
-            )
-            _workingDataBase["ss_umap2"] = np.zeros(
-                (ss_pca_mat_.shape[1]), dtype=np.float32
-            )
+        extract_umap(_workingDataBase, "ss")
     else:
         _workingDataBase["ss_pca1"] = np.zeros((0), dtype=np.float32)
         _workingDataBase["ss_pca2"] = np.zeros((0), dtype=np.float32)
@@ -615,6 +1024,7 @@ def extract_ss_pca(_workingDataBase):
         _workingDataBase["ss_pca_variance"] = np.zeros((3), dtype=np.float32)
         _workingDataBase["ss_umap1"] = np.zeros((0), dtype=np.float32)
         _workingDataBase["ss_umap2"] = np.zeros((0), dtype=np.float32)
+        _workingDataBase["ss_umap_isPending"][0] = False
     return 0
 
 
@@ -634,23 +1044,7 @@ def extract_cs_pca(_workingDataBase):
             "GLOBAL_WAVE_TEMPLATE_CS_AFTER"
         ][0]
 
-    _minPca = int(
-        (
-            _workingDataBase["cs_pca_bound_min"][0]
-            + _workingDataBase["GLOBAL_WAVE_PLOT_CS_BEFORE"][0]
-        )
-        * _workingDataBase["sample_rate"][0]
-    )
-    _maxPca = int(
-        (
-            _workingDataBase["cs_pca_bound_max"][0]
-            + _workingDataBase["GLOBAL_WAVE_PLOT_CS_BEFORE"][0]
-        )
-        * _workingDataBase["sample_rate"][0]
-    )
-    if (_maxPca - _minPca) < 4:
-        _maxPca += 2
-        _minPca -= 2
+    _minPca, _maxPca = get_pca_window(_workingDataBase, "cs")
     if _workingDataBase["cs_index"].sum() > 1:
         cs_pca_mat_, cs_pca_variance_ = lib.extract_pca(
             _workingDataBase["cs_wave"][:, _minPca : (_maxPca + 1)].T
@@ -663,30 +1057,7 @@ def extract_cs_pca(_workingDataBase):
         else:
             _workingDataBase["cs_pca3"] = deepcopy(cs_pca_mat_[2, :])
         _workingDataBase["cs_pca_variance"] = deepcopy(cs_pca_variance_[0:3])
-        if _workingDataBase["umap_enable"][0]:
-            """the default n_neighbors for UMAP algorithm is 15 and based on that we will not use
-            UMAP when we have few datapoints. This will prevent the divergence of UMAP
-            and program crashing due to that."""
-            if _workingDataBase["cs_index"].sum() > 15:
-                cs_embedding_ = lib.umap(
-                    _workingDataBase["cs_wave"][:, _minPca : (_maxPca + 1)]
-                )
-                _workingDataBase["cs_umap1"] = deepcopy(cs_embedding_[:, 0])
-                _workingDataBase["cs_umap2"] = deepcopy(cs_embedding_[:, 1])
-            else:
-                _workingDataBase["cs_umap1"] = np.random.rand(
-                    _workingDataBase["cs_index"].sum()
-                )
-                _workingDataBase["cs_umap2"] = np.random.rand(
-                    _workingDataBase["cs_index"].sum()
-                )
-        else:
-            _workingDataBase["cs_umap1"] = np.zeros(
-                (cs_pca_mat_.shape[1]), dtype=np.float32
-            )
-            _workingDataBase["cs_umap2"] = np.zeros(
-                (cs_pca_mat_.shape[1]), dtype=np.float32
-            )
+        extract_umap(_workingDataBase, "cs")
     else:
         _workingDataBase["cs_pca1"] = np.zeros((0), dtype=np.float32)
         _workingDataBase["cs_pca2"] = np.zeros((0), dtype=np.float32)
@@ -694,6 +1065,7 @@ def extract_cs_pca(_workingDataBase):
         _workingDataBase["cs_pca_variance"] = np.zeros((3), dtype=np.float32)
         _workingDataBase["cs_umap1"] = np.zeros((0), dtype=np.float32)
         _workingDataBase["cs_umap2"] = np.zeros((0), dtype=np.float32)
+        _workingDataBase["cs_umap_isPending"][0] = False
     return 0
 
 
@@ -827,45 +1199,29 @@ def extract_ss_similarity(_workingDataBase):
         ss_wave = _workingDataBase["ss_wave"][:, _window_ss_ss]
         if _workingDataBase["ss_wave_template"].size > 1:
             ss_wave_template = _workingDataBase["ss_wave_template"][0:_min_range_ss_ss]
-            _workingDataBase["ss_similarity_to_ss"] = np.array(
-                [
-                    np.corrcoef(ss_wave[counter, :], ss_wave_template)[0, 1]
-                    for counter in range(ss_wave.shape[0])
-                ],
-                dtype=np.float32,
+            _workingDataBase["ss_similarity_to_ss"] = lib.pearson_correlation(
+                ss_wave, ss_wave_template, dtype=np.float32
             )
         else:
             ss_wave_template = np.mean(
                 _workingDataBase["ss_wave"][:, _window_ss_ss], axis=0
             )
-            _workingDataBase["ss_similarity_to_ss"] = np.array(
-                [
-                    np.corrcoef(ss_wave[counter, :], ss_wave_template)[0, 1]
-                    for counter in range(ss_wave.shape[0])
-                ],
-                dtype=np.float32,
+            _workingDataBase["ss_similarity_to_ss"] = lib.pearson_correlation(
+                ss_wave, ss_wave_template, dtype=np.float32
             )
         # extract_ss_similarity to cs
         ss_wave = _workingDataBase["ss_wave"][:, _window_ss_cs]
         if _workingDataBase["cs_wave_template"].size > 1:
             cs_wave_template = _workingDataBase["cs_wave_template"][0:_min_range_len]
-            _workingDataBase["ss_similarity_to_cs"] = np.array(
-                [
-                    np.corrcoef(ss_wave[counter, :], cs_wave_template)[0, 1]
-                    for counter in range(ss_wave.shape[0])
-                ],
-                dtype=np.float32,
+            _workingDataBase["ss_similarity_to_cs"] = lib.pearson_correlation(
+                ss_wave, cs_wave_template, dtype=np.float32
             )
         elif _workingDataBase["cs_index"].sum() > 1:
             cs_wave_template = np.mean(
                 _workingDataBase["cs_wave"][:, _window_cs_cs], axis=0
             )
-            _workingDataBase["ss_similarity_to_cs"] = np.array(
-                [
-                    np.corrcoef(ss_wave[counter, :], cs_wave_template)[0, 1]
-                    for counter in range(ss_wave.shape[0])
-                ],
-                dtype=np.float32,
+            _workingDataBase["ss_similarity_to_cs"] = lib.pearson_correlation(
+                ss_wave, cs_wave_template, dtype=np.float32
             )
         else:
             _workingDataBase["ss_similarity_to_cs"] = np.zeros(
@@ -945,45 +1301,29 @@ def extract_cs_similarity(_workingDataBase):
         cs_wave = _workingDataBase["cs_wave"][:, _window_cs_cs]
         if _workingDataBase["cs_wave_template"].size > 1:
             cs_wave_template = _workingDataBase["cs_wave_template"][0:_min_range_cs_cs]
-            _workingDataBase["cs_similarity_to_cs"] = np.array(
-                [
-                    np.corrcoef(cs_wave[counter, :], cs_wave_template)[0, 1]
-                    for counter in range(cs_wave.shape[0])
-                ],
-                dtype=np.float32,
+            _workingDataBase["cs_similarity_to_cs"] = lib.pearson_correlation(
+                cs_wave, cs_wave_template, dtype=np.float32
             )
         else:
             cs_wave_template = np.mean(
                 _workingDataBase["cs_wave"][:, _window_cs_cs], axis=0
             )
-            _workingDataBase["cs_similarity_to_cs"] = np.array(
-                [
-                    np.corrcoef(cs_wave[counter, :], cs_wave_template)[0, 1]
-                    for counter in range(cs_wave.shape[0])
-                ],
-                dtype=np.float32,
+            _workingDataBase["cs_similarity_to_cs"] = lib.pearson_correlation(
+                cs_wave, cs_wave_template, dtype=np.float32
             )
         # extract_cs_similarity to ss
         cs_wave = _workingDataBase["cs_wave"][:, _window_cs_ss]
         if _workingDataBase["ss_wave_template"].size > 1:
             ss_wave_template = _workingDataBase["ss_wave_template"][0:_min_range_len]
-            _workingDataBase["cs_similarity_to_ss"] = np.array(
-                [
-                    np.corrcoef(cs_wave[counter, :], ss_wave_template)[0, 1]
-                    for counter in range(cs_wave.shape[0])
-                ],
-                dtype=np.float32,
+            _workingDataBase["cs_similarity_to_ss"] = lib.pearson_correlation(
+                cs_wave, ss_wave_template, dtype=np.float32
             )
         elif _workingDataBase["ss_index"].sum() > 1:
             ss_wave_template = np.mean(
                 _workingDataBase["ss_wave"][:, _window_ss_ss], axis=0
             )
-            _workingDataBase["cs_similarity_to_ss"] = np.array(
-                [
-                    np.corrcoef(cs_wave[counter, :], ss_wave_template)[0, 1]
-                    for counter in range(cs_wave.shape[0])
-                ],
-                dtype=np.float32,
+            _workingDataBase["cs_similarity_to_ss"] = lib.pearson_correlation(
+                cs_wave, ss_wave_template, dtype=np.float32
             )
         else:
             _workingDataBase["cs_similarity_to_ss"] = np.zeros(
@@ -998,37 +1338,25 @@ def extract_cs_similarity(_workingDataBase):
 def extract_ss_time(_workingDataBase):
     if _workingDataBase["ss_index"].sum() > 1:
         scale_factor = float(_workingDataBase["sample_rate"][0]) / 1000.0
-        _workingDataBase["ss_time"] = _workingDataBase["ch_time"][
-            _workingDataBase["ss_index"]
-        ]
+        ss_index_int = lib.index_bool_to_int(_workingDataBase["ss_index"])
+        cs_index_int = lib.index_bool_to_int(_workingDataBase["cs_index"])
+        _workingDataBase["ss_time"] = _workingDataBase["ch_time"][ss_index_int]
 
-        ss_time_to_prev_ss = lib.distance_from_prev_element(
-            _workingDataBase["ss_index"], _workingDataBase["ss_index"]
-        )
         _workingDataBase["ss_time_to_prev_ss"] = (
-            ss_time_to_prev_ss[_workingDataBase["ss_index"]] / scale_factor
+            lib.distance_from_prev_index(ss_index_int, ss_index_int) / scale_factor
         )
 
-        ss_time_to_next_ss = lib.distance_to_next_element(
-            _workingDataBase["ss_index"], _workingDataBase["ss_index"]
-        )
         _workingDataBase["ss_time_to_next_ss"] = (
-            ss_time_to_next_ss[_workingDataBase["ss_index"]] / scale_factor
+            lib.distance_to_next_index(ss_index_int, ss_index_int) / scale_factor
         )
 
         if _workingDataBase["cs_index"].sum() > 1:
-            ss_time_to_prev_cs = lib.distance_from_prev_element(
-                _workingDataBase["ss_index"], _workingDataBase["cs_index"]
-            )
             _workingDataBase["ss_time_to_prev_cs"] = (
-                ss_time_to_prev_cs[_workingDataBase["ss_index"]] / scale_factor
+                lib.distance_from_prev_index(ss_index_int, cs_index_int) / scale_factor
             )
 
-            ss_time_to_next_cs = lib.distance_to_next_element(
-                _workingDataBase["ss_index"], _workingDataBase["cs_index"]
-            )
             _workingDataBase["ss_time_to_next_cs"] = (
-                ss_time_to_next_cs[_workingDataBase["ss_index"]] / scale_factor
+                lib.distance_to_next_index(ss_index_int, cs_index_int) / scale_factor
             )
         else:
             _workingDataBase["ss_time_to_prev_cs"] = np.zeros(
@@ -1049,37 +1377,25 @@ def extract_ss_time(_workingDataBase):
 def extract_cs_time(_workingDataBase):
     if _workingDataBase["cs_index"].sum() > 1:
         scale_factor = float(_workingDataBase["sample_rate"][0]) / 1000.0
-        _workingDataBase["cs_time"] = _workingDataBase["ch_time"][
-            _workingDataBase["cs_index"]
-        ]
+        cs_index_int = lib.index_bool_to_int(_workingDataBase["cs_index"])
+        ss_index_int = lib.index_bool_to_int(_workingDataBase["ss_index"])
+        _workingDataBase["cs_time"] = _workingDataBase["ch_time"][cs_index_int]
 
-        cs_time_to_prev_cs = lib.distance_from_prev_element(
-            _workingDataBase["cs_index"], _workingDataBase["cs_index"]
-        )
         _workingDataBase["cs_time_to_prev_cs"] = (
-            cs_time_to_prev_cs[_workingDataBase["cs_index"]] / scale_factor
+            lib.distance_from_prev_index(cs_index_int, cs_index_int) / scale_factor
         )
 
-        cs_time_to_next_cs = lib.distance_to_next_element(
-            _workingDataBase["cs_index"], _workingDataBase["cs_index"]
-        )
         _workingDataBase["cs_time_to_next_cs"] = (
-            cs_time_to_next_cs[_workingDataBase["cs_index"]] / scale_factor
+            lib.distance_to_next_index(cs_index_int, cs_index_int) / scale_factor
         )
 
         if _workingDataBase["ss_index"].sum() > 1:
-            cs_time_to_prev_ss = lib.distance_from_prev_element(
-                _workingDataBase["cs_index"], _workingDataBase["ss_index"]
-            )
             _workingDataBase["cs_time_to_prev_ss"] = (
-                cs_time_to_prev_ss[_workingDataBase["cs_index"]] / scale_factor
+                lib.distance_from_prev_index(cs_index_int, ss_index_int) / scale_factor
             )
 
-            cs_time_to_next_ss = lib.distance_to_next_element(
-                _workingDataBase["cs_index"], _workingDataBase["ss_index"]
-            )
             _workingDataBase["cs_time_to_next_ss"] = (
-                cs_time_to_next_ss[_workingDataBase["cs_index"]] / scale_factor
+                lib.distance_to_next_index(cs_index_int, ss_index_int) / scale_factor
             )
         else:
             _workingDataBase["cs_time_to_prev_ss"] = np.zeros(
@@ -1337,3 +1653,490 @@ def extract_cs_scatter(_workingDataBase):
         _workingDataBase["cs_pca1_index"][0] = 0
         # cs_pca2_index
         _workingDataBase["cs_pca2_index"][0] = 1
+
+
+# REFRESH GRAPH
+# Each stage of refresh_workingDataBase declares the _workingDataBase keys it reads and
+# writes. A stage is re-run only if one of the keys it reads has been changed since its
+# last run, either by an upstream stage or by any other part of the GUI.
+_GLOBAL_CONFLICT_KEYS = (
+    "GLOBAL_CONFLICT_CS_SS_BEFORE",
+    "GLOBAL_CONFLICT_CS_SS_AFTER",
+    "GLOBAL_CONFLICT_SS_SS_AROUND",
+    "GLOBAL_CONFLICT_CS_CS_AROUND",
+    "GLOBAL_CONFLICT_CS_CSSLOW_AROUND",
+    "GLOBAL_CONFLICT_CSSLOW_CSSLOW_AROUND",
+    "GLOBAL_CS_ALIGN_SSINDEX_BEFORE",
+    "GLOBAL_CS_ALIGN_SSTEMPLATE_BEFORE",
+    "GLOBAL_CS_ALIGN_SSTEMPLATE_AFTER",
+    "GLOBAL_CS_ALIGN_CSTEMPLATE_BEFORE",
+    "GLOBAL_CS_ALIGN_CSTEMPLATE_AFTER",
+)
+_GLOBAL_WAVE_KEYS = (
+    "GLOBAL_WAVE_PLOT_SS_BEFORE",
+    "GLOBAL_WAVE_PLOT_SS_AFTER",
+    "GLOBAL_WAVE_PLOT_CS_BEFORE",
+    "GLOBAL_WAVE_PLOT_CS_AFTER",
+    "GLOBAL_WAVE_TEMPLATE_SS_BEFORE",
+    "GLOBAL_WAVE_TEMPLATE_SS_AFTER",
+    "GLOBAL_WAVE_TEMPLATE_CS_BEFORE",
+    "GLOBAL_WAVE_TEMPLATE_CS_AFTER",
+)
+
+
+def detect_index(_workingDataBase):
+    detect_ss_index(_workingDataBase)
+    detect_cs_index_slow(_workingDataBase)
+    align_cs(_workingDataBase)
+    return 0
+
+
+refresh_stages = [
+    # ch_data_ss and ch_data_cs are fingerprinted by identity, so the two bands are
+    # separate stages and a change of one band leaves the other one untouched
+    {
+        "name": "filter_ss_data",
+        "function": filter_ss_data,
+        "read": (
+            "ch_data",
+            "sample_rate",
+            "ss_min_cutoff_freq",
+            "ss_max_cutoff_freq",
+        ),
+        "write": ("ch_data_ss",),
+    },
+    {
+        "name": "filter_cs_data",
+        "function": filter_cs_data,
+        "read": (
+            "ch_data",
+            "ch_lfp",
+            "isLfpSideloaded",
+            "sample_rate",
+            "cs_min_cutoff_freq",
+            "cs_max_cutoff_freq",
+        ),
+        "write": ("ch_data_cs",),
+    },
+    {
+        # align_cs edits the ss_index of detect_ss_index in place, so the detection and
+        # the alignment of the spikes can not be separated into independent stages
+        "name": "detect_index",
+        "function": detect_index,
+        "read": (
+            "ch_data_ss",
+            "ch_data_cs",
+            "sample_rate",
+            "ss_threshold",
+            "cs_threshold",
+            "ssPeak_mode",
+            "csPeak_mode",
+            "csAlign_mode",
+            "ss_wave_template",
+            "cs_wave_template",
+        )
+        + _GLOBAL_CONFLICT_KEYS
+        + _GLOBAL_WAVE_KEYS,
+        "write": ("ss_index", "cs_index_slow", "cs_index"),
+    },
+    {
+        "name": "extract_ss_peak",
+        "function": extract_ss_peak,
+        "read": ("ch_data_ss", "ss_index"),
+        "write": ("ss_peak",),
+    },
+    {
+        "name": "extract_cs_peak",
+        "function": extract_cs_peak,
+        "read": ("ch_data_cs", "cs_index_slow"),
+        "write": ("cs_peak",),
+    },
+    {
+        "name": "extract_ss_waveform",
+        "function": extract_ss_waveform,
+        "read": (
+            "ch_data_ss",
+            "ss_index",
+            "sample_rate",
+            "GLOBAL_WAVE_PLOT_SS_BEFORE",
+            "GLOBAL_WAVE_PLOT_SS_AFTER",
+        ),
+        "write": ("ss_wave", "ss_wave_span"),
+    },
+    {
+        "name": "extract_cs_waveform",
+        "function": extract_cs_waveform,
+        "read": (
+            "ch_data_ss",
+            "cs_index",
+            "sample_rate",
+            "GLOBAL_WAVE_PLOT_CS_BEFORE",
+            "GLOBAL_WAVE_PLOT_CS_AFTER",
+        ),
+        "write": ("cs_wave", "cs_wave_span"),
+    },
+    {
+        "name": "extract_ss_similarity",
+        "function": extract_ss_similarity,
+        "read": (
+            "ss_index",
+            "cs_index",
+            "ss_wave",
+            "cs_wave",
+            "ss_wave_template",
+            "cs_wave_template",
+            "sample_rate",
+        )
+        + _GLOBAL_WAVE_KEYS,
+        "write": ("ss_similarity_to_ss", "ss_similarity_to_cs"),
+    },
+    {
+        "name": "extract_cs_similarity",
+        "function": extract_cs_similarity,
+        "read": (
+            "ss_index",
+            "cs_index",
+            "ss_wave",
+            "cs_wave",
+            "ss_wave_template",
+            "cs_wave_template",
+            "sample_rate",
+        )
+        + _GLOBAL_WAVE_KEYS,
+        "write": ("cs_similarity_to_cs", "cs_similarity_to_ss"),
+    },
+    {
+        "name": "extract_ss_ifr",
+        "function": extract_ss_ifr,
+        "read": (
+            "ss_index",
+            "ch_data",
+            "sample_rate",
+            "GLOBAL_IFR_PLOT_SS_MIN",
+            "GLOBAL_IFR_PLOT_SS_MAX",
+            "GLOBAL_IFR_PLOT_SS_BINNUM",
+        ),
+        "write": ("ss_ifr", "ss_ifr_mean", "ss_ifr_bins", "ss_ifr_hist"),
+    },
+    {
+        "name": "extract_cs_ifr",
+        "function": extract_cs_ifr,
+        "read": (
+            "cs_index",
+            "ch_data",
+            "sample_rate",
+            "GLOBAL_IFR_PLOT_CS_MIN",
+            "GLOBAL_IFR_PLOT_CS_MAX",
+            "GLOBAL_IFR_PLOT_CS_BINNUM",
+        ),
+        "write": ("cs_ifr", "cs_ifr_mean", "cs_ifr_bins", "cs_ifr_hist"),
+    },
+    {
+        "name": "extract_ss_time",
+        "function": extract_ss_time,
+        "read": ("ss_index", "cs_index", "ch_time", "sample_rate"),
+        "write": (
+            "ss_time",
+            "ss_time_to_prev_ss",
+            "ss_time_to_next_ss",
+            "ss_time_to_prev_cs",
+            "ss_time_to_next_cs",
+        ),
+    },
+    {
+        "name": "extract_cs_time",
+        "function": extract_cs_time,
+        "read": ("ss_index", "cs_index", "ch_time", "sample_rate"),
+        "write": (
+            "cs_time",
+            "cs_time_to_prev_cs",
+            "cs_time_to_next_cs",
+            "cs_time_to_prev_ss",
+            "cs_time_to_next_ss",
+        ),
+    },
+    {
+        "name": "extract_ss_xprob",
+        "function": extract_ss_xprob,
+        "read": (
+            "ss_index",
+            "sample_rate",
+            "GLOBAL_XPROB_SS_BEFORE",
+            "GLOBAL_XPROB_SS_AFTER",
+            "GLOBAL_XPROB_SS_BINSIZE",
+        ),
+        "write": ("ss_xprob", "ss_xprob_span"),
+    },
+    {
+        "name": "extract_cs_xprob",
+        "function": extract_cs_xprob,
+        "read": (
+            "ss_index",
+            "cs_index",
+            "sample_rate",
+            "GLOBAL_XPROB_CS_BEFORE",
+            "GLOBAL_XPROB_CS_AFTER",
+            "GLOBAL_XPROB_CS_BINSIZE",
+        ),
+        "write": ("cs_xprob", "cs_xprob_span"),
+    },
+    {
+        "name": "extract_ss_pca",
+        "function": extract_ss_pca,
+        "read": (
+            "ss_index",
+            "ss_wave",
+            "ss_pca_bound_min",
+            "ss_pca_bound_max",
+            "umap_enable",
+            "sample_rate",
+            "current_slot_num",
+            "flag_umap_async",
+            "GLOBAL_UMAP_LANDMARK_NUM",
+        )
+        + _GLOBAL_WAVE_KEYS,
+        "write": (
+            "ss_pca_bound_min",
+            "ss_pca_bound_max",
+            "ss_pca1",
+            "ss_pca2",
+            "ss_pca3",
+            "ss_pca_variance",
+            "ss_umap1",
+            "ss_umap2",
+            "ss_umap_isPending",
+        ),
+    },
+    {
+        "name": "extract_cs_pca",
+        "function": extract_cs_pca,
+        "read": (
+            "cs_index",
+            "cs_wave",
+            "cs_pca_bound_min",
+            "cs_pca_bound_max",
+            "umap_enable",
+            "sample_rate",
+            "current_slot_num",
+            "flag_umap_async",
+            "GLOBAL_UMAP_LANDMARK_NUM",
+        )
+        + _GLOBAL_WAVE_KEYS,
+        "write": (
+            "cs_pca_bound_min",
+            "cs_pca_bound_max",
+            "cs_pca1",
+            "cs_pca2",
+            "cs_pca3",
+            "cs_pca_variance",
+            "cs_umap1",
+            "cs_umap2",
+            "cs_umap_isPending",
+        ),
+    },
+    {
+        "name": "extract_ss_scatter",
+        "function": extract_ss_scatter,
+        "read": (
+            "ss_index",
+            "ss_pca1",
+            "ss_pca2",
+            "ss_pca3",
+            "ss_umap1",
+            "ss_umap2",
+            "ss_peak",
+            "ss_similarity_to_ss",
+            "ss_similarity_to_cs",
+            "ss_ifr",
+            "ss_time_to_prev_ss",
+            "ss_time_to_next_ss",
+            "ss_time_to_prev_cs",
+            "ss_time_to_next_cs",
+            "ss_time",
+            "umap_enable",
+            "ss_pca1_index",
+            "ss_pca2_index",
+        ),
+        "write": (
+            "ss_scatter_mat",
+            "ss_scatter_list",
+            "ss_scatter1",
+            "ss_scatter2",
+            "ss_pca1_index",
+            "ss_pca2_index",
+        ),
+    },
+    {
+        "name": "extract_cs_scatter",
+        "function": extract_cs_scatter,
+        "read": (
+            "cs_index",
+            "cs_pca1",
+            "cs_pca2",
+            "cs_pca3",
+            "cs_umap1",
+            "cs_umap2",
+            "cs_peak",
+            "cs_similarity_to_ss",
+            "cs_similarity_to_cs",
+            "cs_ifr",
+            "cs_time_to_prev_ss",
+            "cs_time_to_next_ss",
+            "cs_time_to_prev_cs",
+            "cs_time_to_next_cs",
+            "cs_time",
+            "umap_enable",
+            "cs_pca1_index",
+            "cs_pca2_index",
+        ),
+        "write": (
+            "cs_scatter_mat",
+            "cs_scatter_list",
+            "cs_scatter1",
+            "cs_scatter2",
+            "cs_pca1_index",
+            "cs_pca2_index",
+        ),
+    },
+]
+
+
+class RefreshGraph:
+    def __init__(self, stages=None):
+        if stages is None:
+            stages = refresh_stages
+        self.stages = stages
+        self._fingerprint = {}
+        self._isStageValid = {}
+        self.reset()
+        return None
+
+    def reset(self):
+        # invalidate all the stages, the next run will be a full refresh
+        self._fingerprint.clear()
+        self._isStageValid.clear()
+        for stage in self.stages:
+            self._isStageValid[stage["name"]] = False
+        return 0
+
+    def run(self, _workingDataBase, skip_stages=()):
+        """
+        -> find the keys which have been changed since the last run
+        -> run the stages which read any changed key, in the order of the graph
+        -> the keys written by a stage are compared again for the downstream stages
+        -> the stages in skip_stages are not run but considered up to date
+        -> returns the list of the names of the stages which have been run
+        """
+        read_keys = set()
+        for stage in self.stages:
+            read_keys.update(stage["read"])
+        for key in read_keys:
+            self.update_fingerprint(_workingDataBase, key)
+        stages_run = []
+        for stage in self.stages:
+            if self._isStageValid[stage["name"]]:
+                continue
+            if stage["name"] in skip_stages:
+                self._isStageValid[stage["name"]] = True
+                continue
+            stage["function"](_workingDataBase)
+            self._isStageValid[stage["name"]] = True
+            stages_run.append(stage["name"])
+            # the downstream stages are dirty only if the output has actually changed
+            for key in read_keys.intersection(stage["write"]):
+                self.update_fingerprint(_workingDataBase, key)
+        return stages_run
+
+    def update_fingerprint(self, _workingDataBase, key):
+        # a changed key invalidates every stage which reads it right away, so if a
+        # stage raises, the stages after it are still invalid on the next run
+        fingerprint = fingerprint_value(
+            _workingDataBase.get(key, None),
+            by_identity=(key in FINGERPRINT_BY_IDENTITY_KEYS),
+        )
+        if (key in self._fingerprint) and (self._fingerprint[key] == fingerprint):
+            return False
+        self._fingerprint[key] = fingerprint
+        for stage in self.stages:
+            if key in stage["read"]:
+                self._isStageValid[stage["name"]] = False
+        return True
+
+
+# UNDO/REDO HISTORY
+class UndoRedoLog:
+    """
+    -> history of the spike indices of the current slot as an operation log
+    -> only the spikes of the current step are kept in full, as sorted indices, every
+       step in the log keeps the indices which flipped with respect to the step before
+    -> undo and redo flip those indices back in the bool arrays of _workingDataBase,
+       so their cost depends on the number of changed spikes, not on the slot length
+    -> the oldest steps are dropped once the log is longer than max_length
+    """
+
+    keys = ("ss_index", "cs_index_slow", "cs_index")
+
+    def __init__(self, max_length=200):
+        self.max_length = int(max_length)
+        self.reset()
+        return None
+
+    def reset(self, data_size=0):
+        self.data_size = int(data_size)
+        self.index = -1
+        self._steps = []
+        self._state = {}
+        self._index_bool = {}
+        return 0
+
+    def get_length(self):
+        if self.index < 0:
+            return 0
+        return len(self._steps) + 1
+
+    def add(self, _workingDataBase):
+        state = {key: np.flatnonzero(_workingDataBase[key]) for key in self.keys}
+        if self.index >= 0:
+            # a new step discards the steps which could have been redone
+            del self._steps[self.index :]
+            self._steps.append(
+                {key: np.setxor1d(state[key], self._state[key]) for key in self.keys}
+            )
+        self._state = state
+        self._index_bool = {key: _workingDataBase[key] for key in self.keys}
+        self.index += 1
+        if len(self._steps) >= self.max_length:
+            del self._steps[: len(self._steps) - self.max_length + 1]
+            self.index = len(self._steps)
+        return 0
+
+    def undo(self, _workingDataBase):
+        if self.index <= 0:
+            return 0
+        self.flip(_workingDataBase, self._steps[self.index - 1])
+        self.index -= 1
+        return 0
+
+    def redo(self, _workingDataBase):
+        if self.index >= len(self._steps):
+            return 0
+        self.flip(_workingDataBase, self._steps[self.index])
+        self.index += 1
+        return 0
+
+    def flip(self, _workingDataBase, step):
+        for key in self.keys:
+            index_bool = _workingDataBase[key]
+            # an edit which never made it to the log would make the flip wrong,
+            # restore the logged state first in that case; the arrays are edited in
+            # place only right before add, any other edit replaces them, so the
+            # identity of the array tells whether the log is up to date
+            if (index_bool is not self._index_bool.get(key)) or (
+                index_bool.size != self.data_size
+            ):
+                index_bool = lib.index_int_to_bool(self._state[key], self.data_size)
+                _workingDataBase[key] = index_bool
+                self._index_bool[key] = index_bool
+            index_bool[step[key]] = np.logical_not(index_bool[step[key]])
+            self._state[key] = np.setxor1d(self._state[key], step[key])
+        return 0
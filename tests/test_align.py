@@ -0,0 +1,113 @@
+"""
+-> regression test of the batched template alignment of psort.utils.signals_lib
+-> the reference implementation is the original per-CS np.correlate loop
+-> the FFT correlation matches np.correlate up to rounding, so a CS may be aligned
+   to another lag only where the two lags tie within that rounding
+"""
+
+import numpy as np
+
+from psort.utils import lib, signals_lib
+
+SAMPLE_RATE = 30000.0
+NUM_RECORDINGS = 50
+# relative to the largest correlation of the window
+CORR_RTOL = 1e-9
+
+
+def make_workingDataBase(rng, data_size, num_cs):
+    cs_index_slow = np.zeros((data_size), dtype=bool)
+    cs_index_slow[rng.integers(0, data_size, num_cs)] = True
+    cs_index_slow[[0, data_size - 1]] = True
+    _workingDataBase = {
+        "sample_rate": np.array([SAMPLE_RATE], dtype=np.float64),
+        "GLOBAL_CS_ALIGN_SSTEMPLATE_BEFORE": np.array([0.005], dtype=np.float32),
+        "GLOBAL_CS_ALIGN_SSTEMPLATE_AFTER": np.array([0.005], dtype=np.float32),
+        "GLOBAL_WAVE_TEMPLATE_SS_BEFORE": np.array([0.0005], dtype=np.float32),
+        "GLOBAL_WAVE_TEMPLATE_SS_AFTER": np.array([0.0005], dtype=np.float32),
+        "ch_data_ss": rng.standard_normal(data_size),
+        "ss_wave_template": rng.standard_normal(31),
+        "cs_index_slow": cs_index_slow,
+    }
+    return _workingDataBase
+
+
+def get_window_len(_workingDataBase):
+    window_len_before = int(
+        (
+            _workingDataBase["GLOBAL_CS_ALIGN_SSTEMPLATE_BEFORE"][0]
+            + _workingDataBase["GLOBAL_WAVE_TEMPLATE_SS_BEFORE"][0]
+        )
+        * SAMPLE_RATE
+    )
+    window_len_after = int(
+        (
+            _workingDataBase["GLOBAL_CS_ALIGN_SSTEMPLATE_AFTER"][0]
+            + _workingDataBase["GLOBAL_WAVE_TEMPLATE_SS_AFTER"][0]
+        )
+        * SAMPLE_RATE
+    )
+    window_len_temp = int(
+        _workingDataBase["GLOBAL_WAVE_TEMPLATE_SS_AFTER"][0] * SAMPLE_RATE
+    )
+    return window_len_before, window_len_after, window_len_temp
+
+
+def test_correlate_template():
+    rng = np.random.default_rng(0)
+    waveform = rng.standard_normal((100, 331))
+    template = rng.standard_normal(31)
+    corr = lib.correlate_template(waveform, template)
+    for counter_row in range(waveform.shape[0]):
+        corr_ref = np.correlate(waveform[counter_row, :], template, "full")
+        np.testing.assert_allclose(
+            corr[counter_row, :],
+            corr_ref,
+            rtol=0,
+            atol=CORR_RTOL * np.max(np.abs(corr_ref)),
+        )
+
+
+def test_align_cs_wrt_ss_temp():
+    rng = np.random.default_rng(1)
+    for _ in range(NUM_RECORDINGS):
+        data_size = int(rng.integers(5000, 50000))
+        _workingDataBase = make_workingDataBase(rng, data_size, data_size // 1000)
+        cs_index_slow_int = np.flatnonzero(_workingDataBase["cs_index_slow"])
+        signals_lib.align_cs_wrt_ss_temp(_workingDataBase)
+        window_len_before, window_len_after, window_len_temp = get_window_len(
+            _workingDataBase
+        )
+        _data_ss = _workingDataBase["ch_data_ss"]
+        _temp = _workingDataBase["ss_wave_template"]
+        # the edges are rejected as before
+        cs_index_slow_ref = np.zeros((data_size), dtype=bool)
+        cs_ind_ref = []
+        cs_ind_ref_tie = []
+        for _cs_slow_index in cs_index_slow_int:
+            if (_cs_slow_index < window_len_before) or (
+                _cs_slow_index > (data_size - window_len_after)
+            ):
+                continue
+            cs_index_slow_ref[_cs_slow_index] = True
+            search_win_inds = np.arange(
+                _cs_slow_index - window_len_before, _cs_slow_index + window_len_after
+            )
+            corr = np.correlate(_data_ss[search_win_inds], _temp, "full")
+            offset = _cs_slow_index - window_len_before - window_len_temp + 2
+            cs_ind_ref.append(np.argmax(corr) + offset)
+            # the lags which tie with the maximum within the rounding of the FFT
+            cs_ind_ref_tie.append(
+                np.flatnonzero(corr >= np.max(corr) - CORR_RTOL * np.max(np.abs(corr)))
+                + offset
+            )
+        np.testing.assert_array_equal(
+            _workingDataBase["cs_index_slow"], cs_index_slow_ref
+        )
+        cs_ind = np.flatnonzero(_workingDataBase["cs_index"])
+        # a deterministic tie-break: every reference CS has an aligned CS among its
+        # tied lags, and there is no other aligned CS
+        cs_ind_ref = np.unique(cs_ind_ref)
+        for counter_cs in range(len(cs_ind_ref_tie)):
+            assert np.any(np.isin(cs_ind_ref_tie[counter_cs], cs_ind))
+        assert cs_ind.size == cs_ind_ref.size